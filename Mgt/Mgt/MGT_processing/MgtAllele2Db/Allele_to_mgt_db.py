@@ -8,7 +8,8 @@ import argparse
 import math
 import importlib.util
 import re
-from operator import itemgetter
+import copy
+import traceback
 from collections import OrderedDict
 from multiprocessing import Pool
 
@@ -22,11 +23,23 @@ from time import sleep as sl
 
 from MGT_processing.MgtAllele2Db.UpdateScripts.addAlleles import addAlleles
 from MGT_processing.MgtAllele2Db.UpdateScripts.addSnps import addSnpMutsToDb
-from MGT_processing.MgtAllele2Db.UpdateScripts.addAllelicProfiles import addApForScheme
+from MGT_processing.MgtAllele2Db.UpdateScripts.addAllelicProfiles import addApForScheme, genProfileHash, PROFILE_HASH_COL
 from MGT_processing.MgtAllele2Db.UpdateScripts.addClonalComplexes import doAddClonalComplexes
 from MGT_processing.MgtAllele2Db.UpdateScripts.addIsolates import addInfo
 from MGT_processing.MgtAllele2Db.UpdateScripts.addHgts import addTheHstMatrix
 from MGT_processing.MgtAllele2Db.convert_metadata import convert_from_enterobase, convert_from_mgt
+from MGT_processing.Reads2MGTAlleles.snp_mask import mask_high_snp_regions
+from MGT_processing.MgtAllele2Db.ap_matrix import ApMatrix, encode_allele
+from MGT_processing.MgtAllele2Db.allele_store import AlleleStore, store_path
+from MGT_processing.MgtAllele2Db.counters import next_allele, next_neg_allele, next_st, next_dst, locus_allele_counters, \
+    note_pos_allele
+from MGT_processing.MgtAllele2Db.cc_merges import canonical_ready, merged_ids
+from MGT_processing.MgtAllele2Db.allele_compare import ref_snps, get_muts_per_locus
+
+ap_matrices = {}  # {level: ApMatrix} allele profile matrix caches used by get_matches
+profile_hash_tables = {}  # {ap table 0 name: has profile_hash column} used by detect_exact_ap_matches
+allele_stores = {}  # {store path: AlleleStore} allele sequence stores used by match_or_assign_alleles
+ap_st_maps = {}  # {level: [max AP id, {AP id: st}, {st: [AP ids]}]} used by remove_sts_with_nonmatching_dsts
 
 
 """
@@ -88,7 +101,7 @@ def get_table_nos(conn, args):
 
             cur.close()
 
-            locus_columns = [x[0] for x in res if (x[0] not in ["st","dst","id","main_id","date_created","date_modified"]) and ( not x[0].startswith("cc") and not x[0].endswith("id"))]
+            locus_columns = [x[0] for x in res if (x[0] not in ["st","dst","id","main_id","date_created","date_modified",PROFILE_HASH_COL]) and ( not x[0].startswith("cc") and not x[0].endswith("id"))]
 
             tables[lev][no] = locus_columns
 
@@ -128,7 +141,7 @@ def get_min_scheme(connection, args):
 
 
 def get_allele_profile(connection, lev, NewPosAlleles, NewNegAlleles, Allloc, PosMatches, ZeroCallAlleles,
-                       no_tables, all_assignments, args, nodash_to_dash, start_time,posalleleseqs,negalleleseqs,
+                       no_tables, all_assignments, args, nodash_to_dash, start_time,
                        ccb1="", ccb2="", ccsubsetlevs=()):
     """
 
@@ -218,7 +231,7 @@ def get_allele_profile(connection, lev, NewPosAlleles, NewNegAlleles, Allloc, Po
     #  this will be needed for loci where positive allele wasn't in ref allele fasta in reads->alleles OR
     #  where the allele is negative
     #  OTHERWISE if no match assign new (st or dst)
-    profile, new_allele_outdict,posalleleseqs,negalleleseqs = match_or_assign_alleles(lev, NewPosAlleles, NewNegAlleles,posalleleseqs,negalleleseqs,
+    profile, new_allele_outdict = match_or_assign_alleles(lev, NewPosAlleles, NewNegAlleles,
                                                           profile, loci_list,no_tables, connection, args)
 
     if args.timing:
@@ -247,7 +260,7 @@ def get_allele_profile(connection, lev, NewPosAlleles, NewNegAlleles, Allloc, Po
         sys.exit("some loci are missing from profile: {}".format(",".join(missing)))
 
     else:
-        return profile, all_assignments, new_allele_outdict,posalleleseqs,negalleleseqs
+        return profile, all_assignments, new_allele_outdict
 
 
 def retrieve_alleles_to_compare(connection, lev, Allloc, loci_list, to_process, table_nos, args, nodash_to_dash,
@@ -373,14 +386,14 @@ def get_locus_allele_freqs_in_higher_cc(lev, ccb1, ccb2, to_process, locuslist,
         if ccb1 in (None, "", "None", "0", 0) and ccb2 in (None, "", "None", "0", 0):
             return None, None, []
         elif ccb1 in (None, "", "None", "0", 0):
-            cclisb2 = rec_get_merge_cclis([str(ccb2)], 1, lev - ccb2lev, connection, args)
+            cclisb2 = get_merged_ccs([str(ccb2)], lev - ccb2lev, connection, args)
             outp = """ WHERE ("cc1_{0}" IN ('{1}'))""".format(lev - ccb2lev, cclisb2)
         elif ccb2 in (None, "", "None", "0", 0):
-            cclisb1 = rec_get_merge_cclis([str(ccb1)], 1, lev - ccb1lev, connection, args)
+            cclisb1 = get_merged_ccs([str(ccb1)], lev - ccb1lev, connection, args)
             outp = """ WHERE ("cc1_{0}" IN ('{1}'))""".format(lev - ccb1lev, cclisb1)
         else:
-            cclisb1 = rec_get_merge_cclis([str(ccb1)], 1, lev - ccb1lev, connection, args)
-            cclisb2 = rec_get_merge_cclis([str(ccb2)], 1, lev - ccb2lev, connection, args)
+            cclisb1 = get_merged_ccs([str(ccb1)], lev - ccb1lev, connection, args)
+            cclisb2 = get_merged_ccs([str(ccb2)], lev - ccb2lev, connection, args)
             outp = """ WHERE ("cc1_{0}" IN ('{1}') OR "cc1_{2}" IN ('{3}'))""".format(lev - ccb1lev, cclisb1,
                                                                                       lev - ccb2lev, cclisb2)
 
@@ -476,55 +489,57 @@ def get_locus_allele_freqs_in_higher_cc(lev, ccb1, ccb2, to_process, locuslist,
 
     return all_alleles, pos_alleles, matching_st_ids
 
-def get_allele_seqs(args,conn,NewPosAlleles,NewNegAlleles,posalleleseqs,negalleleseqs,lev,table_nos,loci_list):
+def get_allele_store(args):
+    """
+    :param args: input args (allele store is in args.allele_store)
+    :return: AlleleStore of the app (opened once per run)
+    """
+    storefile = store_path(args.allele_store, args.appname)
+    if storefile not in allele_stores:
+        allele_stores[storefile] = AlleleStore(storefile)
+    return allele_stores[storefile]
+
 
+def sync_allele_store(args,conn,NewPosAlleles,NewNegAlleles,lev,loci_list):
+    """
+    bring the allele store up to date with the allele fasta files of loci with new alleles in the current level
+    (only alleles appended to a file since the last run are read)
+    :return: AlleleStore
+    """
 
     time1 = time.time()
     loci_to_get = list(NewPosAlleles.keys()) + list(NewNegAlleles.keys())
     loci_to_get = [x for x in loci_to_get if x in loci_list]
     # print(loci_to_get)
-    combined_locils = []
-    loci_alleles = {}
 
     sqlcommand = """SELECT locus_id,file_location FROM "{}_allele" WHERE "identifier" = '1' AND "locus_id" in ('{}');""".format(
         args.appname, "','".join(loci_to_get))
 
     files = sqlquery_to_outls(conn, sqlcommand)
     files = {x[0]: "/" + x[1] for x in files}  # {locus name: fasta file path}
-    print("\t\tget_allele_seqs sql query".format(lev), (" --- %s seconds ---" % (time.time() - time1)))
+    print("\t\tsync_allele_store sql query".format(lev), (" --- %s seconds ---" % (time.time() - time1)))
     time1 = time.time()
-    # posallelesseqs = {}
-    # negallelesseqs = {}
+    store = get_allele_store(args)
     for locus in files:
-        if locus not in posalleleseqs:
-            if ":" in files[locus]:
-                file = files[locus].split(":")[0] + ".fasta"
-            else:
-                file = files[locus]
-            # print(file)
-            if not path.exists(file):
-                sys.exit("{} allele file does not exist at {}".format(locus,file))
-            alleles = SeqIO.parse(file, "fasta")
-            posalleleseqs[locus] = {}
-            negalleleseqs[locus] = {}
-            for allele in alleles:
-                allelenumber = allele.id.split(":")[-1]
-                if "-" not in allelenumber:
-                    posalleleseqs[locus][allelenumber] = str(allele.seq)
-                else:
-                    negalleleseqs[locus][allelenumber] = str(allele.seq)
-    print("\t\tget_allele_seqs loop".format(lev), (" --- %s seconds ---" % (time.time() - time1)))
+        if ":" in files[locus]:
+            file = files[locus].split(":")[0] + ".fasta"
+        else:
+            file = files[locus]
+        # print(file)
+        if not path.exists(file):
+            sys.exit("{} allele file does not exist at {}".format(locus,file))
+        store.sync_locus(locus, file)
+    print("\t\tsync_allele_store loop".format(lev), (" --- %s seconds ---" % (time.time() - time1)))
 
-    return posalleleseqs,negalleleseqs
+    return store
 
-def match_or_assign_alleles(lev, NewPosAlleles, NewNegAlleles,posalleleseqs,negalleleseqs, assignments,
+def match_or_assign_alleles(lev, NewPosAlleles, NewNegAlleles, assignments,
                             loci_list,no_tables, connection, args):
     """
     match any unmatched alleles to current db
     this will be needed for loci where positive allele wasn't in ref allele fasta in reads->alleles OR
     where the allele is negative
     OTHERWISE if no match assign new (st or dst)
-    :param alleles: dictionary of {locus:{allele:allele seq}}
     :param lev: MGT level
     :param NewPosAlleles: dictionary of alleles not matching reads to alleles reference alleles file with no missing data
     :param NewNegAlleles: dictionary of alleles not matching reads to alleles reference alleles file with missing data
@@ -538,11 +553,11 @@ def match_or_assign_alleles(lev, NewPosAlleles, NewNegAlleles,posalleleseqs,nega
     """
     # Add exact matches to pos alleles to assignments and record novel positive alleles that need naming in newpos_todo
     time1 = time.time()
-    posalleleseqs,negalleleseqs = get_allele_seqs(args,connection,NewPosAlleles,NewNegAlleles,posalleleseqs,negalleleseqs,lev,no_tables,loci_list)
+    store = sync_allele_store(args,connection,NewPosAlleles,NewNegAlleles,lev,loci_list)
     if args.timing:
         print("\tget alleles".format(lev), (" --- %s seconds ---" % (time.time() - time1)))
     time1 = time.time()
-    assignments, newpos_todo = exactmatch(posalleleseqs, NewPosAlleles, assignments, loci_list)
+    assignments, newpos_todo = exactmatch(store, NewPosAlleles, assignments, loci_list)
 
     if args.timing:
         print("\tassign_alleles_exact".format(lev), (" --- %s seconds ---" % (time.time() - time1)))
@@ -552,7 +567,7 @@ def match_or_assign_alleles(lev, NewPosAlleles, NewNegAlleles,posalleleseqs,nega
         # print(newpos_todo)
         return "newst",""
 
-    outcomes = get_negmatches_sql(posalleleseqs,negalleleseqs, NewNegAlleles, assignments, loci_list, newpos_todo,
+    outcomes = get_negmatches_sql(store, NewNegAlleles, assignments, loci_list, newpos_todo,
                                   args,connection)
     # if lev == 2 or lev =="2":
     #     print(outcomes)
@@ -564,19 +579,19 @@ def match_or_assign_alleles(lev, NewPosAlleles, NewNegAlleles,posalleleseqs,nega
     #     print(assignments,new_allele_outdict)
     if args.timing:
         print("\tassign_alleles_all".format(lev), (" --- %s seconds ---" % (time.time() - time1)))
-    return assignments, new_allele_outdict,posalleleseqs,negalleleseqs
+    return assignments, new_allele_outdict
 
 
 ## ALLELE PROCESSING ###
 
 
-def exactmatch(alleles, NewPosAlleles, assignments, loci_list):
+def exactmatch(store, NewPosAlleles, assignments, loci_list):
     """
     Takes positive alleles that were not present in set of alleles used for reads2alleles script and:
     checks if they exist in the current DB and assigns if they do
     if completely novel add to dict of new pos alleles
 
-    :param alleles: dictionary of {locus:{allele:allele seq}}
+    :param store: AlleleStore synced for the loci in NewPosAlleles
     :param NewPosAlleles: dictionary of {locus:sequence_of_novel_pos_allele}
     :param assignments: dictionary of loci already assigned allele numbers: {locus:allele_number}
     :param loci_list: list of loci for current level
@@ -588,13 +603,11 @@ def exactmatch(alleles, NewPosAlleles, assignments, loci_list):
         # print(locus)
         if locus not in assignments:
             if locus in loci_list:
-                for allele in alleles[locus]:
-                    if "-" not in allele:
-                        alleleseq = alleles[locus][allele]
-                        if alleleseq == NewPosAlleles[locus]:
-                            assignments[locus] = allele
-                            # print(locus,allele)
-                            # print("match",locus,allele)
+                allele = store.find(locus, NewPosAlleles[locus])
+                if allele is not None:
+                    assignments[locus] = allele
+                    # print(locus,allele)
+                    # print("match",locus,allele)
                 if locus not in assignments:
                     newloci_todo[locus] = NewPosAlleles[locus]
                 # if locus == "STM1332_STMMW_13401":
@@ -606,25 +619,6 @@ def exactmatch(alleles, NewPosAlleles, assignments, loci_list):
 
     return assignments, newloci_todo
 
-def get_muts_per_locus(newnegs,alleles,newseq,muts,matchallelelist):
-    #TODO only return newnegs if input alleles are negative (i.e. no matches to positive alleles)
-    match = False
-    for existlocus in alleles:
-        oldseq = str(alleles[existlocus])
-        if len(newseq) == len(oldseq):
-            anymut = 'no'
-            for pos in range(len(newseq)):
-                if newseq[pos] != oldseq[pos] and newseq[pos] not in ["N", "-"] and oldseq[pos] not in [
-                    "N", "-"]:
-                    anymut = 'yes'
-            if anymut == 'no':
-                if "-" not in existlocus:
-                    matchallelelist.append(existlocus)
-                allele = existlocus.split("_")[0].strip("-")
-                newnegs.append(("", allele, newseq, muts))
-                match = True
-    return newnegs,muts,matchallelelist,match
-
 def get_muts(newnegs,alleles,locus,newseq,muts,matchallelelist):
     #TODO only return newnegs if input alleles are negative (i.e. no matches to positive alleles)
     match = False
@@ -644,7 +638,15 @@ def get_muts(newnegs,alleles,locus,newseq,muts,matchallelelist):
                 match = True
     return newnegs,muts,matchallelelist,match
 
-def newloctype(combined_todo,posalleles,negalleles,args):
+def newloctype(combined_todo,posalleles,negalleles,posids,args):
+    """
+    :param combined_todo: new allele sequence
+    :param posalleles: {allele:seq} positive alleles of the same length as the new allele (plus allele "1")
+    :param negalleles: {allele:seq} negative alleles of the same length as the new allele
+    :param posids: all positive allele numbers of the locus
+    :param args: input args
+    :return: outcome ("type of allele assignment", possible matching allele, newseq, muts)
+    """
     muts = []
     newnegs = []
     newseq = str(combined_todo)
@@ -659,12 +661,7 @@ def newloctype(combined_todo,posalleles,negalleles,args):
             oldseq = posalleles["1"]
 
             #  Get SNPs from allele relative to "1"/ref allele
-            for pos in range(len(oldseq)):
-                if newseq[pos] != oldseq[pos] and newseq[pos] not in ["N", "-"] and oldseq[pos] not in ["N",
-                                                                                                        "-"]:
-                    muts.append((oldseq[pos], str(pos), newseq[pos]))
-                    # if locus == "STM0777":
-                    #     print(muts)
+            muts += ref_snps(newseq, oldseq)
             if args.printinfo:
                 print(muts)
 
@@ -697,7 +694,7 @@ def newloctype(combined_todo,posalleles,negalleles,args):
         ##check if neg match is contradicted by pos match to same allele and remove neg match if so.
         nnewnegs = []
         for match in newnegs:  # a match to a
-            if match[1] in posalleles:
+            if match[1] in posids:
                 if match[1] not in matchallelelist:
                     pass
                 else:
@@ -731,7 +728,7 @@ def newloctype(combined_todo,posalleles,negalleles,args):
                     outcome = ("new neg allele", allele, newseq, muts)
                 else:
                     ## check if negative matches have any pos allele associated if no then assign to neg number otherwise next pos
-                    outcome = check_locus_allele_freqs(posalleles, allele_hits, newseq, muts)
+                    outcome = check_locus_allele_freqs(posids, allele_hits, newseq, muts)
             else:
                 if "N" in newseq:
                     ##this means new allele is negative and only matches one other allele number (could be many neg +pos)
@@ -744,11 +741,11 @@ def newloctype(combined_todo,posalleles,negalleles,args):
                     outcome = ("new pos allele", allele, newseq, muts)
     return outcome
 
-def get_negmatches_sql(posalleles,negalleles, NewNegAlleles, assignments, loci_list, newloci_todo, args,conn):
+def get_negmatches_sql(store, NewNegAlleles, assignments, loci_list, newloci_todo, args,conn):
     """
     Determine what type of allele the locus should be called as after masking high snp regions
     and calling SNPs (relative to ref allele "1") by matching seqs to existing allele seqs in DB
-    :param alleles: dictionary of {locus:{allele:allele seq}}
+    :param store: AlleleStore synced for the loci in NewNegAlleles and newloci_todo
     :param NewNegAlleles: dictionary of {locus:sequence_of_any allele with missing sequence from reads2alleles}
     :param assignments: dictionary of loci already assigned allele numbers: {locus:allele_number}
     :param sizes: dict of locus sizes
@@ -776,12 +773,10 @@ def get_negmatches_sql(posalleles,negalleles, NewNegAlleles, assignments, loci_l
         if locus not in assignments:  # If locus not already assigned allele
             if locus in loci_list:  # If locus is in the current level allele profile
                 #  Check if new negative allele matches other negative alleles and add to assignments and done list
-                for allele in negalleles[locus]:
-                    newallele = NewNegAlleles[locus]
-                    oldallele = negalleles[locus][allele]
-                    if newallele == oldallele:
-                        assignments[locus] = allele
-                        done.append(locus)
+                allele = store.find(locus, NewNegAlleles[locus], negative=True)
+                if allele is not None:
+                    assignments[locus] = allele
+                    done.append(locus)
 
     print("\t\tget_negmatches_sql firstloop", (" --- %s seconds ---" % (time.time() - time2)))
 
@@ -793,7 +788,10 @@ def get_negmatches_sql(posalleles,negalleles, NewNegAlleles, assignments, loci_l
     locus_processing_list = [x for x in combined_todo if x not in assignments]
     locus_processing_list = [x for x in locus_processing_list if x in loci_list]
     locus_processing_list = [x for x in locus_processing_list if x not in done]
-    mpinputs = [(combined_todo[locus],posalleles[locus],negalleles[locus],args) for locus in locus_processing_list]
+    mpinputs = []
+    for locus in locus_processing_list:
+        posalleles, negalleles = store.length_bucket(locus, len(combined_todo[locus]))
+        mpinputs.append((combined_todo[locus], posalleles, negalleles, store.positive_ids(locus), args))
 
     # newloctype(locus,combined_todo,posalleles,negalleles,args)
     time2 = time.time()
@@ -916,19 +914,14 @@ def sort_outcomes_and_assign(outcome, allele_assignments, connection, args):
     :return: updated allele assignments and new allele info in format {locus:(locus,allele assignment,sequence,snps)}
     """
     time1 = time.time()
-    # get next allele number and next dst for each allele for loci in outcome
-    next_pos_dict, next_neg_dict = get_max_loci_dict(outcome, connection, args)
-    print("\t\tsort_outcomes_and_assign get max", (" --- %s seconds ---" % (time.time() - time1)))
-    time1 = time.time()
     new_allele_outdict = {}
     for locus in outcome:
         if outcome[locus][1] == "0":
             allele_assignments[locus] = "0"
         else:
 
-            # assign new number based on outcome info
-            newno = assign_new_allele_names(locus, outcome[locus][0], outcome[locus][1], next_pos_dict[locus],
-                                            next_neg_dict[locus])
+            # assign new number based on outcome info (numbers claimed from the counters table)
+            newno = assign_new_allele_names(locus, outcome[locus][0], outcome[locus][1], connection, args)
 
             allele_assignments[locus] = str(newno)  # add assignment to others
 
@@ -939,19 +932,23 @@ def sort_outcomes_and_assign(outcome, allele_assignments, connection, args):
     return allele_assignments, new_allele_outdict
 
 
-def assign_new_allele_names(locus, type, negallele, nextpos, nextneg_dict):
+def assign_new_allele_names(locus, type, negallele, connection, args):
     """
 
     :param locus: locus being named
     :param type: positive, negative or novel negative - what type of assignment is happening
     :param negallele: if it is a neg allele which pos allele is it based on
-    :param existing_alleles: list of existing alleles for that locus
+    :param connection: sql psycopg2 connection object
+    :param args: input argparse args (numbers are only read, not claimed, in --query runs)
     :return: next allele number in the sequence
     """
+    claim = not args.query
 
     if type == "novel pos allele":
         # assign new pos allele i.e. 8 where 7 is current highest
-        newallele = nextpos
+        newallele = next_allele(connection, args.appname, locus, claim=claim)
+        if claim:
+            note_pos_allele(connection, args.appname, locus, newallele)
 
         return newallele
 
@@ -961,10 +958,12 @@ def assign_new_allele_names(locus, type, negallele, nextpos, nextneg_dict):
         # (current model where pos must exist for negs to exist excludes this)
         newposallele = negallele.split("_")[0].replace("-", "")
 
-        if int(newposallele) < int(nextpos):
+        if int(newposallele) < next_allele(connection, args.appname, locus, claim=False):
             newallele = newposallele
         else:
-            newallele = nextpos
+            newallele = next_allele(connection, args.appname, locus, claim=claim)
+        if claim:
+            note_pos_allele(connection, args.appname, locus, newallele)
 
         # TODONE need to check if pos already exists for neg allele hit - if so then assign new pos allele no.
         # Negative matches where there is a positive allele that doesn't match are removed earlier so above TD is ok
@@ -975,7 +974,7 @@ def assign_new_allele_names(locus, type, negallele, nextpos, nextneg_dict):
         # assign new negative allele i.e. -8_3 where -8_2 or 8 exists
         posallele = negallele.split("_")[0].replace("-", "")
 
-        nextneg = nextneg_dict[posallele]
+        nextneg = next_neg_allele(connection, args.appname, locus, posallele, claim=claim)
 
         newallele = "-" + str(posallele) + "_" + str(nextneg)
 
@@ -984,7 +983,7 @@ def assign_new_allele_names(locus, type, negallele, nextpos, nextneg_dict):
     elif type == "novel neg allele":
         # assign neg allele to new overall allele i.e. -8.1 where 8 does not exist
         # (current model where pos must exist for negs to exist excludes this)
-        newallele = nextpos
+        newallele = next_allele(connection, args.appname, locus, claim=claim)
         newallele = "-" + str(newallele) + "_1"
 
         return newallele
@@ -1000,7 +999,7 @@ def check_locus_allele_freqs(locusalleles,poshits, newseq, muts):
     """
     # iterate over new allele matches and related strain allele matches, look for any match
     match = []
-    existingalleles = list(locusalleles.keys())
+    existingalleles = list(locusalleles)
 
     notexistingpos = [x for x in poshits if x not in existingalleles]
 
@@ -1014,112 +1013,47 @@ def check_locus_allele_freqs(locusalleles,poshits, newseq, muts):
         return ("new pos allele", newpos, newseq, muts)
 
 
-def mask_high_snp_regions(locus, recon_locus, ref_locus, window_size, snp_limit):
-    """
-    compare new allele seq to "ref" allele to identify and mask(with Ns) regions with high snp density
-    which can be caused by BLAST errors where indels are present in query seq
-
-    :param locus: Not currently used (useful for debug)
-    :param recon_locus: sequence to be checked
-    :param ref_locus: sequence of 'ref' locus
-    :param window_size: size of rolling window to check SNP frequency within
-    :param snp_limit: limit of number of SNPs within that window
+## ST/CC CALLING ###
 
-    :return: input sequence to be checked with regions with elevated SNP counts masked if necessary
+def canonical_merge_ids(ids, table, conn):
     """
-
-    if len(recon_locus) != len(ref_locus):  # comparison with reference will break if lengths not the same
-        return recon_locus
-
-    halfwindow = int(window_size / 2)
-    mutpos = []
-    outlocus = list(str(recon_locus))  # Convert test sequence into list of letters
-    for pos in range(len(recon_locus)):
-        if recon_locus[pos] != ref_locus[pos] and recon_locus[pos] not in ["N", "-"] and ref_locus[pos] not in ["N",
-                                                                                                                "-"]:
-            mutpos.append(
-                "X")  # if the same position doesn't match (i.e. a SNP) and that missmatch is not caused by an N or an indel
-        else:
-            mutpos.append("M")  # If ref and new seq are the same
-
-    #  Get list of ranges allowing for window length over whole locus
-    for x in range(halfwindow, len(ref_locus) - halfwindow):
-        window = mutpos[x - halfwindow:x + halfwindow]  # get window list of Match(M) or SNP(X)
-        if window.count("X") > snp_limit:
-            # if num of SNPS greater than limit mask all positions in current window
-            for pos in range(x - halfwindow, x + halfwindow):
-                outlocus[pos] = "N"  # change to N
-    outlocus = "".join(outlocus)
-    return outlocus
+    :param ids: cc/odc identifiers (str)
+    :param table: cc table
+    :param conn: psycopg2 connection
+    :return: identifiers of all ccs merged with ids from the canonical_id column, None if the table has no filled
+    canonical_id column (backfill_canonical_ids.py not run)
+    """
+    cur = conn.cursor()
+    try:
+        if not canonical_ready(cur, table):
+            return None
+        return merged_ids(cur, table, ids)
+    finally:
+        cur.close()
 
 
-def get_max_loci_dict(outcome, connection, args):
+def get_merged_ccs(ccls, level, conn, args):
     """
-    get next allele number and next dst for each allele for loci in outcome
-    :param outcome: loci with unresolved alleles in input seqs
-    :param connection: sql psycopg2 connection object
-    :param args: input argparse args
-    :return: next_pos_dict {locus:next allele number} & next_neg_dict {locus:{allele:next dst number for allele}}
+    :param ccls: cc identifiers (str)
+    :param level: MGT level
+    :return: ccls and identifiers of all ccs merged with them
     """
-
-    time1 = time.time()
-    get_max_for_loci = []
-    for i in outcome:
-        if outcome[i][1] != "0":
-            get_max_for_loci.append(i)
-    print("\t\tget_max_loci_dict parse outcome", (" --- %s seconds ---" % (time.time() - time1)))
-    time1 = time.time()
-    #  Get allele numbers for all loci in  get_max_for_loci
-    locuslisstr = "('" + "','".join(get_max_for_loci) + "')"
-    sqlquery = """Select * FROM "{}_allele" WHERE "locus_id" IN {};""".format(args.appname, locuslisstr)
-    tablels = sqlquery_to_outls(connection, sqlquery)
-    print("\t\tget_max_loci_dict run sql query", (" --- %s seconds ---" % (time.time() - time1)))
-    time1 = time.time()
-    #  process sql out and store allele numbers as a list for each locus
-    loci_allele_dict = {}
-    for line in tablels:
-        loc = line[-1]
-        if loc not in loci_allele_dict:
-            loci_allele_dict[loc] = [line[1]]
-        else:
-            loci_allele_dict[loc].append(line[1])
-    print("\t\tget_max_loci_dict first loop", (" --- %s seconds ---" % (time.time() - time1)))
-    time1 = time.time()
-    next_pos_dict = {}
-    next_neg_dict = {}
-
-    for locus in loci_allele_dict:
-        #  For each locus get maximum allele number after converting all alleles to positive
-        next_neg_dict[locus] = {}
-        allelelist = loci_allele_dict[locus]
-        # pos = [x.split("_")[0].replace("-", "") for x in allelelist if x != '']
-        alleledict = {}
-        for allele in allelelist:
-            allelesub = allele.replace("-","").split("_")
-            pallele = allelesub[0]
-            if pallele != '':
-                if pallele not in alleledict:
-                    alleledict[pallele] = "1"
-
-                if len(allelesub) > 1:
-                    negallele = int(allelesub[1])
-                    if negallele >= int(alleledict[pallele]):
-                            alleledict[pallele] = str(negallele+1)
-
-
-        # assign next allele number
-        posnext = max(map(int, list(alleledict.keys()))) + 1
-
-
-        next_neg_dict[locus] = dict(alleledict)
-        # if posnext == 1:
-        #     input("posnext Press Enter to continue...{}".format(locus))
-        next_pos_dict[locus] = str(posnext)
-    print("\t\tget_max_loci_dict second loop", (" --- %s seconds ---" % (time.time() - time1)))
-    return next_pos_dict, next_neg_dict
+    merged = canonical_merge_ids(ccls, "{0}_cc1_{1}".format(args.appname, level), conn)
+    if merged is None:
+        return rec_get_merge_cclis(ccls, 1, level, conn, args)
+    return list(set(ccls + merged))
 
 
-## ST/CC CALLING ###
+def get_merged_odcs(odcls, level, conn, args):
+    """
+    :param odcls: odc identifiers (str)
+    :param level: odc table number
+    :return: odcls and identifiers of all odcs merged with them
+    """
+    merged = canonical_merge_ids(odcls, "{0}_cc2_{1}".format(args.appname, level), conn)
+    if merged is None:
+        return rec_get_merge_odclis(odcls, 1, level, conn, args)
+    return list(set(odcls + merged))
 
 def rec_get_merge_cclis(ccls, newmerge, level, conn, args):
     if newmerge == 0:
@@ -1216,14 +1150,14 @@ def get_next_dst(connection, args, level, st):
     :return: next dst
     """
 
-    #  select largest dst give the level and st
-    nextstquery = """SELECT MAX("dst") FROM "{}_ap{}_0" WHERE "st" = {};""".format(args.appname, level, st)
-
-    res = sqlquery_to_outls(connection, nextstquery)
     if args.query:
+        #  select largest dst give the level and st
+        nextstquery = """SELECT MAX("dst") FROM "{}_ap{}_0" WHERE "st" = {};""".format(args.appname, level, st)
+
+        res = sqlquery_to_outls(connection, nextstquery)
         dst = res[0][0]
     else:
-        dst = res[0][0] + 1  # get value and add 1 to result
+        dst = next_dst(connection, args.appname, level, st)  # claim from the counters table
 
     return dst
 
@@ -1231,14 +1165,7 @@ def get_next_dst(connection, args, level, st):
 def get_next_st(connection, args, level):
     if args.query:
         return 0
-    nextstquery = """SELECT MAX("st") FROM "{}_ap{}_0";""".format(args.appname, level)
-    res = sqlquery_to_outls(connection, nextstquery)
-    # print("CURRENT MAX ST",res)
-    if res[0][0] == None:
-        nextst=1
-    else:
-        nextst = res[0][0] + 1
-    return nextst
+    return next_st(connection, args.appname, level)  # claim from the counters table
 
 def match_existing_st_to_cc(st,level,odclev,odcdiffs,connection,args):
     """
@@ -1498,7 +1425,7 @@ def call_st_cc(stres, ccres, odcres, profile, level, odcdiffs,odclev, connection
                 cc = nextcc
         else:
             cchits = list(map(str,cchits))
-            cchits = rec_get_merge_cclis(cchits,1,level,connection,args)
+            cchits = get_merged_ccs(cchits, level, connection, args)
             cchits = list(map(int, cchits))
             cc = min(cchits)
 
@@ -1547,7 +1474,7 @@ def call_st_cc(stres, ccres, odcres, profile, level, odcdiffs,odclev, connection
                         odc[odcdiff] = nextodc
                 else:  # if there are matches assign to smallest value and get any merges as list of merge tuples
 
-                    odchits = rec_get_merge_odclis(odchits, 1, odcno, connection, args)
+                    odchits = get_merged_odcs(odchits, odcno, connection, args)
                     odchits = list(map(int, odchits))
                     odccall = min(odchits)
                     odc[odcdiff] = odccall  # assign the smallest odc value to result
@@ -1596,6 +1523,50 @@ def detect_exact_ap_matches(connection, tablesdict, level, inquery, dbname, odc_
     :param odc_level:
     :return:
     """
+    if profile_hash_ready(connection, dbname, level):
+        #  one indexed lookup of the hash of the whole profile (see backfill_profile_hash.py)
+        profile = {i: inquery[nodash_to_dash[i]] for no in tablesdict[level] for i in tablesdict[level][no]}
+        exactmatch_query = """SELECT "id" FROM "{}_ap{}_0" WHERE "{}" = '{}'""".format(dbname, level, PROFILE_HASH_COL,
+                                                                                      genProfileHash(profile))
+        exacthitcombined = [x[0] for x in sqlquery_to_outls(connection, exactmatch_query)]
+    else:
+        exacthitcombined = exact_ap_matches_by_columns(connection, tablesdict, level, inquery, dbname)
+
+    # If one exact hit get st,dst,cc (and odc info if MGT9) info and output
+    # if >1 something has gone wrong!
+    # if 0 do nothing and let further processing occur
+
+    if len(exacthitcombined) == 1:
+        match = exacthitcombined[0]
+        # TODO odc id names in more automated way - Salmonella_tables_cc
+        if odc_level:
+            ccsub = 'SELECT "st","dst","cc1_{}_id","cc2_2_id","cc2_3_id","cc2_4_id" FROM "{}_ap{}_0" WHERE "id" = {} ;'.format(
+                level, dbname, level,
+                match)
+        else:
+            ccsub = 'SELECT "st","dst","cc1_{}_id" FROM "{}_ap{}_0" WHERE "id" = {} ;'.format(level, dbname, level,
+                                                                                              match)
+        res = sqlquery_to_outls(connection, ccsub)
+        return res, "EXACT"
+        ### get st,dst,cc
+    elif len(exacthitcombined) > 1:
+        sys.exit("Level {} profile matches more than one ST exactly!! ({})".format(str(level), ",".join(
+            list(map(str, exacthitcombined)))))
+    else:
+        return "", "NONE"
+
+
+def exact_ap_matches_by_columns(connection, tablesdict, level, inquery, dbname):
+    """
+    exact allele profile matches by comparing every locus column (used when profile_hash is not filled)
+
+    :param connection: psycopg2 connection object
+    :param tablesdict: {level:{table number:[locus columns]}}
+    :param level: MGT level
+    :param inquery: {locus:allele}
+    :param dbname: database app name
+    :return: ids of matching allele profiles
+    """
     exacthitcombined = []
     for no in list(sorted(tablesdict[level].keys())):  # for each allele profile table for a given level table 0 has different columns
         if no == 0:
@@ -1639,47 +1610,80 @@ def detect_exact_ap_matches(connection, tablesdict, level, inquery, dbname, odc_
                 if len(exacthitcombined) == 0:
                     break
 
-    # If one exact hit get st,dst,cc (and odc info if MGT9) info and output
-    # if >1 something has gone wrong!
-    # if 0 do nothing and let further processing occur
+    return exacthitcombined
 
-    if len(exacthitcombined) == 1:
-        match = exacthitcombined[0]
-        # TODO odc id names in more automated way - Salmonella_tables_cc
-        if odc_level:
-            ccsub = 'SELECT "st","dst","cc1_{}_id","cc2_2_id","cc2_3_id","cc2_4_id" FROM "{}_ap{}_0" WHERE "id" = {} ;'.format(
-                level, dbname, level,
-                match)
-        else:
-            ccsub = 'SELECT "st","dst","cc1_{}_id" FROM "{}_ap{}_0" WHERE "id" = {} ;'.format(level, dbname, level,
-                                                                                              match)
-        res = sqlquery_to_outls(connection, ccsub)
-        return res, "EXACT"
-        ### get st,dst,cc
-    elif len(exacthitcombined) > 1:
-        sys.exit("Level {} profile matches more than one ST exactly!! ({})".format(str(level), ",".join(
-            list(map(str, exacthitcombined)))))
-    else:
-        return "", "NONE"
 
+def profile_hash_ready(connection, dbname, level):
+    """
+    :param connection: psycopg2 connection object
+    :param dbname: database app name
+    :param level: MGT level
+    :return: True if every allele profile of the level has a profile_hash (backfill_profile_hash.py has been run)
+    """
+    table = "{}_ap{}_0".format(dbname, level)
+    if table not in profile_hash_tables:
+        hascol = """SELECT 1 FROM INFORMATION_SCHEMA.COLUMNS WHERE table_name = '{}' AND column_name = '{}';""".format(
+            table, PROFILE_HASH_COL)
+        profile_hash_tables[table] = len(sqlquery_to_outls(connection, hascol)) > 0
+    if not profile_hash_tables[table]:
+        return False
+    nulls = """SELECT 1 FROM "{}" WHERE "{}" IS NULL LIMIT 1;""".format(table, PROFILE_HASH_COL)
+    return len(sqlquery_to_outls(connection, nulls)) == 0
+
+
+def get_ap_st_map(connection, level, dbname, apids=()):
+    """
+    AP id to ST map of a level, read in full on first use then extended with the APs added since (by this run or
+    any other) on each call
 
-def remove_sts_with_nonmatching_dsts(connection, level, dbname, idmatchcounts):
+    :param connection: psycopg2 connection object
+    :param level: MGT level
+    :param dbname: database app name
+    :param apids: AP ids that must be in the map (read in full again if any is missing, i.e. committed by another
+    run after APs with higher ids)
+    :return: {AP id: st}, {st: [AP ids]} (ids and sts as str)
+    """
+    if level not in ap_st_maps or any(x not in ap_st_maps[level][1] for x in apids if int(x) <= ap_st_maps[level][0]):
+        ap_st_maps[level] = [0, {}, {}]
+    stmap = ap_st_maps[level]
+    get_sts = """ SELECT "id","st" FROM "{}_ap{}_0" WHERE "id" > {} ORDER BY "id" """.format(dbname, level, stmap[0])
+    for inf in sqlquery_to_outls(connection, get_sts):
+        id = str(inf[0])
+        st = str(inf[1])
+        stmap[1][id] = st
+        stmap[2].setdefault(st, []).append(id)
+        stmap[0] = inf[0]
+    return stmap[1], stmap[2]
 
-    get_sts = """ SELECT "id","st","dst" FROM "{}_ap{}_0" """.format(dbname, level)
 
-    stres = sqlquery_to_outls(connection, get_sts)
+def query_ap_sts(connection, level, dbname, apids):
+    """
+    AP id to ST links of only the STs of the candidate APs (one query on the st, dst index)
 
-    all_st_apids = {}
+    :param apids: candidate AP ids
+    :return: {AP id: st}, {st: [AP ids]} (ids and sts as str)
+    """
+    get_sts = """ SELECT "id","st" FROM "{0}_ap{1}_0" WHERE "st" IN (SELECT "st" FROM "{0}_ap{1}_0" WHERE "id" IN ({2})) """.format(
+        dbname, level, ",".join(map(str, apids)))
     id_to_st = {}
-    # get all id to st links and list of apids per st
-    for inf in stres:
-        st = str(inf[1])
+    all_st_apids = {}
+    for inf in sqlquery_to_outls(connection, get_sts):
         id = str(inf[0])
+        st = str(inf[1])
         id_to_st[id] = st
-        if st not in all_st_apids:
-            all_st_apids[st] = [id]
-        else:
-            all_st_apids[st].append(id)
+        all_st_apids.setdefault(st, []).append(id)
+    return id_to_st, all_st_apids
+
+
+def remove_sts_with_nonmatching_dsts(connection, level, dbname, idmatchcounts, args):
+
+    # get all id to st links and list of apids per st
+    if not idmatchcounts:
+        return {}
+    if args.no_stmap:
+        id_to_st, all_st_apids = query_ap_sts(connection, level, dbname, idmatchcounts.keys())
+    else:
+        id_to_st, all_st_apids = get_ap_st_map(connection, level, dbname, idmatchcounts.keys())
 
     # get sts and lists of ids from matches
 
@@ -1768,76 +1772,33 @@ def chunks(l, n):
         yield l[i:i + n]
 
 def get_mostvariable(args,conn):
-
-    sqlquery="""SELECT "identifier","locus_id" FROM "{appname}_allele" WHERE identifier NOT LIKE '-%';""".format(appname=args.appname)
-    stres = sqlquery_to_outls(conn, sqlquery)
-    maxno = {}
-    for row in stres:
-        if row[0] != '':
-            alleleno = int(row[0])
-            locus = row[1]
-            if locus not in maxno:
-                maxno[locus] = alleleno
-            else:
-                if alleleno > maxno[locus]:
-                    maxno[locus] = alleleno
-
-    sortedloci = sorted(maxno.items(), key=itemgetter(1), reverse=True)
+    """
+    rank loci by variability (highest positive allele number first) from the posallele counters (counters.py),
+    loci with no positive alleles are left out (counters missing from the table are not stored in --query runs)
+    :param args: inputs
+    :param conn: sql connection
+    :return: list of loci
+    """
+    nextpos = locus_allele_counters(conn, args.appname, write=not args.query)
+    sortedloci = sorted([x for x in nextpos.items() if x[1] > 1], key=lambda x: (-x[1], x[0]))
     sortedloci = [x[0] for x in sortedloci]
     return sortedloci
 
 
-def get_matches(level, connection, inquery, allowed_diffs, tablesdict, odc_level, args, start_time,
-                ignore_zeros=True):
+def sql_ap_mismatches(level, connection, inquery, allowdiff, tablesdict, args):
     """
-    Get matches in the correct level to input dict with structure {locus:allele_call}
+    compare query to allele profiles of a level in postgres, in chunks of loci (most variable first), dropping
+    profiles with more than allowdiff missmatches after each chunk (used with --no_apcache)
+
     :param level: MGT level being examined
     :param connection: psycopg2 connection object
     :param inquery: input query dict
-    :param allowed_diffs: number of differences allowed for CC calling in list (for normal level this ill be 1)
-    for odclevel this will include the different odc cutoffs
+    :param allowdiff: maximum missmatches for a profile to be kept
     :param tablesdict: number and name of allele profile tables for each level
-    :param matching_st_ids: sts within the current subset (if subset on defined by ccminus1 and ccminus2)
-    :param odc_level: boolean if level is used for odcs
     :param args: input argparse object
-    :param ignore_zeros: whether to count alleles called 0 as a match (True) or as a missmatch (False) - at the moment
-    always True
-    :return: lists/dicts of st matches, cc matches and odc matches
+    :return: {AP id: [missmatches]}, {AP id: number of zero calls}, number of loci compared
     """
-
-    ############ first check for exact match and if there is a hit return that ST,dST and CC
-
-
-
-
-    if args.timing:
-        print("{} start get matches".format(level), (" --- %s seconds ---" % (time.time() - start_time)))
-
-    if args.query and inquery == "newst":
-        return [], [], {}
-
     dbname = args.appname
-    output, outcome = detect_exact_ap_matches(connection, tablesdict, level, inquery, dbname, odc_level)
-
-    if args.timing:
-        print("{} exact get matches".format(level), (" --- %s seconds ---" % (time.time() - start_time)))
-
-
-    if outcome == "EXACT":
-        if args.printinfo:
-            print(level, "exact match", output)
-        return output, outcome, {}
-
-    ## test below "if" - effectively if cc subsetting returns nothing below will assume new ST. if below is removed then will search whole DB - much slower.
-    # if matching_st_ids == [] and args.subsetwcc:
-    #     print(level, "subset ST matches")
-    #     return [], [], {}
-    #
-    # if matching_st_ids == [] and args.subsetst:
-    #     print(level, "nested subset ST matches")
-    #     return [], [], {}
-
-
     idmissmatchcounts = {}
     zerocounts = {}  # store number of allele matches caused by 0 in query or existing allele
 
@@ -1905,11 +1866,6 @@ def get_matches(level, connection, inquery, allowed_diffs, tablesdict, odc_level
                 keyname = "main_id"
                 matchstring =   """ WHERE {keyname} IN ('{idls}')""".format(keyname=keyname,idls="','".join(map(str, idmissmatchcounts.keys())))
 
-            if odc_level:
-                allowdiff = max(list(allowed_diffs.keys()))
-            else:
-                allowdiff = list(allowed_diffs.keys())[0]
-
             sqlquery = """SELECT "{kname}","{locusls}" FROM "{db}_ap{lev}_{tableno}"{match};""".format(
                 locusls=locus_retreive_string, db=dbname, lev=level, tableno=str(no), kname=keyname,
                 match=matchstring)
@@ -1957,9 +1913,110 @@ def get_matches(level, connection, inquery, allowed_diffs, tablesdict, odc_level
             if idmissmatchcounts == {}:
                 break
         if idmissmatchcounts == {}:
-            if args.printinfo:
-                print("No Ap matches at level {}".format(level))
-            return [], [], {}
+            break
+
+    return idmissmatchcounts, zerocounts, totquery
+
+
+def get_ap_matrix(level, connection, tablesdict, args):
+    """
+    :return: ApMatrix of the level's allele profiles, brought up to date with the database
+    """
+    if level not in ap_matrices:
+        ap_matrices[level] = ApMatrix(args.apcache, args.appname, level, tablesdict[level])
+    added = ap_matrices[level].sync(connection)
+    if args.timing:
+        print("\t{} allele profiles added to level {} matrix cache".format(added, level))
+    return ap_matrices[level]
+
+
+def matrix_ap_mismatches(level, connection, inquery, allowdiff, tablesdict, args):
+    """
+    as sql_ap_mismatches using the cached allele profile matrix of the level (ap_matrix.py)
+
+    :return: {AP id: [missmatches]}, {AP id: number of zero calls}, number of loci compared
+    """
+    matrix = get_ap_matrix(level, connection, tablesdict, args)
+    dash_nodash = {nodash_to_dash[x]: x for x in matrix.loci}
+    loci = [dash_nodash[x] for x in args.variable_alleles if x in dash_nodash]
+    query = {}
+    for locus in loci:
+        query_allele = inquery[nodash_to_dash[locus]]
+        if "new" in query_allele and "-" not in query_allele:
+            query[locus] = 0
+        else:
+            query[locus] = encode_allele(neg_to_pos(query_allele))
+    idmissmatchcounts, zerocounts = matrix.mismatches(query, loci, allowdiff)
+    return idmissmatchcounts, zerocounts, len(loci)
+
+
+def get_matches(level, connection, inquery, allowed_diffs, tablesdict, odc_level, args, start_time,
+                ignore_zeros=True):
+    """
+    Get matches in the correct level to input dict with structure {locus:allele_call}
+    :param level: MGT level being examined
+    :param connection: psycopg2 connection object
+    :param inquery: input query dict
+    :param allowed_diffs: number of differences allowed for CC calling in list (for normal level this ill be 1)
+    for odclevel this will include the different odc cutoffs
+    :param tablesdict: number and name of allele profile tables for each level
+    :param matching_st_ids: sts within the current subset (if subset on defined by ccminus1 and ccminus2)
+    :param odc_level: boolean if level is used for odcs
+    :param args: input argparse object
+    :param ignore_zeros: whether to count alleles called 0 as a match (True) or as a missmatch (False) - at the moment
+    always True
+    :return: lists/dicts of st matches, cc matches and odc matches
+    """
+
+    ############ first check for exact match and if there is a hit return that ST,dST and CC
+
+
+
+
+    if args.timing:
+        print("{} start get matches".format(level), (" --- %s seconds ---" % (time.time() - start_time)))
+
+    if args.query and inquery == "newst":
+        return [], [], {}
+
+    dbname = args.appname
+    output, outcome = detect_exact_ap_matches(connection, tablesdict, level, inquery, dbname, odc_level)
+
+    if args.timing:
+        print("{} exact get matches".format(level), (" --- %s seconds ---" % (time.time() - start_time)))
+
+
+    if outcome == "EXACT":
+        if args.printinfo:
+            print(level, "exact match", output)
+        return output, outcome, {}
+
+    ## test below "if" - effectively if cc subsetting returns nothing below will assume new ST. if below is removed then will search whole DB - much slower.
+    # if matching_st_ids == [] and args.subsetwcc:
+    #     print(level, "subset ST matches")
+    #     return [], [], {}
+    #
+    # if matching_st_ids == [] and args.subsetst:
+    #     print(level, "nested subset ST matches")
+    #     return [], [], {}
+
+
+    if odc_level:
+        allowdiff = max(list(allowed_diffs.keys()))
+    else:
+        allowdiff = list(allowed_diffs.keys())[0]
+
+    if args.no_apcache:
+        idmissmatchcounts, zerocounts, totquery = sql_ap_mismatches(level, connection, inquery, allowdiff, tablesdict,
+                                                                    args)
+    else:
+        idmissmatchcounts, zerocounts, totquery = matrix_ap_mismatches(level, connection, inquery, allowdiff,
+                                                                       tablesdict, args)
+
+    if idmissmatchcounts == {}:
+        if args.printinfo:
+            print("No Ap matches at level {}".format(level))
+        return [], [], {}
 
 
 
@@ -1968,7 +2025,7 @@ def get_matches(level, connection, inquery, allowed_diffs, tablesdict, odc_level
 
     # Need to remove APs for all dSTs when ONE dST is ruled out - i.e. 34.0 is ruled out but not 34.2, 34.3 - need to remove all three
     ## GET list of how many AP ids correspond to each ST - use to check if all neg profiles of an ST match (if not then remove match)
-    idmissmatchcounts = remove_sts_with_nonmatching_dsts(connection, level, dbname, idmissmatchcounts)
+    idmissmatchcounts = remove_sts_with_nonmatching_dsts(connection, level, dbname, idmissmatchcounts, args)
 
     #  Gather lists of allele profile ids either matching or passing cutoffs for ST, CC and ODC calls
     stmatch, ccmatch, odcmatches = gather_st_cc_odc_matches(allowed_diffs, totquery, idmissmatchcounts, odc_level,
@@ -2179,7 +2236,7 @@ def write_to_tables(alleles_out_dict, profile, level, st, dst, cc, merges, args,
         #         print(alleles_out_dict[i])
         #         input("Press Enter to continue...")
 
-        addAlleles(projectpath, args.mgtapp, args.appname, alleleLocation, alleles_out_dict,args.settings)  # add new alleles
+        addAlleles(projectpath, args.mgtapp, args.appname, alleleLocation, alleles_out_dict,args.settings,get_allele_store(args).path)  # add new alleles
 
         addSnpMutsToDb(projectpath, args.mgtapp, args.appname, alleles_out_dict,args.settings)  # add SNPs for new alleles
 
@@ -2333,6 +2390,87 @@ def check_alleles_file_format(args, conn, allelesfile,StrainName):
 ######## MAIN ########
 
 
+def connect_db(args):
+    """
+    :param args: input args (settings must be loaded)
+    :return: psycopg2 connection to the app database
+    """
+    database = settings.APPS_DATABASE_MAPPING[args.appname]
+    psql_details = settings.DATABASES[database]
+
+    if not args.local:
+        host = settings.NONLOCALHOST
+    else:
+        host=psql_details['HOST']
+
+    DbConString = "dbname='{0}' host='{1}' port='{2}' user='{3}' password='{4}'".format(psql_details['NAME'],host,psql_details['PORT'],psql_details['USER'],psql_details['PASSWORD'])  ## connection info for Db - assign new user that can only do what is needed for script
+    conn = psycopg2.connect(DbConString)
+    conn.autocommit = True
+    return conn
+
+
+def get_alleles_files(args):
+    """
+    :param args: input args
+    :return: list of (alleles file, strain database id or "") to assign in order
+    """
+    if args.manifest:
+        allelesfiles = []
+        for manifest in args.inalleles:
+            for line in open(manifest):
+                line = line.strip()
+                if line == "" or line.startswith("#"):
+                    continue
+                col = line.split("\t")
+                allelesfiles.append((col[0], col[1] if len(col) > 1 else ""))
+    else:
+        allelesfiles = [(x, "") for x in args.inalleles]
+
+    if len(allelesfiles) == 1 and not args.manifest:
+        allelesfiles = [(allelesfiles[0][0], args.id)]
+    elif args.id != "":
+        sys.exit("--id can only be used with a single alleles file, use a manifest to give ids for a batch")
+
+    return allelesfiles
+
+
+def run_batch(args, conn, allelesfiles, no_tables):
+    """
+    assign many isolates in one process, in order. Tables, variable loci and the allele/allele profile caches
+    are loaded once and kept up to date as each isolate adds alleles, STs and CCs, so later isolates see them.
+    An isolate that fails is marked failed (cron) and the batch moves on to the next one.
+    :param args: input args
+    :param conn: psycopg2 connection
+    :param allelesfiles: list of (alleles file, strain database id or "")
+    :param no_tables: allele profile tables from get_table_nos
+    :return: list of failed alleles files
+    """
+    failed = []
+    batch_start = time.time()
+    for pos, (allelesfile, ident) in enumerate(allelesfiles):
+        isolate_args = copy.copy(args)
+        isolate_args.inalleles = allelesfile
+        isolate_args.id = ident
+        print("Batch isolate {} of {}: {}".format(pos + 1, len(allelesfiles), allelesfile))
+        try:
+            if conn.closed:
+                conn = connect_db(args)
+            assign_isolate(isolate_args, conn, no_tables)
+        except (Exception, SystemExit):
+            traceback.print_exc()
+            failed.append(allelesfile)
+            if args.cron:
+                strainid = ident if ident != "" else str(allelesfile).split("/")[-1].replace("_alleles.fasta", "")
+                try:
+                    if conn.closed:
+                        conn = connect_db(args)
+                    update_status('F', args, conn, [strainid], 'server_status', 'id')
+                except Exception:
+                    traceback.print_exc()
+    print("Batch of {} isolates ({} failed)".format(len(allelesfiles), len(failed)), (" --- %s seconds ---" % (time.time() - batch_start)))
+    return failed
+
+
 def main():
     # sys.exit()
 
@@ -2342,10 +2480,6 @@ def main():
 
     settings = load_settings(args)
 
-    database = settings.APPS_DATABASE_MAPPING[args.appname]
-    psql_details = settings.DATABASES[database]
-
-
     args.projectPath = path.dirname(path.dirname(path.dirname(path.abspath(__file__)))) + "/"
     args.mgtalleles = settings.ABS_SUBDIR_ALLELES + "/" + args.appname + "/"
 
@@ -2354,15 +2488,35 @@ def main():
     # if not args.mgtalleles.startswith("/"):
     #     args.mgtalleles = "/" + args.mgtalleles
 
-    metadata_type = args.metadata_type
-    if not args.local:
-        host = settings.NONLOCALHOST
+    allelesfiles = get_alleles_files(args)
+
+    conn = connect_db(args)
+
+    start_time = time.time()
+    no_tables = get_table_nos(conn,
+                              args)  # descriptions of allele profile tables in format: {level:{table number: [list of locus names in table]}}
+
+    args.variable_alleles = get_mostvariable(args,conn)
+    if args.timing:
+        print("\tget variable loci", (" --- %s seconds ---" % (time.time() - start_time)))
+
+    if len(allelesfiles) == 1 and not args.manifest:
+        args.inalleles = allelesfiles[0][0]
+        assign_isolate(args, conn, no_tables)
     else:
-        host=psql_details['HOST']
+        failed = run_batch(args, conn, allelesfiles, no_tables)
+        if failed:
+            sys.exit("{} of {} isolates failed: {}".format(len(failed), len(allelesfiles), ",".join(failed)))
 
-    DbConString = "dbname='{0}' host='{1}' port='{2}' user='{3}' password='{4}'".format(psql_details['NAME'],host,psql_details['PORT'],psql_details['USER'],psql_details['PASSWORD'])  ## connection info for Db - assign new user that can only do what is needed for script
-    conn = psycopg2.connect(DbConString)
-    conn.autocommit = True
+
+def assign_isolate(args, conn, no_tables):
+    """
+    assign alleles, STs, CCs and ODCs to one isolate and write them to the database
+    :param args: input args (args.inalleles is the alleles file, args.id its strain database id or "")
+    :param conn: psycopg2 connection
+    :param no_tables: allele profile tables from get_table_nos
+    """
+    metadata_type = args.metadata_type
 
     InputAllelesFile = args.inalleles
     if args.id == "":
@@ -2416,13 +2570,6 @@ def main():
 
     ##read/process alleles file produced by genomes_to_alleles.py
 
-    start_time2 = time.time()
-    no_tables = get_table_nos(conn,
-                              args)  # descriptions of allele profile tables in format: {level:{table number: [list of locus names in table]}}
-
-    args.variable_alleles = get_mostvariable(args,conn)
-    if args.timing:
-        print("\tget variable loci", (" --- %s seconds ---" % (time.time() - start_time2)))
     st_results = {}
     cc_results = {}
     merge_results = {}
@@ -2446,8 +2593,6 @@ def main():
     print("minlevel = " + str(minlevel))
 
     odcdiffs = OrderedDict()
-    posalleleseqs = {}
-    negalleleseqs = {}
     for level in range(minlevel, maxlevel + 1):
         start_time1 = time.time()
         # print(level)
@@ -2483,7 +2628,7 @@ def main():
             ccb1 = ""
             ccb2 = ""
 
-        profile, all_assignments, new_allele_outdict,posalleleseqs,negalleleseqs = get_allele_profile(conn, level,
+        profile, all_assignments, new_allele_outdict = get_allele_profile(conn, level,
                                                                                            NewPosAlleles,
                                                                                            NewNegAlleles, AllCalls,
                                                                                            PosMatches,
@@ -2492,8 +2637,6 @@ def main():
                                                                                            all_assignments, args,
                                                                                            nodash_to_dash,
                                                                                            start_time,
-                                                                                           posalleleseqs,
-                                                                                           negalleleseqs,
                                                                                            ccb1=ccb1,
                                                                                            ccb2=ccb2,
                                                                                            ccsubsetlevs=ccsubsetlevs)
@@ -2672,7 +2815,8 @@ def parseargs():
     test = False
     if not test:
 
-        parser.add_argument("inalleles", help="File path to strain alleles file (output from genomes_to_alleles.py)")
+        parser.add_argument("inalleles", nargs="+",
+                            help="File path to strain alleles file (output from genomes_to_alleles.py), more than one to assign a batch in one run")
         parser.add_argument("appname", help="Name of database (i.e. Salmonella)")
         parser.add_argument("-s", "--settings", help="name of settings file to use (minus '.py')")
         parser.add_argument("-m", "--inmeta", help="File path to strain metadata")
@@ -2715,13 +2859,30 @@ def parseargs():
                             help="threads for multithreaded steps",
                             default=4,
                             type=int)
+        parser.add_argument("--manifest",
+                            help="inalleles are manifest files listing alleles files to assign as a batch, one per line (alleles file path, optionally followed by a tab and the strain database id)",
+                            action='store_true')
+        parser.add_argument("--apcache",
+                            help="folder for the per level allele profile matrix cache used for AP matching (default <Mgt project folder>/ap_matrix_cache)")
+        parser.add_argument("--allele_store",
+                            help="folder for the allele sequence store, on a local filesystem writable by every user running this script (default <Mgt project folder>/allele_store)")
+        parser.add_argument("--no_apcache",
+                            help="match allele profiles with chunked postgres queries instead of the matrix cache",
+                            action='store_true')
+        parser.add_argument("--no_stmap",
+                            help="look up the STs of matched allele profiles with a query per level instead of the in-process allele profile id to ST map",
+                            action='store_true')
 
     args = parser.parse_args()
     args.mgtpath = path.dirname(path.dirname(path.dirname(path.abspath(__file__)))) + "/"
 
     args.mgtapp = "Mgt"
+    if not args.apcache:
+        args.apcache = args.mgtpath + "ap_matrix_cache/"
+    if not args.allele_store:
+        args.allele_store = args.mgtpath + "allele_store/"
     if test:
-        args.inalleles = "/Users/mjohnpayne/Library/CloudStorage/OneDrive-UNSW/MGT/2ap_1st_problem/input_problematic_strains/90107_alleles.fasta"
+        args.inalleles = ["/Users/mjohnpayne/Library/CloudStorage/OneDrive-UNSW/MGT/2ap_1st_problem/input_problematic_strains/90107_alleles.fasta"]
         args.appname = "Salmonella"
         args.settings = "/Users/mjohnpayne/Library/CloudStorage/OneDrive-UNSW/PycharmProjects/MGT/Mgt/Mgt/Mgt/settings_local_mp.py"
         args.inmeta = ""
@@ -2743,6 +2904,11 @@ def parseargs():
 
         args.mgtapp = "Mgt"
         args.threads = 4
+        args.apcache = args.mgtpath + "ap_matrix_cache/"
+        args.allele_store = args.mgtpath + "allele_store/"
+        args.no_apcache = False
+        args.no_stmap = False
+        args.manifest = False
 
     return args
 
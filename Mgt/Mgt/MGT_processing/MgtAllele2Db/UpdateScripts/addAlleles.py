@@ -2,12 +2,13 @@ import sys
 import re
 from Bio import SeqRecord, SeqIO
 from MGT_processing.MgtAllele2Db.UpdateScripts import getFromTableInOrgDb, readAppSettAndConnToDb, addToTableInOrgDb
+from MGT_processing.MgtAllele2Db.allele_store import AlleleStore
 # from Static import *
 
 
 ################################# TOP_LVL
 
-def addAlleles(projectPath, projectName, appName,dir_alleleSeqs, alleles_out_dict,settingtype):
+def addAlleles(projectPath, projectName, appName,dir_alleleSeqs, alleles_out_dict,settingtype,storefile):
     ## change dir_alleleSeqs to use alleles_dict_out
 
     # setting up the appClass
@@ -19,12 +20,14 @@ def addAlleles(projectPath, projectName, appName,dir_alleleSeqs, alleles_out_dic
 
     # for each file in the folder
 
-    extractAndAddAlleles(organismAppClass, dir_alleleSeqs, projectPath, appName, alleles_out_dict)
+    extractAndAddAlleles(organismAppClass, dir_alleleSeqs, projectPath, appName, alleles_out_dict, storefile)
 
 
-def extractAndAddAlleles(organismAppClass, dir_alleleSeqs, projectPath, appName, alleles_out_dict):
+def extractAndAddAlleles(organismAppClass, dir_alleleSeqs, projectPath, appName, alleles_out_dict, storefile):
     # fns = glob.glob(dir_alleleSeqs + "*")
 
+    store = AlleleStore(storefile)
+
     for locusId in alleles_out_dict:
         for allelels in alleles_out_dict[locusId]:
             alleleId = allelels[1]
@@ -34,7 +37,7 @@ def extractAndAddAlleles(organismAppClass, dir_alleleSeqs, projectPath, appName,
                 print(locusId,alleleId)
                 seqRec = SeqRecord.SeqRecord(allele_seq,id=locusId+":"+alleleId,)
                 print(dir_alleleSeqs)
-                seqFileLoc = appendSeqToFile(appName, dir_alleleSeqs, locusId, seqRec)
+                seqFileLoc = appendSeqToFile(appName, dir_alleleSeqs, locusId, seqRec, store)
 
 
                 addAlleleToDb(organismAppClass, locusId, alleleId, len(seqRec.seq), False, seqFileLoc)
@@ -44,6 +47,8 @@ def extractAndAddAlleles(organismAppClass, dir_alleleSeqs, projectPath, appName,
 
             # print(locusId, alleleId)
 
+    store.close()
+
 
 def allele_seq_unique(existing_alleles_file,newseq):
     exist = SeqIO.parse(existing_alleles_file,"fasta")
@@ -53,19 +58,31 @@ def allele_seq_unique(existing_alleles_file,newseq):
             return False
     return True
 
-def appendSeqToFile(appName, alleleSeqDirName, locusId, seqRec):
+def allele_seq_unique_in_store(store, fn_, locusId, newseq):
+    store.sync_locus(locusId, fn_)
+    seq = str(newseq.seq)
+    return store.find(locusId, seq) is None and store.find(locusId, seq, negative=True) is None
+
+def appendSeqToFile(appName, alleleSeqDirName, locusId, seqRec, store=None):
     fn_ = alleleSeqDirName + "/" + locusId + ".fasta"
     # print(fn_)
     # print(">{}\n{}\n".format(seqRec.id,str(seqRec.seq)))
     # print(fn_)
 
-    if not allele_seq_unique(fn_,seqRec):
+    if store is not None:
+        unique = allele_seq_unique_in_store(store, fn_, locusId, seqRec)
+    else:
+        unique = allele_seq_unique(fn_, seqRec)
+
+    if not unique:
         print("New allele for {} is not unique!!\n{}\n{}".format(locusId,seqRec.id,str(seqRec.seq)))
         sys.exit()
     else:
         outf = open(fn_,"a+")
         outf.write(">{}\n{}\n".format(seqRec.id,str(seqRec.seq)))
         outf.close()
+        if store is not None:
+            store.sync_locus(locusId, fn_)  # reads just the appended allele
 
     #
     # print("Seq. appended to: " + fn_)
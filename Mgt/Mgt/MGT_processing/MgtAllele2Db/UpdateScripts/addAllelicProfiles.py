@@ -1,9 +1,15 @@
 import sys
 import re
+import hashlib
+from django.db import connections
 from MGT_processing.MgtAllele2Db.UpdateScripts import getFromTableInOrgDb, readAppSettAndConnToDb, addToTableInOrgDb
 from MGT_processing.MgtAllele2Db.UpdateScripts.genModelDefsForApsAndHgt import PGS_COL_LIMIT
 import math
 
+PROFILE_HASH_COL = "profile_hash"
+
+_hashColInTable = {}
+
 
 ##################################### TOP_LVL
 # def doAddAllelicProfiles(projectPath, projectName, appName, profile_dict):
@@ -75,7 +81,10 @@ def addApForScheme(projectPath,projectName, appName, schemeName, profile_dict,st
     # print("pre addToDb")
     # print(st, dst, locus_ids_list_o_lists)
 
-    addToDb(list_tableNameClass, st, dst, locus_ids_list_o_lists, alleles_ls)
+    table_0_obj = addToDb(list_tableNameClass, st, dst, locus_ids_list_o_lists, alleles_ls)
+
+    profHash = genProfileHash({locus: profile_dict[nodash_to_dash[locus]] for locus in lociNames_sorted})
+    setProfileHash(table_0_obj, profHash)
     # print("post addToDb")
     # isHeader = True
     # with open(pathAndFileName, 'r') as fh_:
@@ -116,6 +125,35 @@ def addToDb(list_tableNameClass, st, dst, list_namesSplit, list_alleleValsSplit)
             addToTableInOrgDb.addAllelicProfileStrToTable(list_tableNameClass[i], list_namesSplit[i],
                                                           list_alleleValsSplit[i], None, None, table_0_obj)
 
+    return table_0_obj
+
+
+def genProfileHash(dict_locusToAllele):
+    """
+    md5 of a full allele profile, independent of locus order (stored in profile_hash of ap<lev>_0 tables)
+
+    :param dict_locusToAllele: {locus column name (no underscores): allele}
+    :return: hex digest
+    """
+    profStr = "\t".join("{}={}".format(locus, dict_locusToAllele[locus]) for locus in sorted(dict_locusToAllele))
+    return hashlib.md5(profStr.encode()).hexdigest()
+
+
+def setProfileHash(table_0_obj, profHash):
+    """
+    store profile hash of a new allele profile (skipped if the table has no profile_hash column yet,
+    see backfill_profile_hash.py)
+    """
+    tableName = table_0_obj._meta.db_table
+    with connections[table_0_obj._state.db].cursor() as cur:
+        if tableName not in _hashColInTable:
+            cur.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s;",
+                        [tableName, PROFILE_HASH_COL])
+            _hashColInTable[tableName] = cur.fetchone() is not None
+        if _hashColInTable[tableName]:
+            cur.execute('UPDATE "{}" SET "{}" = %s WHERE "id" = %s;'.format(tableName, PROFILE_HASH_COL),
+                        [profHash, table_0_obj.pk])
+
 
 
 def splitTheLists(lociNames_sorted, header_colNames, arrVals):
@@ -1,5 +1,7 @@
 import sys
+from django.db import connections
 from MGT_processing.MgtAllele2Db.UpdateScripts import getFromTableInOrgDb, readAppSettAndConnToDb, addToTableInOrgDb
+from MGT_processing.MgtAllele2Db import cc_merges
 import re
 
 
@@ -125,6 +127,9 @@ def handleMerges(dict_ccCache, ccTableObj, merges):
 		ccObj_orig.merge_id = ccObj_mergeTo # 4.
 		ccObj_orig.save()
 
+		with connections[ccObj_orig._state.db].cursor() as cur: # 5. join the canonical ids of the two merge groups
+			cc_merges.record_merge(cur, ccTableObj._meta.db_table, ccObj_orig.identifier, ccObj_mergeTo.identifier)
+
 """
 for ccObj in cc1_3.objects.all():
 	try:
@@ -214,6 +219,8 @@ def getOrAddCc(dict_ccCache, ccTableObj, ccId):
 
 	if not ccObj:
 		ccObj = addToTableInOrgDb.addCcToTable(ccTableObj, ccId)
+		with connections[ccObj._state.db].cursor() as cur:
+			cc_merges.add_cc(cur, ccTableObj._meta.db_table, ccId)
 
 	dict_ccCache[ccId] = ccObj
 
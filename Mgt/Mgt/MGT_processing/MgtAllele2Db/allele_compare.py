@@ -0,0 +1,62 @@
+"""
+Base by base comparison of a new allele with existing alleles for newloctype (Allele_to_mgt_db.py)
+
+Sequences are compared as uint8 arrays, every existing allele of the new allele's length at once. Positions
+with N or - in either sequence are not counted as differences.
+"""
+
+import numpy as np
+
+N_BASE = ord("N")
+GAP_BASE = ord("-")
+
+
+def seqs_to_array(seqs):
+    """
+    :param seqs: list of sequences of the same length
+    :return: uint8 array [sequences, length]
+    """
+    return np.frombuffer("".join(seqs).encode(), dtype=np.uint8).reshape(len(seqs), -1)
+
+
+def masked_differences(newseq, oldseqs):
+    """
+    positions where a sequence differs from existing sequences of the same length, ignoring N and - in either
+    :param newseq: sequence
+    :param oldseqs: list of sequences of the same length as newseq
+    :return: bool array [oldseqs, length] True where they differ
+    """
+    new = seqs_to_array([newseq])
+    old = seqs_to_array(oldseqs)
+    return (old != new) & (old != N_BASE) & (old != GAP_BASE) & (new != N_BASE) & (new != GAP_BASE)
+
+
+def ref_snps(newseq, oldseq):
+    """
+    SNPs of a new allele relative to the ref allele ("1"), over the length of the ref allele
+    :param newseq: new allele sequence, at least as long as oldseq
+    :param oldseq: ref allele sequence
+    :return: [(ref base, position (str), new base)]
+    """
+    if len(newseq) < len(oldseq):
+        raise IndexError("new allele ({}bp) is shorter than allele 1 ({}bp)".format(len(newseq), len(oldseq)))
+    diffs = masked_differences(newseq[:len(oldseq)], [oldseq])[0]
+    return [(oldseq[pos], str(pos), newseq[pos]) for pos in np.nonzero(diffs)[0].tolist()]
+
+
+def get_muts_per_locus(newnegs,alleles,newseq,muts,matchallelelist):
+    #TODO only return newnegs if input alleles are negative (i.e. no matches to positive alleles)
+    match = False
+    samelen = [x for x in alleles if len(alleles[x]) == len(newseq)]
+    if len(samelen) == 0:
+        return newnegs,muts,matchallelelist,match
+    #  compare all same length alleles at once
+    anymuts = masked_differences(newseq, [str(alleles[x]) for x in samelen]).any(axis=1)
+    for existlocus, anymut in zip(samelen, anymuts):
+        if not anymut:
+            if "-" not in existlocus:
+                matchallelelist.append(existlocus)
+            allele = existlocus.split("_")[0].strip("-")
+            newnegs.append(("", allele, newseq, muts))
+            match = True
+    return newnegs,muts,matchallelelist,match
@@ -0,0 +1,177 @@
+"""
+Allele sequence store used by Allele_to_mgt_db.py in place of parsing locus allele fasta files on every run
+
+One sqlite file per app (<app>_allele_store.sqlite in the --allele_store folder of Allele_to_mgt_db.py, by default
+<Mgt project folder>/allele_store) holds every allele of every locus with
+an md5 digest of its sequence and its length, indexed so that:
+    exact matches of a new positive or negative allele are a (locus, digest) lookup
+    the alleles compared base by base to a new allele are only those of the same length
+
+The allele fasta files stay the record of the alleles. The store remembers how far into each locus file it has
+read (byte offset, mtime and the bytes just before the offset) and reads only what was appended since, so it
+follows addAlleles (which appends to the files and then syncs the store) and any other change to the files
+(a rewritten file is read again from the start).
+
+The store is only a copy of the fasta files, so it can live apart from the allele folder (which may be on a network
+filesystem not writable by every user). Its folder has to be on a filesystem with working file locks (sqlite is not
+safe on most network filesystems) and writable by every user running Allele_to_mgt_db.py, as sqlite creates a
+rollback journal next to the store while writing. The default rollback journal is used rather than WAL, which also
+needs a shared memory file that every process can map.
+"""
+
+import hashlib
+import os
+import sqlite3
+
+STORE_NAME = "allele_store.sqlite"
+TAIL_BYTES = 64  # bytes before the read offset kept to check a file was only appended to
+
+
+def store_path(store_dir, appname):
+    """
+    :param store_dir: allele store folder (args.allele_store), created if missing
+    :param appname: database app name (i.e. Salmonella)
+    :return: path of the app's allele store
+    """
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+    return os.path.join(store_dir, "{}_{}".format(appname, STORE_NAME))
+
+
+def seq_digest(seq):
+    """
+    :param seq: allele sequence
+    :return: md5 hex digest
+    """
+    return hashlib.md5(str(seq).encode()).hexdigest()
+
+
+def _parse_fasta(text):
+    """
+    :param text: fasta text of complete records
+    :return: [(allele number, sequence)] allele number is the part of the id after the last ":"
+    """
+    out = []
+    for record in text.split(">")[1:]:
+        lines = record.split("\n")
+        header = lines[0].split()
+        if not header:
+            continue
+        out.append((header[0].split(":")[-1], "".join(x.strip() for x in lines[1:])))
+    return out
+
+
+class AlleleStore(object):
+
+    def __init__(self, path):
+        """
+        :param path: sqlite file (from store_path())
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=300, isolation_level=None)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS alleles (locus TEXT, allele TEXT, negative INTEGER,
+                          length INTEGER, digest TEXT, seq TEXT, PRIMARY KEY (locus, allele));""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS alleles_digest ON alleles (locus, digest);")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS alleles_length ON alleles (locus, length);")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS files (locus TEXT PRIMARY KEY, path TEXT, read_to INTEGER,
+                          mtime INTEGER, tail BLOB);""")
+
+    def close(self):
+        self.conn.close()
+
+    def _file_state(self, locus):
+        res = self.conn.execute("SELECT path, read_to, mtime, tail FROM files WHERE locus = ?;", (locus,)).fetchone()
+        return res
+
+    def sync_locus(self, locus, fasta):
+        """
+        bring the stored alleles of a locus up to date with its fasta file
+
+        :param locus: locus name
+        :param fasta: locus allele fasta path
+        :return: number of alleles read from the file
+        """
+        fasta = os.path.realpath(fasta)
+        stat = os.stat(fasta)
+        state = self._file_state(locus)
+        if state and state[0] == fasta and state[1] == stat.st_size and state[2] == stat.st_mtime_ns:
+            return 0
+
+        self.conn.execute("BEGIN IMMEDIATE;")  # one process reads a file at a time, others then see it done
+        try:
+            state = self._file_state(locus)
+            with open(fasta, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                offset = 0
+                if state and state[0] == fasta and 0 < state[1] <= size:
+                    f.seek(state[1] - len(state[3]))
+                    if f.read(len(state[3])) == state[3]:
+                        offset = state[1]
+                if offset == 0:
+                    self.conn.execute("DELETE FROM alleles WHERE locus = ?;", (locus,))
+                f.seek(offset)
+                data = f.read(size - offset)
+
+            # leave a record still being appended (by addAlleles) for the next sync
+            if offset and data and not data.endswith(b"\n"):
+                data = data[:data.rfind(b"\n>") + 1]
+            end = offset + len(data)
+
+            rows = []
+            for allele, seq in _parse_fasta(data.decode()):
+                rows.append((locus, allele, int("-" in allele), len(seq), seq_digest(seq), seq))
+            self.conn.executemany("INSERT OR REPLACE INTO alleles VALUES (?,?,?,?,?,?);", rows)
+
+            with open(fasta, "rb") as f:
+                f.seek(max(end - TAIL_BYTES, 0))
+                tail = f.read(min(end, TAIL_BYTES))
+            mtime = stat.st_mtime_ns if end == stat.st_size else 0
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?,?);", (locus, fasta, end, mtime, tail))
+            self.conn.execute("COMMIT;")
+        except BaseException:
+            self.conn.execute("ROLLBACK;")
+            raise
+        return len(rows)
+
+    def find(self, locus, seq, negative=False):
+        """
+        :param locus: locus name
+        :param seq: allele sequence
+        :param negative: look for a negative allele (id containing "-") instead of a positive one
+        :return: allele number with exactly this sequence, None if there is none
+        """
+        res = self.conn.execute("SELECT allele FROM alleles WHERE locus = ? AND digest = ? AND negative = ? AND seq = ?;",
+                                (locus, seq_digest(seq), int(negative), str(seq))).fetchone()
+        if res:
+            return res[0]
+        return None
+
+    def positive_ids(self, locus):
+        """
+        :param locus: locus name
+        :return: set of positive allele numbers of the locus
+        """
+        return set(x[0] for x in self.conn.execute("SELECT allele FROM alleles WHERE locus = ? AND negative = 0;",
+                                                  (locus,)))
+
+    def length_bucket(self, locus, length, include=("1",)):
+        """
+        :param locus: locus name
+        :param length: sequence length
+        :param include: positive alleles added whatever their length (allele 1 is the reference for SNP calls)
+        :return: ({positive allele: seq}, {negative allele: seq}) of the alleles of the given length
+        """
+        pos = {}
+        neg = {}
+        for allele, negative, seq in self.conn.execute(
+                "SELECT allele, negative, seq FROM alleles WHERE locus = ? AND length = ?;", (locus, length)):
+            if negative:
+                neg[allele] = seq
+            else:
+                pos[allele] = seq
+        for allele in include:
+            if allele not in pos:
+                res = self.conn.execute("SELECT seq FROM alleles WHERE locus = ? AND allele = ?;", (locus, allele)).fetchone()
+                if res:
+                    pos[allele] = res[0]
+        return pos, neg
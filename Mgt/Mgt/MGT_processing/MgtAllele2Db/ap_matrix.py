@@ -0,0 +1,296 @@
+"""
+Per level allele profile matrix cache for get_matches (Allele_to_mgt_db.py)
+
+The allele profiles of a level ("{app}_ap{lev}_{no}" tables) are held as one int32 matrix with a row per locus
+and a column per allele profile, so the values of a locus across every profile are contiguous and the most
+variable loci can be compared first without reading the rest. Alleles are stored as in the string comparison
+get_matches did before: negative alleles as their positive allele ("-3_2" -> 3) and missing/zero calls as 0.
+
+Files in the cache folder (per app and level):
+    <app>_ap<lev>.npy        int32 [loci, capacity] matrix (memory mapped, only the first "rows" columns used)
+    <app>_ap<lev>_ids.npy    int64 [capacity] allele profile ids ("id" of table 0) of the matrix columns
+    <app>_ap<lev>.json       watermark: loci, rows, the largest allele profile id read and pending ids
+
+Allele profiles are only ever added, so on each load profiles with an id over the watermark are read from
+postgres and written into the spare capacity (the files are reallocated at double size when full). A profile
+with its table 0 row but not yet a row in every other table of the level (being written by another run, or
+left by a run that failed part way through addApForScheme) is skipped and kept as pending: pending ids are
+read again on every load and added once complete, so they never hold back the profiles after them. Matrix
+columns are therefore not strictly in id order. The matrix is rebuilt if the level's loci changed or profiles
+at or below the watermark were removed.
+"""
+
+import fcntl
+import json
+import os
+import re
+
+import numpy as np
+
+FETCH_ROWS = 20000  # allele profiles read from postgres per query when building/extending
+
+
+def encode_allele(value):
+    """
+    :param value: allele profile value ("5", "-3_2", "0", "" or None)
+    :return: int as compared by get_matches (negative alleles as their positive allele, missing as 0)
+    """
+    if value is None:
+        return 0
+    value = re.sub(r"_[0-9]+", "", str(value)).replace("-", "")
+    if value == "":
+        return 0
+    return int(value)
+
+
+class ApMatrix(object):
+
+    def __init__(self, cachedir, appname, level, tables):
+        """
+        :param cachedir: cache folder
+        :param appname: database app name (i.e. Salmonella)
+        :param level: MGT level
+        :param tables: {table number: [locus columns]} of the level (from get_table_nos)
+        """
+        self.appname = appname
+        self.level = level
+        self.tables = tables
+        self.loci = [locus for no in sorted(tables.keys()) for locus in tables[no]]
+        self.locus_index = {locus: pos for pos, locus in enumerate(self.loci)}
+        prefix = os.path.join(cachedir, "{}_ap{}".format(appname, level))
+        self.matrix_path = prefix + ".npy"
+        self.ids_path = prefix + "_ids.npy"
+        self.meta_path = prefix + ".json"
+        self.lock_path = prefix + ".lock"
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir, exist_ok=True)
+        self.matrix = None
+        self.ids = None
+        self.rows = 0
+
+    def _table(self, no):
+        return "{}_ap{}_{}".format(self.appname, self.level, no)
+
+    def _read_meta(self):
+        if not (os.path.exists(self.meta_path) and os.path.exists(self.matrix_path) and os.path.exists(self.ids_path)):
+            return None
+        try:
+            meta = json.load(open(self.meta_path))
+        except ValueError:
+            return None
+        if meta.get("loci") != self.loci:
+            return None
+        return meta
+
+    def _write_meta(self, rows, max_id, pending):
+        tmp = self.meta_path + ".tmp"
+        outf = open(tmp, "w")
+        json.dump({"loci": self.loci, "rows": rows, "max_id": max_id, "pending": pending}, outf)
+        outf.close()
+        os.rename(tmp, self.meta_path)
+
+    def _allocate(self, capacity, keep_rows=0):
+        """
+        new matrix/id files of the given capacity holding the first keep_rows of the current ones
+        """
+        matrix_tmp = self.matrix_path + ".tmp.npy"
+        ids_tmp = self.ids_path + ".tmp.npy"
+        matrix = np.lib.format.open_memmap(matrix_tmp, mode="w+", dtype=np.int32, shape=(len(self.loci), capacity))
+        ids = np.lib.format.open_memmap(ids_tmp, mode="w+", dtype=np.int64, shape=(capacity,))
+        if keep_rows:
+            old_matrix = np.load(self.matrix_path, mmap_mode="r")
+            old_ids = np.load(self.ids_path, mmap_mode="r")
+            matrix[:, :keep_rows] = old_matrix[:, :keep_rows]
+            ids[:keep_rows] = old_ids[:keep_rows]
+        matrix.flush()
+        ids.flush()
+        del matrix, ids
+        os.rename(matrix_tmp, self.matrix_path)
+        os.rename(ids_tmp, self.ids_path)
+
+    def _read_block(self, conn, res, where):
+        """
+        :param res: (id, table 0 locus columns) rows of allele profiles
+        :param where: condition on "main_id" selecting at least those profiles in the other tables
+        :return: (ids, [loci, n] int32 block, bool array True for profiles found in every table)
+        """
+        ids = np.array([x[0] for x in res], dtype=np.int64)
+        col = {apid: pos for pos, apid in enumerate(ids.tolist())}
+        block = np.zeros((len(self.loci), len(ids)), dtype=np.int32)
+        complete = np.ones(len(ids), dtype=bool)
+        offset = 0
+        for no in sorted(self.tables.keys()):
+            loci = self.tables[no]
+            if no == 0:
+                rows = [(x[0], x[1:]) for x in res]
+            else:
+                cur = conn.cursor()
+                cur.execute('SELECT "main_id", "{cols}" FROM "{table}" WHERE {where};'.format(
+                    cols='","'.join(loci), table=self._table(no), where=where))
+                rows = [(x[0], x[1:]) for x in cur.fetchall()]
+                cur.close()
+            found = np.zeros(len(ids), dtype=bool)
+            for apid, values in rows:
+                if apid in col:
+                    block[offset:offset + len(loci), col[apid]] = [encode_allele(x) for x in values]
+                    found[col[apid]] = True
+            complete &= found
+            offset += len(loci)
+        return ids, block, complete
+
+    def _fetch(self, conn, after_id):
+        """
+        yield (ids, [loci, n] int32 block, incomplete ids, last id read) of allele profiles with id > after_id in
+        id order.
+        Profiles missing from a table other than table 0 (still being written, or left by a run that failed part
+        way through addApForScheme) are left out of the block and returned as incomplete
+        """
+        last = after_id
+        while True:
+            cur = conn.cursor()
+            cur.execute('SELECT "id", "{cols}" FROM "{table}" WHERE "id" > {last} ORDER BY "id" LIMIT {n};'.format(
+                cols='","'.join(self.tables[0]), table=self._table(0), last=last, n=FETCH_ROWS))
+            res = cur.fetchall()
+            cur.close()
+            if not res:
+                return
+            ids, block, complete = self._read_block(conn, res, '"main_id" > {} AND "main_id" <= {}'.format(
+                last, int(res[-1][0])))
+            last = int(ids[-1])
+            yield ids[complete], block[:, complete], ids[~complete].tolist(), last
+
+    def _fetch_pending(self, conn, pending):
+        """
+        :param pending: ids of allele profiles that were incomplete on an earlier sync
+        :return: (ids, [loci, n] int32 block, ids still incomplete) profiles removed from table 0 are dropped
+        """
+        if not pending:
+            return np.zeros(0, dtype=np.int64), np.zeros((len(self.loci), 0), dtype=np.int32), []
+        idlist = ",".join(str(int(x)) for x in pending)
+        cur = conn.cursor()
+        cur.execute('SELECT "id", "{cols}" FROM "{table}" WHERE "id" IN ({ids}) ORDER BY "id";'.format(
+            cols='","'.join(self.tables[0]), table=self._table(0), ids=idlist))
+        res = cur.fetchall()
+        cur.close()
+        if not res:
+            return np.zeros(0, dtype=np.int64), np.zeros((len(self.loci), 0), dtype=np.int32), []
+        ids, block, complete = self._read_block(conn, res, '"main_id" IN ({})'.format(idlist))
+        return ids[complete], block[:, complete], ids[~complete].tolist()
+
+    def _append(self, rows, ids, block):
+        """
+        write allele profiles into the matrix after its first rows columns (reallocating if full)
+
+        :return: rows in the matrix
+        """
+        if not len(ids):
+            return rows
+        capacity = np.load(self.ids_path, mmap_mode="r").shape[0]
+        if rows + len(ids) > capacity:
+            self._allocate(max(capacity * 2, rows + len(ids)), rows)
+        matrix = np.load(self.matrix_path, mmap_mode="r+")
+        id_arr = np.load(self.ids_path, mmap_mode="r+")
+        matrix[:, rows:rows + len(ids)] = block
+        id_arr[rows:rows + len(ids)] = ids
+        matrix.flush()
+        id_arr.flush()
+        del matrix, id_arr
+        return rows + len(ids)
+
+    def sync(self, conn):
+        """
+        bring the cached matrix up to date with the database (append new allele profiles or rebuild) and load it
+
+        :param conn: psycopg2 connection
+        :return: number of allele profiles added to the cache
+        """
+        lockf = open(self.lock_path, "w")
+        fcntl.flock(lockf, fcntl.LOCK_EX)  # other Allele_to_mgt_db.py runs wait while the files are written
+        try:
+            meta = self._read_meta()
+            rows, max_id, pending = (meta["rows"], meta["max_id"], meta.get("pending", [])) if meta else (0, 0, [])
+
+            cur = conn.cursor()
+            cur.execute('SELECT COUNT(*), COALESCE(MAX("id"), 0), COUNT(*) FILTER (WHERE "id" <= {}) FROM "{}";'.format(
+                max_id, self._table(0)))
+            db_rows, db_max_id, db_rows_old = cur.fetchone()
+            cur.close()
+
+            if meta is None or db_rows_old != rows + len(pending):
+                # no cache yet, loci changed or profiles removed: rebuild from scratch
+                rows, max_id, pending = 0, 0, []
+                self._allocate(max(int(db_rows * 1.5), 1024))
+                self._write_meta(0, 0, [])
+
+            # incomplete profiles are skipped and checked again on every sync so one never holds back the rest
+            ids, block, pending = self._fetch_pending(conn, pending)
+            rows = self._append(rows, ids, block)
+            added = len(ids)
+            self._write_meta(rows, max_id, pending)
+            if db_max_id > max_id:
+                for ids, block, incomplete, max_id in self._fetch(conn, max_id):
+                    rows = self._append(rows, ids, block)
+                    added += len(ids)
+                    pending += incomplete
+                    self._write_meta(rows, max_id, pending)
+
+            self.rows = rows
+            self.matrix = np.load(self.matrix_path, mmap_mode="r")
+            self.ids = np.load(self.ids_path, mmap_mode="r")
+        finally:
+            fcntl.flock(lockf, fcntl.LOCK_UN)
+            lockf.close()
+        return added
+
+    def mismatches(self, query, loci, allowdiff, first_chunks=(12, 12, 12), chunk=50):
+        """
+        compare a query profile to every cached allele profile, most variable loci first so that profiles
+        with more than allowdiff mismatches are dropped early
+
+        :param query: {locus column: int allele (0 = no call)}
+        :param loci: locus columns to compare in comparison order (most variable first)
+        :param allowdiff: maximum mismatches for a profile to be kept
+        :param first_chunks: sizes of the first locus chunks (small so most profiles are dropped early)
+        :param chunk: size of the later locus chunks
+        :return: ({ap id (str): [(query allele, profile allele) mismatches]}, {ap id (str): zero calls})
+        """
+        cols = np.array([self.locus_index[x] for x in loci], dtype=np.int64)
+        qvals = np.array([query[x] for x in loci], dtype=np.int32)
+
+        bounds = [0]
+        for size in first_chunks:
+            bounds.append(min(bounds[-1] + size, len(cols)))
+        while bounds[-1] < len(cols):
+            bounds.append(min(bounds[-1] + chunk, len(cols)))
+
+        cand = np.arange(self.rows)
+        nmiss = np.zeros(self.rows, dtype=np.int32)
+        nzero = np.zeros(self.rows, dtype=np.int32)
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+            if len(cand) == self.rows:
+                block = self.matrix[:, :self.rows][cols[start:end]]
+            else:
+                # np.ix_ reads only the candidate columns of the chunk's loci (not every column of those loci)
+                block = self.matrix[np.ix_(cols[start:end], cand)]
+            q = qvals[start:end, None]
+            zero = (block == 0) | (q == 0)
+            nmiss += ((block != q) & ~zero).sum(axis=0, dtype=np.int32)
+            nzero += zero.sum(axis=0, dtype=np.int32)
+            keep = nmiss <= allowdiff
+            cand, nmiss, nzero = cand[keep], nmiss[keep], nzero[keep]
+            if len(cand) == 0:
+                break
+
+        idmissmatchcounts = {}
+        zerocounts = {}
+        if len(cand):
+            block = self.matrix[np.ix_(cols, cand)]
+            differ = (block != qvals[:, None]) & (block != 0) & (qvals[:, None] != 0)
+            for pos in range(len(cand)):
+                apid = str(int(self.ids[cand[pos]]))
+                rows = np.nonzero(differ[:, pos])[0]
+                idmissmatchcounts[apid] = [(str(qvals[x]), str(block[x, pos])) for x in rows]
+                zerocounts[apid] = int(nzero[pos])
+        return idmissmatchcounts, zerocounts
@@ -0,0 +1,64 @@
+"""
+Add and fill the canonical_id column of the clonal complex and ODC tables ("{app}_cc1_{lev}", "{app}_cc2_{lev}") of
+an existing database
+
+canonical_id is the lowest identifier of a cc's merge group (see cc_merges.py). Once a table has it, all ccs merged
+with a cc are one indexed lookup for Allele_to_mgt_db.py and the website instead of following merge_id chains.
+addClonalComplexes keeps it up to date for new ccs and merges, so this only needs to be run once per database
+(rerunning recalculates every canonical_id from the merge_id links).
+
+usage: python3 backfill_canonical_ids.py Salmonella -s <settings>
+"""
+
+import argparse
+import sys
+from os import path
+
+import psycopg2
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.MgtAllele2Db.Allele_to_mgt_db import load_settings, sqlquery_to_outls
+from MGT_processing.MgtAllele2Db.cc_merges import backfill_canonical
+
+
+def parseargs():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("appname", help="Name of database (i.e. Salmonella)")
+    parser.add_argument("-s", "--settings", help="name of settings file to use (minus '.py')")
+    parser.add_argument("--local",
+                        help="use psql_details['HOST'] from settings for postgres host rather than NONLOCALHOST variable in settings",
+                        action='store_true')
+    return parser.parse_args()
+
+
+def main():
+    args = parseargs()
+    settings = load_settings(args)
+
+    database = settings.APPS_DATABASE_MAPPING[args.appname]
+    psql_details = settings.DATABASES[database]
+    if not args.local:
+        host = settings.NONLOCALHOST
+    else:
+        host = psql_details['HOST']
+
+    DbConString = "dbname='{0}' host='{1}' port='{2}' user='{3}' password='{4}'".format(psql_details['NAME'], host, psql_details['PORT'], psql_details['USER'], psql_details['PASSWORD'])
+    conn = psycopg2.connect(DbConString)
+    conn.autocommit = True
+
+    cctables = [x[0] for x in sqlquery_to_outls(conn, 'SELECT "table_name" FROM "{}_tables_cc";'.format(args.appname))]
+
+    conn.autocommit = False  # each table filled in one transaction
+    for cctable in sorted(cctables):
+        cur = conn.cursor()
+        nccs, ngroups = backfill_canonical(cur, "{}_{}".format(args.appname, cctable))
+        cur.close()
+        conn.commit()
+        print("{}: {} ccs, {} merge groups".format(cctable, nccs, ngroups))
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Add and fill the profile_hash column of the allele profile tables ("{app}_ap{lev}_0") of an existing database
+
+profile_hash is the md5 of a whole allele profile (genProfileHash in UpdateScripts/addAllelicProfiles.py). Once
+every profile of a level has one, detect_exact_ap_matches in Allele_to_mgt_db.py finds exact matches with a
+single indexed lookup instead of comparing every locus column. New profiles get their hash from addApForScheme,
+so this only needs to be run once per database (rerunning only fills profiles still missing a hash).
+
+usage: python3 backfill_profile_hash.py Salmonella -s <settings>
+"""
+
+import argparse
+import sys
+from os import path
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.MgtAllele2Db.Allele_to_mgt_db import get_table_nos, load_settings, sqlquery_to_outls
+from MGT_processing.MgtAllele2Db.UpdateScripts.addAllelicProfiles import genProfileHash, PROFILE_HASH_COL
+
+BATCH_ROWS = 5000  # allele profiles hashed and updated per batch
+
+
+def add_hash_column(conn, table):
+    """
+    :param conn: psycopg2 connection
+    :param table: allele profile table 0 of a level
+    """
+    cur = conn.cursor()
+    cur.execute('ALTER TABLE "{}" ADD COLUMN IF NOT EXISTS "{}" varchar(32) NULL;'.format(table, PROFILE_HASH_COL))
+    cur.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ("{1}");'.format(table, PROFILE_HASH_COL))
+    cur.close()
+
+
+def backfill_level(conn, appname, level, tables):
+    """
+    :param conn: psycopg2 connection
+    :param appname: database app name (i.e. Salmonella)
+    :param level: MGT level
+    :param tables: {table number: [locus columns]} of the level (from get_table_nos)
+    :return: number of allele profiles hashed
+    """
+    table_0 = "{}_ap{}_0".format(appname, level)
+    add_hash_column(conn, table_0)
+
+    done = 0
+    last = 0
+    while True:
+        res = sqlquery_to_outls(conn, 'SELECT "id", "{}" FROM "{}" WHERE "id" > {} AND "{}" IS NULL ORDER BY "id" LIMIT {};'.format(
+            '","'.join(tables[0]), table_0, last, PROFILE_HASH_COL, BATCH_ROWS))
+        if not res:
+            return done
+        profiles = {x[0]: dict(zip(tables[0], x[1:])) for x in res}
+        last = res[-1][0]
+        for no in sorted(tables.keys()):
+            if no == 0:
+                continue
+            others = sqlquery_to_outls(conn, 'SELECT "main_id", "{}" FROM "{}_ap{}_{}" WHERE "main_id" IN ({});'.format(
+                '","'.join(tables[no]), appname, level, no, ",".join(map(str, profiles.keys()))))
+            for row in others:
+                profiles[row[0]].update(zip(tables[no], row[1:]))
+
+        # profiles not yet written to every table are left for a rerun
+        nloci = sum(len(x) for x in tables.values())
+        hashes = [(genProfileHash(prof), apid) for apid, prof in profiles.items() if len(prof) == nloci]
+        cur = conn.cursor()
+        execute_values(cur, 'UPDATE "{0}" SET "{1}" = v.hash FROM (VALUES %s) AS v (hash, id) WHERE "{0}"."id" = v.id;'.format(
+            table_0, PROFILE_HASH_COL), hashes)
+        cur.close()
+        done += len(hashes)
+
+
+def parseargs():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("appname", help="Name of database (i.e. Salmonella)")
+    parser.add_argument("-s", "--settings", help="name of settings file to use (minus '.py')")
+    parser.add_argument("--levels", help="comma separated MGT levels to fill (default all)")
+    parser.add_argument("--local",
+                        help="use psql_details['HOST'] from settings for postgres host rather than NONLOCALHOST variable in settings",
+                        action='store_true')
+    return parser.parse_args()
+
+
+def main():
+    args = parseargs()
+    settings = load_settings(args)
+
+    database = settings.APPS_DATABASE_MAPPING[args.appname]
+    psql_details = settings.DATABASES[database]
+    if not args.local:
+        host = settings.NONLOCALHOST
+    else:
+        host = psql_details['HOST']
+
+    DbConString = "dbname='{0}' host='{1}' port='{2}' user='{3}' password='{4}'".format(psql_details['NAME'], host, psql_details['PORT'], psql_details['USER'], psql_details['PASSWORD'])
+    conn = psycopg2.connect(DbConString)
+    conn.autocommit = True
+
+    tablesdict = get_table_nos(conn, args)
+    levels = sorted(tablesdict.keys())
+    if args.levels:
+        levels = [int(x) for x in args.levels.split(",")]
+
+    for level in levels:
+        if level not in tablesdict:
+            sys.exit("MGT{} has no allele profile tables in {}".format(level, args.appname))
+        done = backfill_level(conn, args.appname, level, tablesdict[level])
+        print("MGT{}: {} allele profiles hashed".format(level, done))
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
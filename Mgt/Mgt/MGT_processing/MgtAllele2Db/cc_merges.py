@@ -0,0 +1,182 @@
+"""
+Merge resolution for the clonal complex and ODC tables ("{app}_cc1_{lev}", "{app}_cc2_{lev}")
+
+CCs that merge are linked by merge_id chains. Every CC of a merge group gets the lowest identifier of its group in
+a canonical_id column, so all CCs merged with a CC are one indexed lookup instead of following merge_id chains one
+query per hop:
+    backfill_canonical_ids.py adds and fills the column for an existing database
+    addClonalComplexes keeps it up to date as CCs are added (add_cc) and merged (record_merge)
+
+Groups only ever join (handleMerges re-points merge_ids within the joined group), so a merge is the union of the
+two groups under the lower canonical id. UnionFind / load_merges build the same groups in memory from
+(identifier, merge_id) pairs for tables without the column.
+
+Functions take a DB-API cursor (psycopg2 or django connection cursor).
+"""
+
+CANONICAL_COL = "canonical_id"
+
+_canonical_tables = set()
+
+
+class UnionFind(object):
+
+    def __init__(self):
+        self.parent = {}
+
+    def add(self, x):
+        if x not in self.parent:
+            self.parent[x] = x
+
+    def find(self, x):
+        """
+        :return: root (lowest member) of the group of x
+        """
+        self.add(x)
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        """
+        :return: root of the joined group (the lower of the two roots)
+        """
+        roota = self.find(a)
+        rootb = self.find(b)
+        if rootb < roota:
+            roota, rootb = rootb, roota
+        self.parent[rootb] = roota
+        return roota
+
+    def groups(self):
+        """
+        :return: {root: [members]}
+        """
+        out = {}
+        for x in self.parent:
+            out.setdefault(self.find(x), []).append(x)
+        return out
+
+
+def load_merges(pairs):
+    """
+    :param pairs: (identifier, merge_id) rows of a cc table, merge_id None if the cc is not merged
+    :return: UnionFind of every cc in pairs
+    """
+    uf = UnionFind()
+    for cc, mergecc in pairs:
+        if mergecc in (None, ""):
+            uf.add(cc)
+        else:
+            uf.union(cc, mergecc)
+    return uf
+
+
+def has_canonical(cur, table):
+    """
+    :param cur: db cursor
+    :param table: cc table
+    :return: True if the table has a canonical_id column
+    """
+    if table in _canonical_tables:
+        return True
+    cur.execute('SELECT * FROM "{}" LIMIT 0;'.format(table))
+    if CANONICAL_COL in [x[0] for x in cur.description]:
+        _canonical_tables.add(table)
+        return True
+    return False
+
+
+def canonical_ready(cur, table):
+    """
+    :return: True if every cc of the table has a canonical_id (backfill_canonical_ids.py has been run)
+    """
+    if not has_canonical(cur, table):
+        return False
+    cur.execute('SELECT 1 FROM "{}" WHERE "{}" IS NULL LIMIT 1;'.format(table, CANONICAL_COL))
+    return cur.fetchone() is None
+
+
+def merged_ids(cur, table, ccs):
+    """
+    :param cur: db cursor
+    :param table: cc table with a filled canonical_id column
+    :param ccs: cc identifiers
+    :return: identifiers (str) of every cc in the table merged with any of ccs (including those of ccs in the table)
+    """
+    ccs = [int(x) for x in ccs]
+    if not ccs:
+        return []
+    cur.execute('SELECT "identifier" FROM "{0}" WHERE "{1}" IN (SELECT "{1}" FROM "{0}" WHERE "identifier" IN ({2}));'.format(
+        table, CANONICAL_COL, ",".join(map(str, ccs))))
+    return [str(x[0]) for x in cur.fetchall()]
+
+
+def merge_dict(cur, table):
+    """
+    :param cur: db cursor
+    :param table: cc table
+    :return: {cc: lowest cc of its merge group} for every cc that is part of a merge
+    """
+    if canonical_ready(cur, table):
+        cur.execute('SELECT "identifier", "{1}" FROM "{0}" WHERE "{1}" IN (SELECT "{1}" FROM "{0}" WHERE "identifier" <> "{1}");'.format(
+            table, CANONICAL_COL))
+        return dict(cur.fetchall())
+    cur.execute('SELECT "identifier", "merge_id_id" FROM "{}" WHERE "merge_id_id" IS NOT NULL;'.format(table))
+    uf = load_merges(cur.fetchall())
+    return {cc: uf.find(cc) for cc in uf.parent}
+
+
+def add_cc(cur, table, cc):
+    """
+    give a new (unmerged) cc its own identifier as canonical id (skipped if the table has no canonical_id column)
+    """
+    if has_canonical(cur, table):
+        cur.execute('UPDATE "{0}" SET "{1}" = "identifier" WHERE "identifier" = {2} AND "{1}" IS NULL;'.format(
+            table, CANONICAL_COL, int(cc)))
+
+
+def record_merge(cur, table, cc, mergecc):
+    """
+    join the merge groups of cc and mergecc under the lower canonical id (skipped if the table has no canonical_id
+    column)
+    """
+    if not has_canonical(cur, table):
+        return
+    cc = int(cc)
+    mergecc = int(mergecc)
+    cur.execute('SELECT "identifier", "{}" FROM "{}" WHERE "identifier" IN ({}, {});'.format(
+        CANONICAL_COL, table, cc, mergecc))
+    canonicals = set([cc, mergecc])
+    for identifier, canonical in cur.fetchall():
+        if canonical is not None:
+            canonicals.add(int(canonical))
+    cur.execute('UPDATE "{0}" SET "{1}" = {2} WHERE "identifier" IN ({3}, {4}) OR "{1}" IN ({5});'.format(
+        table, CANONICAL_COL, min(canonicals), cc, mergecc, ",".join(map(str, sorted(canonicals)))))
+
+
+def backfill_canonical(cur, table):
+    """
+    add the canonical_id column (and index) to a cc table if missing and set it for every cc from the merge_id links
+
+    :param cur: db cursor
+    :param table: cc table
+    :return: (number of ccs, number of merge groups with more than one cc)
+    """
+    if not has_canonical(cur, table):
+        cur.execute('ALTER TABLE "{}" ADD COLUMN "{}" integer NULL;'.format(table, CANONICAL_COL))
+        _canonical_tables.add(table)
+    cur.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ("{1}");'.format(table, CANONICAL_COL))
+
+    cur.execute('SELECT "identifier", "merge_id_id" FROM "{}";'.format(table))
+    uf = load_merges(cur.fetchall())
+    groups = [x for x in uf.groups().items() if len(x[1]) > 1]
+
+    cur.execute('UPDATE "{0}" SET "{1}" = "identifier";'.format(table, CANONICAL_COL))
+    for root, members in groups:
+        cur.execute('UPDATE "{}" SET "{}" = {} WHERE "identifier" IN ({});'.format(
+            table, CANONICAL_COL, root, ",".join(map(str, members))))
+    return len(uf.parent), len(groups)
@@ -0,0 +1,293 @@
+"""
+Next allele/ST number counters ("{app}_counters" table) used by Allele_to_mgt_db.py
+
+Rows are (kind, name, sub, next):
+    allele      locus                       next positive allele number
+    negallele   locus, positive allele      next negative allele suffix (-<allele>_<suffix>)
+    st          level                       next ST
+    dst         level, ST                   next dST
+    posallele   locus                       one more than the highest positive allele assigned (variability ranking)
+
+Numbers are claimed with a single UPDATE ... RETURNING so concurrent runs never get the same number and the
+allele and allele profile tables are not scanned. A counter missing from the table is seeded from the existing
+alleles/allele profiles the first time it is used (--query runs only read: a missing counter or table is worked
+out from the existing data without being stored). Numbers claimed by a run that then fails are not reused.
+Each claimed number is looked up in the allele/allele profile table: if alleles or allele profiles were added
+other than through Allele_to_mgt_db.py and the number is already used, the counter is re-seeded from the existing
+data and the number claimed again (rebuild_counters.py brings every counter up to date at once).
+
+Loci are ranked by variability for allele profile matching from the posallele counters (locus_allele_counters).
+These only count positive alleles: the allele counters also count the positive part of negative alleles (-7_1 uses
+7), so a locus with only negative alleles would rank as variable.
+"""
+
+_counter_tables = set()
+
+
+def counter_table(appname):
+    return "{}_counters".format(appname)
+
+
+def ensure_counter_table(conn, appname, create=True):
+    """
+    :param conn: psycopg2 connection (autocommit, a failed check must not abort the transaction)
+    :param appname: database app name (i.e. Salmonella)
+    :param create: create the table if missing (False only checks it exists, i.e. for --query runs)
+    :return: True if the table exists
+    """
+    if appname in _counter_tables:
+        return True
+    cur = conn.cursor()
+    if create:
+        cur.execute("""CREATE TABLE IF NOT EXISTS "{}" ("kind" varchar(10) NOT NULL, "name" varchar(100) NOT NULL,
+                    "sub" varchar(50) NOT NULL DEFAULT '', "next" integer NOT NULL, PRIMARY KEY ("kind", "name", "sub"));""".format(
+            counter_table(appname)))
+    else:
+        try:
+            cur.execute("""SELECT 1 FROM "{}" LIMIT 0;""".format(counter_table(appname)))
+        except Exception:
+            cur.close()
+            return False
+    cur.close()
+    _counter_tables.add(appname)
+    return True
+
+
+def next_value(conn, appname, kind, name, seed, sub="", claim=True, taken=None):
+    """
+    :param conn: psycopg2 connection
+    :param appname: database app name (i.e. Salmonella)
+    :param kind: allele, negallele, st or dst
+    :param name: locus or level
+    :param seed: function returning the next number from existing data, called if the counter does not exist yet
+    or the number claimed is taken
+    :param sub: positive allele (negallele) or ST (dst)
+    :param claim: take the number (False only reads it, i.e. for --query runs, a missing counter is worked out
+    from seed without being stored)
+    :param taken: function returning True if a claimed number is already used in the allele/allele profile table
+    :return: next number (int)
+    """
+    if not ensure_counter_table(conn, appname, create=claim):
+        return int(seed())
+    where = """"kind" = '{}' AND "name" = '{}' AND "sub" = '{}'""".format(kind, name, sub)
+    if claim:
+        query = """UPDATE "{}" SET "next" = "next" + 1 WHERE {} RETURNING "next" - 1;""".format(counter_table(appname), where)
+    else:
+        query = """SELECT "next" FROM "{}" WHERE {};""".format(counter_table(appname), where)
+    cur = conn.cursor()
+    cur.execute(query)
+    res = cur.fetchone()
+    if res is None and not claim:
+        cur.close()
+        return int(seed())
+    if res is None:
+        cur.execute("""INSERT INTO "{}" ("kind", "name", "sub", "next") VALUES ('{}', '{}', '{}', {}) ON CONFLICT DO NOTHING;""".format(
+            counter_table(appname), kind, name, sub, int(seed())))
+        cur.execute(query)
+        res = cur.fetchone()
+    # counter is behind the existing data, move it past them and claim again
+    while claim and taken is not None and taken(int(res[0])):
+        reseed = int(seed())
+        cur.execute("""UPDATE "{}" SET "next" = {} WHERE {} AND "next" < {};""".format(
+            counter_table(appname), reseed, where, reseed))
+        cur.execute(query)
+        res = cur.fetchone()
+    cur.close()
+    return int(res[0])
+
+
+def allele_counters(identifiers):
+    """
+    :param identifiers: allele identifiers of a locus ("5", "-5_2" ...)
+    :return: (next positive allele number, {positive allele: next negative suffix})
+    """
+    nextneg = {}
+    for allele in identifiers:
+        allelesub = allele.replace("-", "").split("_")
+        pallele = allelesub[0]
+        if pallele == "":
+            continue
+        if pallele not in nextneg:
+            nextneg[pallele] = 1
+        if len(allelesub) > 1 and int(allelesub[1]) >= nextneg[pallele]:
+            nextneg[pallele] = int(allelesub[1]) + 1
+    nextpos = max([int(x) for x in nextneg] + [0]) + 1
+    return nextpos, nextneg
+
+
+def pos_allele_counter(identifiers):
+    """
+    :param identifiers: allele identifiers of a locus ("5", "-5_2" ...)
+    :return: one more than the highest positive allele number (1 if there are none)
+    """
+    return max([int(x) for x in identifiers if x != "" and not x.startswith("-")] + [0]) + 1
+
+
+def locus_identifiers(conn, appname, locus):
+    cur = conn.cursor()
+    cur.execute("""SELECT "identifier" FROM "{}_allele" WHERE "locus_id" = '{}';""".format(appname, locus))
+    res = [x[0] for x in cur.fetchall()]
+    cur.close()
+    return res
+
+
+def exists(conn, query):
+    cur = conn.cursor()
+    cur.execute(query)
+    res = cur.fetchone()
+    cur.close()
+    return res is not None
+
+
+def next_allele(conn, appname, locus, claim=True):
+    """
+    :return: next positive allele number of a locus
+    """
+    # a negative allele (-5_1) uses its positive allele number as allele_counters does
+    def taken(allele):
+        return exists(conn, """SELECT 1 FROM "{}_allele" WHERE "locus_id" = '{}' AND ("identifier" = '{}' OR
+                      "identifier" LIKE '-{}!_%' ESCAPE '!') LIMIT 1;""".format(appname, locus, allele, allele))
+    return next_value(conn, appname, "allele", locus,
+                      lambda: allele_counters(locus_identifiers(conn, appname, locus))[0], claim=claim, taken=taken)
+
+
+def next_neg_allele(conn, appname, locus, posallele, claim=True):
+    """
+    :return: next negative allele suffix for a positive allele of a locus
+    """
+    return next_value(conn, appname, "negallele", locus,
+                      lambda: allele_counters(locus_identifiers(conn, appname, locus))[1].get(str(posallele), 1),
+                      sub=str(posallele), claim=claim,
+                      taken=lambda suffix: exists(conn, """SELECT 1 FROM "{}_allele" WHERE "locus_id" = '{}' AND
+                      "identifier" = '-{}_{}' LIMIT 1;""".format(appname, locus, posallele, suffix)))
+
+
+def next_st(conn, appname, level, claim=True):
+    """
+    :return: next ST of a level
+    """
+    def seed():
+        cur = conn.cursor()
+        cur.execute("""SELECT MAX("st") FROM "{}_ap{}_0";""".format(appname, level))
+        res = cur.fetchone()
+        cur.close()
+        return (res[0] or 0) + 1
+    return next_value(conn, appname, "st", str(level), seed, claim=claim,
+                      taken=lambda st: exists(conn, """SELECT 1 FROM "{}_ap{}_0" WHERE "st" = {} LIMIT 1;""".format(
+                          appname, level, st)))
+
+
+def next_dst(conn, appname, level, st, claim=True):
+    """
+    :return: next dST of an ST of a level
+    """
+    def seed():
+        cur = conn.cursor()
+        cur.execute("""SELECT MAX("dst") FROM "{}_ap{}_0" WHERE "st" = {};""".format(appname, level, st))
+        res = cur.fetchone()
+        cur.close()
+        return (res[0] or 0) + 1
+    return next_value(conn, appname, "dst", str(level), seed, sub=str(st), claim=claim,
+                      taken=lambda dst: exists(conn, """SELECT 1 FROM "{}_ap{}_0" WHERE "st" = {} AND "dst" = {} LIMIT 1;""".format(
+                          appname, level, st, dst)))
+
+
+def note_pos_allele(conn, appname, locus, allele):
+    """
+    move the posallele counter of a locus past a newly assigned positive allele
+
+    :param conn: psycopg2 connection
+    :param appname: database app name (i.e. Salmonella)
+    :param locus: locus
+    :param allele: positive allele number
+    """
+    ensure_counter_table(conn, appname)
+    where = """"kind" = 'posallele' AND "name" = '{}' AND "sub" = ''""".format(locus)
+    cur = conn.cursor()
+    cur.execute("""SELECT 1 FROM "{}" WHERE {};""".format(counter_table(appname), where))
+    if cur.fetchone() is None:
+        cur.execute("""INSERT INTO "{}" ("kind", "name", "sub", "next") VALUES ('posallele', '{}', '', {}) ON CONFLICT DO NOTHING;""".format(
+            counter_table(appname), locus, pos_allele_counter(locus_identifiers(conn, appname, locus))))
+    cur.execute("""UPDATE "{}" SET "next" = {} WHERE {} AND "next" < {};""".format(
+        counter_table(appname), int(allele) + 1, where, int(allele) + 1))
+    cur.close()
+
+
+def locus_allele_counters(conn, appname, write=True):
+    """
+    one more than the highest positive allele number of every locus, as a measure of how variable each locus is
+    (get_mostvariable). Counters missing for some loci are seeded from those loci's alleles only, so the allele table
+    is read once per locus at most
+
+    :param conn: psycopg2 connection
+    :param appname: database app name (i.e. Salmonella)
+    :param write: store the seeded counters (False leaves the database untouched, i.e. for --query runs)
+    :return: {locus: one more than the highest positive allele number (1 if there are none)}
+    """
+    cur = conn.cursor()
+    query = """SELECT "name", "next" FROM "{}" WHERE "kind" = 'posallele';""".format(counter_table(appname))
+    if ensure_counter_table(conn, appname, create=write):
+        cur.execute(query)
+        nextpos = dict(cur.fetchall())
+    else:
+        nextpos = {}
+    cur.execute("""SELECT "identifier" FROM "{}_locus";""".format(appname))
+    missing = [x[0] for x in cur.fetchall() if x[0] not in nextpos]
+    if missing:
+        cur.execute("""SELECT "locus_id", "identifier" FROM "{}_allele" WHERE "locus_id" IN ('{}');""".format(
+            appname, "','".join(missing)))
+        identifiers = {locus: [] for locus in missing}
+        for locus, allele in cur.fetchall():
+            identifiers[locus].append(allele)
+        if not write:
+            for locus in missing:
+                nextpos[locus] = pos_allele_counter(identifiers[locus])
+            cur.close()
+            return nextpos
+        for locus in missing:
+            cur.execute("""INSERT INTO "{}" ("kind", "name", "sub", "next") VALUES ('posallele', '{}', '', {}) ON CONFLICT DO NOTHING;""".format(
+                counter_table(appname), locus, pos_allele_counter(identifiers[locus])))
+        cur.execute(query)
+        nextpos = dict(cur.fetchall())
+    cur.close()
+    return nextpos
+
+
+def rebuild_counters(conn, appname, levels):
+    """
+    recalculate every counter from the allele and allele profile tables (in one transaction)
+
+    :param conn: psycopg2 connection
+    :param appname: database app name (i.e. Salmonella)
+    :param levels: MGT levels with allele profile tables
+    :return: {kind: number of counters}
+    """
+    ensure_counter_table(conn, appname)
+    rows = []
+    cur = conn.cursor()
+    cur.execute("""SELECT "locus_id", "identifier" FROM "{}_allele";""".format(appname))
+    identifiers = {}
+    for locus, allele in cur.fetchall():
+        identifiers.setdefault(locus, []).append(allele)
+    for locus in identifiers:
+        nextpos, nextneg = allele_counters(identifiers[locus])
+        rows.append(("allele", locus, "", nextpos))
+        rows.append(("posallele", locus, "", pos_allele_counter(identifiers[locus])))
+        rows += [("negallele", locus, pallele, nextneg[pallele]) for pallele in nextneg]
+
+    for level in levels:
+        cur.execute("""SELECT "st", MAX("dst") FROM "{}_ap{}_0" GROUP BY "st";""".format(appname, level))
+        res = cur.fetchall()
+        rows.append(("st", str(level), "", max([x[0] for x in res] + [0]) + 1))
+        rows += [("dst", str(level), str(st), maxdst + 1) for st, maxdst in res]
+
+    cur.execute("""DELETE FROM "{}";""".format(counter_table(appname)))
+    cur.executemany("""INSERT INTO "{}" ("kind", "name", "sub", "next") VALUES (%s, %s, %s, %s);""".format(
+        counter_table(appname)), rows)
+    cur.close()
+    conn.commit()
+
+    counts = {}
+    for row in rows:
+        counts[row[0]] = counts.get(row[0], 0) + 1
+    return counts
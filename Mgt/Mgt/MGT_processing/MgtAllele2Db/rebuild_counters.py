@@ -0,0 +1,57 @@
+"""
+Recalculate the next allele/ST number counters ("{app}_counters", see counters.py) from the allele and allele
+profile tables. Run after alleles or allele profiles are added other than by Allele_to_mgt_db.py (or to create
+every counter up front), while no Allele_to_mgt_db.py run is assigning.
+
+usage: python3 rebuild_counters.py Salmonella -s <settings>
+"""
+
+import argparse
+import sys
+from os import path
+
+import psycopg2
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.MgtAllele2Db.Allele_to_mgt_db import get_table_nos, load_settings
+from MGT_processing.MgtAllele2Db.counters import rebuild_counters
+
+
+def parseargs():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("appname", help="Name of database (i.e. Salmonella)")
+    parser.add_argument("-s", "--settings", help="name of settings file to use (minus '.py')")
+    parser.add_argument("--local",
+                        help="use psql_details['HOST'] from settings for postgres host rather than NONLOCALHOST variable in settings",
+                        action='store_true')
+    return parser.parse_args()
+
+
+def main():
+    args = parseargs()
+    settings = load_settings(args)
+
+    database = settings.APPS_DATABASE_MAPPING[args.appname]
+    psql_details = settings.DATABASES[database]
+    if not args.local:
+        host = settings.NONLOCALHOST
+    else:
+        host = psql_details['HOST']
+
+    DbConString = "dbname='{0}' host='{1}' port='{2}' user='{3}' password='{4}'".format(psql_details['NAME'], host, psql_details['PORT'], psql_details['USER'], psql_details['PASSWORD'])
+    conn = psycopg2.connect(DbConString)
+    conn.autocommit = True
+
+    levels = sorted(get_table_nos(conn, args).keys())
+
+    conn.autocommit = False  # counters replaced in one transaction
+    counts = rebuild_counters(conn, args.appname, levels)
+    for kind in sorted(counts):
+        print("{}: {} counters".format(kind, counts[kind]))
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Assembly statistics of a genome (replaces the assembly-stats tool), from the ContigStore the pipeline already
+holds (from_store, used by post_assembly_qc) or in one streaming pass over a fasta (from_fasta, command line).
+
+AssemblyStats holds the values assem_filter() checks (sum, n, largest, N50) as well as N90, L50/L90,
+GC and N content. to_text() gives the same layout assembly-stats prints so <strain>_assembly_stats.txt
+files stay comparable with older runs.
+
+usage (prints stats of each genome, i.e. to pre-screen public assemblies):
+    python assembly_stats.py genome1.fasta [genome2.fasta ...]
+"""
+
+import re
+import sys
+
+_NRUN = re.compile(b"[Nn]+")
+
+
+class AssemblyStats(object):
+    __slots__ = ("filename", "lengths", "sum", "n", "largest", "shortest", "n_count", "gaps", "gc_count")
+
+    def __init__(self, filename, lengths, n_count=0, gaps=0, gc_count=0):
+        """
+        :param filename: genome path (used in text output only)
+        :param lengths: contig lengths
+        :param n_count: number of N bases
+        :param gaps: number of runs of Ns
+        :param gc_count: number of G/C bases
+        """
+        self.filename = filename
+        self.lengths = sorted(lengths, reverse=True)
+        self.sum = sum(self.lengths)
+        self.n = len(self.lengths)
+        self.largest = self.lengths[0] if self.lengths else 0
+        self.shortest = self.lengths[-1] if self.lengths else 0
+        self.n_count = n_count
+        self.gaps = gaps
+        self.gc_count = gc_count
+
+    @classmethod
+    def from_fasta(cls, path):
+        """
+        :param path: genome fasta
+        :return: AssemblyStats
+        """
+        lengths = []
+        n_count = gaps = gc_count = 0
+        length = None
+        in_nrun = False  # previous base was N, runs of N can continue over line breaks
+        with open(path, "rb") as f:
+            for line in f:
+                if line.startswith(b">"):
+                    if length is not None:
+                        lengths.append(length)
+                    length = 0
+                    in_nrun = False
+                    continue
+                line = line.rstrip(b"\r\n")
+                if not line:
+                    continue
+                if length is None:
+                    length = 0
+                length += len(line)
+                gc_count += line.count(b"G") + line.count(b"C") + line.count(b"g") + line.count(b"c")
+                for run in _NRUN.finditer(line):
+                    n_count += run.end() - run.start()
+                    if not (run.start() == 0 and in_nrun):
+                        gaps += 1
+                in_nrun = line[-1:] in (b"N", b"n")
+        if length is not None:
+            lengths.append(length)
+        return cls(path, lengths, n_count, gaps, gc_count)
+
+    @classmethod
+    def from_store(cls, store):
+        """
+        :param store: ContigStore already holding the genome (no extra read of the fasta)
+        :return: AssemblyStats
+        """
+        lengths = []
+        n_count = gaps = gc_count = 0
+        for contig in store:
+            seq = store.raw(contig)
+            lengths.append(len(seq))
+            gc_count += seq.count(b"G") + seq.count(b"C") + seq.count(b"g") + seq.count(b"c")
+            for run in _NRUN.finditer(seq):
+                n_count += run.end() - run.start()
+                gaps += 1
+        return cls(store.path, lengths, n_count, gaps, gc_count)
+
+    ######## derived values ########
+
+    @property
+    def ave(self):
+        return float(self.sum) / self.n if self.n else 0.0
+
+    @property
+    def gc(self):
+        """
+        :return: GC fraction of non N bases
+        """
+        acgt = self.sum - self.n_count
+        return float(self.gc_count) / acgt if acgt else 0.0
+
+    def nx(self, x):
+        """
+        :param x: percentage i.e. 50 for N50
+        :return: (Nx, Lx) length of the contig that takes the cumulative length over x% and number of contigs needed
+        """
+        if not self.lengths:
+            return 0, 0
+        target = self.sum * x / 100.0
+        total = 0
+        for count, length in enumerate(self.lengths, 1):
+            total += length
+            if total >= target:
+                return length, count
+        return self.lengths[-1], self.n
+
+    @property
+    def n50(self):
+        return self.nx(50)[0]
+
+    @property
+    def l50(self):
+        return self.nx(50)[1]
+
+    @property
+    def n90(self):
+        return self.nx(90)[0]
+
+    @property
+    def l90(self):
+        return self.nx(90)[1]
+
+    def to_text(self):
+        """
+        :return: stats in the assembly-stats text layout
+        """
+        lines = ["stats for {}".format(self.filename),
+                 "sum = {}, n = {}, ave = {:.2f}, largest = {}".format(self.sum, self.n, self.ave, self.largest)]
+        for x in (50, 60, 70, 80, 90, 100):
+            lines.append("N{} = {}, n = {}".format(x, *self.nx(x)))
+        lines.append("N_count = {}".format(self.n_count))
+        lines.append("Gaps = {}".format(self.gaps))
+        return "\n".join(lines) + "\n"
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    for path in sys.argv[1:]:
+        stats = AssemblyStats.from_fasta(path)
+        print(stats.to_text() + "GC = {:.4f}\n".format(stats.gc))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Streaming parser for tabular (-outfmt 6) blastn output.
+
+Parsed hits use the same result -> alignment -> hsp layout and attribute names as
+Bio.Blast.NCBIXML records so reads_to_alleles.py can use either without changes:
+
+result attributes: 'query', 'alignments'
+    alignment attributes: 'hit_def', 'hsps'
+        hsp attributes: 'align_length', 'bits', 'expect', 'gaps', 'identities', 'match', 'positives', 'query',
+                        'query_end', 'query_start', 'sbjct', 'sbjct_end', 'sbjct_start', 'score'
+
+Only columns needed for allele calling are requested and records use __slots__, so memory use
+follows the number of hsps rather than the size of the XML.
+"""
+
+TAB_FIELDS = ["qseqid", "stitle", "length", "nident", "gaps", "positive", "score", "bitscore", "evalue",
+              "qstart", "qend", "sstart", "send", "qseq", "sseq"]
+
+OUTFMT = "6 " + " ".join(TAB_FIELDS)
+
+
+class TabHsp(object):
+    __slots__ = ("align_length", "identities", "gaps", "positives", "score", "bits", "expect",
+                 "query_start", "query_end", "sbjct_start", "sbjct_end", "query", "sbjct", "match")
+
+    def __init__(self, align_length, identities, gaps, positives, score, bits, expect,
+                 query_start, query_end, sbjct_start, sbjct_end, query, sbjct):
+        self.align_length = align_length
+        self.identities = identities
+        self.gaps = gaps
+        self.positives = positives
+        self.score = score
+        self.bits = bits
+        self.expect = expect
+        self.query_start = query_start
+        self.query_end = query_end
+        self.sbjct_start = sbjct_start
+        self.sbjct_end = sbjct_end
+        self.query = query
+        self.sbjct = sbjct
+        self.match = midline(query, sbjct)
+
+
+class TabAlignment(object):
+    __slots__ = ("hit_def", "hsps")
+
+    def __init__(self, hit_def):
+        self.hit_def = hit_def
+        self.hsps = []
+
+
+class TabResult(object):
+    __slots__ = ("query", "alignments")
+
+    def __init__(self, query):
+        self.query = query
+        self.alignments = []
+
+
+def midline(query, sbjct):
+    """
+    rebuild the XML Hsp_midline: "|" for identical bases, " " for mismatches and gaps
+
+    :param query: aligned query string
+    :param sbjct: aligned subject string
+    :return: midline string of same length
+    """
+    return "".join("|" if q == s and q != "-" else " " for q, s in zip(query.upper(), sbjct.upper()))
+
+
+def parse_blast_tabular(handle):
+    """
+    yields one TabResult per query sequence with hits, in blast output order
+    (alignments in order of first appearance, hsps in output order)
+
+    :param handle: open handle to blastn output made with -outfmt OUTFMT
+    :return: generator of TabResult
+    """
+    result = None
+    alignments = {}
+    for line in handle:
+        if not line.strip() or line.startswith("#"):
+            continue
+        col = line.rstrip("\n").split("\t")
+        qseqid, stitle = col[0], col[1]
+
+        if result is None or result.query != qseqid:
+            if result is not None:
+                yield result
+            result = TabResult(qseqid)
+            alignments = {}
+
+        if stitle not in alignments:
+            alignments[stitle] = TabAlignment(stitle)
+            result.alignments.append(alignments[stitle])
+
+        alignments[stitle].hsps.append(TabHsp(int(col[2]), int(col[3]), int(col[4]), int(col[5]), float(col[6]),
+                                              float(col[7]), float(col[8]), int(col[9]), int(col[10]),
+                                              int(col[11]), int(col[12]), col[13], col[14]))
+    if result is not None:
+        yield result
@@ -0,0 +1,127 @@
+"""
+Per genome record of allele calling, written as <strain>_calls.json.gz next to <strain>_alleles.fasta
+
+The record holds what the alleles file was made from: the number of reference alleles of every locus at
+calling time, exact calls, reconstructed ("new") sequences, uncallable reasons, loci without BLAST hits and
+the result cache key of the alleles file (if it was cached).
+
+Reference alleles are only ever added to, so when the reference allele file grows the loci that changed
+are those with a different allele count. reads_to_alleles.py --intype recall re-evaluates only those loci:
+"new" calls without Ns are looked up by exact sequence in the current alleles and promoted to the named
+allele, with no assembly or BLAST needed. Changed loci that were uncallable or had no BLAST hits, or whose
+called allele is gone, can only be called again from the genome and are returned as needing a full rerun
+(no hsps are kept: re-scoring them against the new alleles would need the contig sequences anyway).
+"""
+
+import gzip
+import json
+
+RECORD_VERSION = 1
+
+
+def calls_record_path(alleles_path):
+    """
+    :param alleles_path: <strain>_alleles.fasta path
+    :return: <strain>_calls.json.gz path
+    """
+    if alleles_path.endswith("_alleles.fasta"):
+        return alleles_path[:-len("_alleles.fasta")] + "_calls.json.gz"
+    return alleles_path + "_calls.json.gz"
+
+
+def allele_counts(seqs):
+    """
+    :param seqs: {locus:{allele id:seq}} from get_allowed_locus_sizes
+    :return: {locus: number of reference alleles}
+    """
+    return {locus: len(seqs[locus]) for locus in seqs}
+
+
+def write_call_record(path, strain, seqs, locus_list, mgt1st, serotype, ref, reconstructed, uncall, no_hits,
+                      cache_key=None):
+    """
+    :param path: record path from calls_record_path()
+    :param strain: strain name
+    :param seqs: {locus:{allele id:seq}} the calls were made against
+    :param locus_list: loci in alleles file order
+    :param mgt1st: 7 gene ST
+    :param serotype: species/serotype
+    :param ref: {locus:allele number} exact calls
+    :param reconstructed: {locus:seq} reconstructed loci (only those written as new are kept)
+    :param uncall: {locus:reason} uncallable loci
+    :param no_hits: loci without BLAST hits
+    :param cache_key: result cache key of the alleles file (None if not cached)
+    """
+    record = {
+        "version": RECORD_VERSION,
+        "strain": strain,
+        "mgt1st": mgt1st,
+        "serotype": serotype,
+        "loci": list(locus_list),
+        "allele_counts": allele_counts(seqs),
+        "ref": {locus: str(allele) for locus, allele in ref.items()},
+        "new": {locus: str(seq) for locus, seq in reconstructed.items() if locus not in ref and locus not in uncall},
+        "uncallable": dict(uncall),
+        "no_hits": list(no_hits),
+        "alleles_cache_key": cache_key,
+    }
+    save_call_record(path, record)
+
+
+def save_call_record(path, record):
+    """
+    :param path: record path
+    :param record: record dict
+    """
+    outf = gzip.open(path, "wt")
+    json.dump(record, outf)
+    outf.close()
+
+
+def load_call_record(path):
+    """
+    :param path: record path
+    :return: record dict, None if missing or written by an incompatible version
+    """
+    try:
+        with gzip.open(path, "rt") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if record.get("version") != RECORD_VERSION:
+        return None
+    return record
+
+
+def recall_record(record, seqs):
+    """
+    re-evaluate loci whose reference alleles changed since the record was written (updates record in place)
+
+    :param record: record from load_call_record()
+    :param seqs: current {locus:{allele id:seq}}
+    :return: (changed loci, loci promoted from new to a named allele, loci that need full re-calling: loci added
+    to the scheme, changed loci that were uncallable or had no BLAST hits, or whose called allele was removed)
+    """
+    old_counts = record["allele_counts"]
+    new_counts = allele_counts(seqs)
+    changed = [x for x in record["loci"] if old_counts.get(x) != new_counts.get(x)]
+
+    promoted = []
+    recorded = set(record["loci"])
+    rerun = [x for x in new_counts if x not in recorded]  # loci added to the scheme were never blasted
+    for locus in changed:
+        if locus not in seqs or locus in record["uncallable"] or locus in record["no_hits"]:
+            # a new reference allele may make these callable, which needs the genome
+            rerun.append(locus)
+        elif locus in record["ref"]:
+            if "{}:{}".format(locus, record["ref"][locus]) not in seqs[locus]:
+                rerun.append(locus)
+        elif locus in record["new"] and "N" not in record["new"][locus]:
+            by_seq = {str(seq): allele for allele, seq in seqs[locus].items()}
+            if record["new"][locus] in by_seq:
+                record["ref"][locus] = by_seq[record["new"][locus]].split(":")[-1]
+                del record["new"][locus]
+                promoted.append(locus)
+
+    record["allele_counts"] = new_counts
+    return changed, promoted, rerun
@@ -0,0 +1,206 @@
+"""
+Contig store for the query genome, loaded once per run and passed to every allele calling stage.
+
+Contigs are kept as bytes (or, with use_mmap, read on demand from an mmap of the fasta through a
+faidx style index) and are looked up by the contig id BLAST reports (first word of the header).
+store[contig_id] returns the contig as a str so the store can stand in for the old {id: seq} dict,
+but slice()/base()/length() should be used where only part of a contig is needed.
+"""
+
+import mmap
+
+_COMPLEMENT = bytes.maketrans(b"ACGTNacgtn-", b"TGCANtgcan-")
+_COMPLEMENT_STR = str.maketrans("ACGTNacgtn-", "TGCANtgcan-")
+
+
+def reverse_complement(dna):
+    """
+    :param dna: str or bytes sequence
+    :return: reverse complement of the same type (non ACGTN characters are left as is)
+    """
+    if isinstance(dna, (bytes, bytearray)):
+        return dna.translate(_COMPLEMENT)[::-1]
+    return str(dna).translate(_COMPLEMENT_STR)[::-1]
+
+
+def _index_fasta(path):
+    """
+    faidx style index of a fasta file
+
+    :param path: fasta path
+    :return: {contig id: (sequence offset, length, bases per line, bytes per line)}
+    """
+    index = {}
+    with open(path, "rb") as f:
+        contig = None
+        offset = length = linebases = linewidth = 0
+        lastline = blank = False
+        pos = 0
+        for line in f:
+            if line.startswith(b">"):
+                if contig is not None:
+                    index[contig] = (offset, length, linebases, linewidth)
+                contig = line[1:].split()[0].decode()
+                offset = pos + len(line)
+                length = linebases = linewidth = 0
+                lastline = blank = False
+            else:
+                bases = len(line.rstrip(b"\r\n"))
+                if bases == 0:
+                    # blank lines are only allowed after the last line of a contig
+                    blank = True
+                    pos += len(line)
+                    continue
+                if blank:
+                    raise ValueError("{}: contig {} has blank lines, cannot index".format(path, contig))
+                if lastline:
+                    raise ValueError("{}: contig {} has uneven line lengths, cannot index".format(path, contig))
+                if linebases == 0:
+                    linebases, linewidth = bases, len(line)
+                elif bases != linebases:
+                    lastline = True  # only the final line of a contig may be shorter
+                elif len(line) != linewidth and line.endswith(b"\n"):
+                    raise ValueError("{}: contig {} has uneven line endings, cannot index".format(path, contig))
+                length += bases
+            pos += len(line)
+        if contig is not None:
+            index[contig] = (offset, length, linebases, linewidth)
+    return index
+
+
+class ContigStore(object):
+
+    def __init__(self, contigs=None, path=None):
+        self.path = path
+        self._contigs = contigs if contigs is not None else {}
+        self._index = None
+        self._mmap = None
+
+    @classmethod
+    def from_fasta(cls, path, use_mmap=False):
+        """
+        :param path: genome fasta
+        :param use_mmap: keep contigs in the (page cached) file and read slices on demand
+        :return: ContigStore
+        """
+        store = cls(path=path)
+        if use_mmap:
+            try:
+                store._index = _index_fasta(path)
+            except ValueError as e:
+                print("{}, loading contigs into memory".format(e))
+                store._index = None
+            else:
+                f = open(path, "rb")
+                store._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                f.close()
+                return store
+
+        contig = None
+        chunks = []
+        with open(path, "rb") as f:
+            for line in f:
+                if line.startswith(b">"):
+                    if contig is not None:
+                        store._contigs[contig] = b"".join(chunks)
+                    contig = line[1:].split()[0].decode()
+                    chunks = []
+                else:
+                    chunks.append(line.strip())
+        if contig is not None:
+            store._contigs[contig] = b"".join(chunks)
+        return store
+
+    def __getstate__(self):
+        # mmap can't be pickled, workers reopen the file
+        state = dict(self.__dict__)
+        state["_mmap"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._index is not None:
+            f = open(self.path, "rb")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            f.close()
+
+    ######## dict style access ########
+
+    def ids(self):
+        if self._index is not None:
+            return list(self._index.keys())
+        return list(self._contigs.keys())
+
+    def __iter__(self):
+        return iter(self.ids())
+
+    def __len__(self):
+        return len(self.ids())
+
+    def __contains__(self, contig):
+        if self._index is not None:
+            return contig in self._index
+        return contig in self._contigs
+
+    def __getitem__(self, contig):
+        return self.raw(contig).decode()
+
+    def keys(self):
+        return self.ids()
+
+    def items(self):
+        for contig in self.ids():
+            yield contig, self[contig]
+
+    ######## sequence access ########
+
+    def length(self, contig):
+        if self._index is not None:
+            return self._index[contig][1]
+        return len(self._contigs[contig])
+
+    def lengths(self):
+        return [self.length(x) for x in self.ids()]
+
+    def raw(self, contig, start=0, end=None):
+        """
+        :param contig: contig id
+        :param start: 0 based start
+        :param end: 0 based exclusive end (default end of contig)
+        :return: bytes of contig[start:end]
+        """
+        if self._index is None:
+            if start == 0 and end is None:
+                return self._contigs[contig]
+            return self._contigs[contig][start:end]
+
+        offset, length, linebases, linewidth = self._index[contig]
+        start, end, _ = slice(start, end).indices(length)
+        if end <= start:
+            return b""
+        first = offset + (start // linebases) * linewidth + start % linebases
+        last = offset + ((end - 1) // linebases) * linewidth + (end - 1) % linebases + 1
+        data = self._mmap[first:last]
+        if linewidth != linebases:
+            data = data.replace(b"\n", b"").replace(b"\r", b"")
+        return data
+
+    def slice(self, contig, start=0, end=None):
+        """
+        :return: str of contig[start:end] (python slice semantics, 0 based)
+        """
+        return self.raw(contig, start, end).decode()
+
+    def base(self, contig, pos):
+        """
+        :return: single base at 0 based pos as str
+        """
+        if pos < 0:
+            pos += self.length(contig)
+        return self.raw(contig, pos, pos + 1).decode()
+
+    def revcomp(self, contig, start=0, end=None):
+        """
+        :return: reverse complement of contig[start:end] as str
+        """
+        return reverse_complement(self.raw(contig, start, end)).decode()
@@ -0,0 +1,45 @@
+"""
+Exact full length allele scan of a genome, shared by the allele calling pre-screen (reads_to_alleles.py)
+and the internal 7 gene MLST typer (mlst_typer.py)
+"""
+
+from contig_store import reverse_complement
+
+
+def find_exact_alleles(qgenome, seqs, k=31):
+    """
+    finds full length exact copies of known alleles in the contigs with one linear scan per contig
+    alleles are indexed (both orientations) by their first k bases, each contig position is looked up in the index
+    and candidate alleles are compared to the contig at that position
+
+    :param qgenome: query genome ContigStore
+    :param seqs: {locus:{allele id:seq}}
+    :param k: anchor kmer size (capped at the shortest allele length)
+    :return: {locus:set of allele ids with an exact copy in the genome}
+    """
+    minlen = min([len(seqs[locus][allele]) for locus in seqs for allele in seqs[locus]])
+    k = min(k, minlen)
+
+    index = {}
+    for locus in seqs:
+        for allele in seqs[locus]:
+            fwd = str(seqs[locus][allele]).upper().encode()
+            for seq in set([fwd, reverse_complement(fwd)]):
+                anchor = seq[:k]
+                if anchor not in index:
+                    index[anchor] = []
+                index[anchor].append((seq, locus, allele))
+
+    found = {}
+    for contig in qgenome:
+        contigseq = qgenome.raw(contig).upper()
+        for pos in range(len(contigseq) - k + 1):
+            kmer = contigseq[pos:pos + k]
+            if kmer in index:
+                for seq, locus, allele in index[kmer]:
+                    if contigseq.startswith(seq, pos):
+                        if locus not in found:
+                            found[locus] = set()
+                        found[locus].add(allele)
+
+    return found
@@ -0,0 +1,162 @@
+"""
+Assembly free exact allele calling from reads (reads_to_alleles.py --mode kmer)
+
+Every k-mer of every known allele is stored 2 bit encoded (canonical, i.e. the smaller of the k-mer and
+its reverse complement) in one sorted numpy array. Reads are streamed in batches, their k-mers encoded the
+same way with vectorised shifts and counted against that array. An allele is covered when every one of its
+k-mers was seen at least min_depth times; a locus is called when exactly one of its alleles is covered.
+Loci with no covered allele (novel or missing) or several (mixed/paralogous) are left unresolved.
+"""
+
+import gzip
+
+import numpy as np
+
+_CODE = np.full(256, 4, dtype=np.uint8)
+for _base, _code in zip(b"ACGTacgt", (0, 1, 2, 3, 0, 1, 2, 3)):
+    _CODE[_base] = _code
+
+
+def _kmer_values(vals, k):
+    """
+    2 bit values of all k-mers of vals by doubling (2-mers, 4-mers, 8-mers ...) so only ~2*log2(k) array passes are needed
+
+    :param vals: uint64 array of base codes 0-3
+    :param k: kmer size
+    :return: uint64 array, value of k-mer starting at each position (len(vals) - k + 1)
+    """
+    result, rlen = None, 0
+    block, blen = vals, 1
+    remaining = k
+    while True:
+        if remaining & 1:
+            if result is None:
+                result, rlen = block, blen
+            else:
+                n = len(vals) - (rlen + blen) + 1
+                result = (result[:n] << np.uint64(2 * blen)) | block[rlen:rlen + n]
+                rlen += blen
+        remaining >>= 1
+        if not remaining:
+            return result
+        n = len(vals) - 2 * blen + 1
+        block = (block[:n] << np.uint64(2 * blen)) | block[blen:blen + n]
+        blen *= 2
+
+
+def encode_kmers(seq, k):
+    """
+    :param seq: bytes, reads joined by a non ACGT separator (e.g. b"N") so no k-mer spans two reads
+    :param k: kmer size (<= 31)
+    :return: uint64 array of canonical 2 bit encoded k-mers of seq (k-mers containing non ACGT are dropped)
+    """
+    codes = _CODE[np.frombuffer(seq, dtype=np.uint8)]
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    bad = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(codes == 4, out=bad[1:])
+    ok = (bad[k:k + n] - bad[:n]) == 0
+
+    vals = codes.astype(np.uint64)
+    vals[codes == 4] = 0
+    fwd = _kmer_values(vals, k)
+    # reverse complement k-mer at i is the k-mer of the reverse complemented sequence at len - k - i
+    rev = _kmer_values((np.uint64(3) - vals)[::-1].copy(), k)[::-1]
+    return np.minimum(fwd, rev)[ok]
+
+
+def read_fastq_seqs(path):
+    """
+    :param path: fastq or fastq.gz
+    :return: generator of read sequences (bytes)
+    """
+    if path.endswith(".gz"):
+        handle = gzip.open(path, "rb")
+    else:
+        handle = open(path, "rb")
+    with handle:
+        for lineno, line in enumerate(handle):
+            if lineno % 4 == 1:
+                yield line.rstrip(b"\r\n")
+
+
+class KmerAlleleIndex(object):
+
+    def __init__(self, seqs, k=31):
+        """
+        :param seqs: {locus:{allele id:seq}}
+        :param k: kmer size (<= 31 so a k-mer fits in 64 bits)
+        """
+        self.k = k
+        encoded = {}
+        for locus in seqs:
+            for allele in seqs[locus]:
+                kmers = encode_kmers(str(seqs[locus][allele]).encode(), k)
+                if len(kmers) > 0 and len(kmers) == len(seqs[locus][allele]) - k + 1:  # alleles with Ns can't be covered
+                    encoded[(locus, allele)] = kmers
+        self.kmers = np.unique(np.concatenate(list(encoded.values()))) if encoded else np.zeros(0, dtype=np.uint64)
+        self.alleles = {}
+        for (locus, allele), kmers in encoded.items():
+            if locus not in self.alleles:
+                self.alleles[locus] = {}
+            self.alleles[locus][allele] = np.searchsorted(self.kmers, np.unique(kmers))
+        self.loci = list(seqs.keys())
+        self.counts = np.zeros(len(self.kmers), dtype=np.int64)
+        self.reads = 0
+
+    def count_reads(self, fastqs, batch_size=100000):
+        """
+        add k-mer counts of all reads in the fastq files
+
+        :param fastqs: fastq(.gz) paths
+        :param batch_size: reads encoded together
+        """
+        for fastq in fastqs:
+            batch = []
+            for read in read_fastq_seqs(fastq):
+                batch.append(read)
+                if len(batch) == batch_size:
+                    self._count_batch(batch)
+                    batch = []
+            if batch:
+                self._count_batch(batch)
+
+    def _count_batch(self, batch):
+        self.reads += len(batch)
+        if len(self.kmers) == 0:
+            return
+        # lookups are much faster for sorted k-mers, unique also collapses repeats within the batch
+        kmers, counts = np.unique(encode_kmers(b"N".join(batch), self.k), return_counts=True)
+        idx = np.searchsorted(self.kmers, kmers)
+        idx[idx == len(self.kmers)] = 0
+        hit = self.kmers[idx] == kmers
+        self.counts[idx[hit]] += counts[hit]
+
+    def covered(self, min_depth):
+        """
+        :param min_depth: minimum count of every k-mer of an allele
+        :return: {locus:[allele ids with all k-mers at >= min_depth]} for every locus
+        """
+        out = {}
+        for locus in self.loci:
+            out[locus] = []
+            for allele, idx in self.alleles.get(locus, {}).items():
+                if self.counts[idx].min() >= min_depth:
+                    out[locus].append(allele)
+        return out
+
+    def calls(self, min_depth):
+        """
+        :param min_depth: minimum count of every k-mer of an allele
+        :return: ({locus:allele id} for loci with exactly one covered allele, list of unresolved loci)
+        """
+        calls = {}
+        unresolved = []
+        for locus, alleles in self.covered(min_depth).items():
+            if len(alleles) == 1:
+                calls[locus] = alleles[0]
+            else:
+                unresolved.append(locus)
+        return calls, unresolved
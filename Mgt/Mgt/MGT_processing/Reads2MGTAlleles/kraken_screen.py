@@ -0,0 +1,136 @@
+"""
+Contamination screen of reads on a subsample of read pairs before (or instead of) classifying every read.
+
+A head or random subsample of read pairs is classified with kraken first. Species percentages of the
+subsample are given a Wilson score interval. The subsample only decides outcomes check_kraken would agree with:
+if a contaminant is clearly over 10% the sample is rejected, if the target is clearly over --kraken_min_target %
+and every contaminant clearly under 10% it is accepted. Everything else, including a target that is low or
+missing in the subsample, is borderline and classified again with all reads.
+"""
+
+import gzip
+import math
+import random
+
+MAX_CONTAMINANT = 10.0  # % of reads from a non target species that fails the sample (as in check_kraken)
+SCREEN_Z = 3.0  # interval width in standard deviations (~99.7% two sided confidence)
+
+
+def _open_fastq(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _read_records(handle):
+    while True:
+        record = [handle.readline() for _ in range(4)]
+        if not record[0]:
+            return
+        yield b"".join(record)
+
+
+def subsample_read_pairs(fq1, fq2, out1, out2, pairs, mode="head", seed=1):
+    """
+    write a subsample of read pairs to uncompressed fastq files
+
+    :param fq1: forward reads fastq(.gz)
+    :param fq2: reverse reads fastq(.gz)
+    :param out1: subsample forward reads fastq
+    :param out2: subsample reverse reads fastq
+    :param pairs: number of read pairs to keep
+    :param mode: head (first pairs, only reads that far) or random (reservoir sample over every pair)
+    :param seed: random seed so reruns screen the same reads
+    :return: (read pairs written, True if that is every pair in the input)
+    """
+    kept = []
+    complete = True
+    with _open_fastq(fq1) as in1, _open_fastq(fq2) as in2:
+        if mode == "random":
+            rand = random.Random(seed)
+            for seen, pair in enumerate(zip(_read_records(in1), _read_records(in2))):
+                if seen < pairs:
+                    kept.append(pair)
+                else:
+                    complete = False
+                    slot = rand.randint(0, seen)
+                    if slot < pairs:
+                        kept[slot] = pair
+        else:
+            for pair in zip(_read_records(in1), _read_records(in2)):
+                if len(kept) == pairs:
+                    complete = False
+                    break
+                kept.append(pair)
+
+    with open(out1, "wb") as outf1, open(out2, "wb") as outf2:
+        for read1, read2 in kept:
+            outf1.write(read1)
+            outf2.write(read2)
+    return len(kept), complete
+
+
+def wilson_interval(hits, total, z=SCREEN_Z):
+    """
+    :param hits: reads of a species
+    :param total: reads classified
+    :param z: interval width in standard deviations
+    :return: (low, high) percentage interval
+    """
+    if total == 0:
+        return 0.0, 100.0
+    p = min(float(hits) / total, 1.0)
+    denom = 1 + z * z / total
+    centre = (p + z * z / (2 * total)) / denom
+    half = z * math.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / denom
+    return max(0.0, centre - half) * 100, min(1.0, centre + half) * 100
+
+
+def species_counts(kraken_result, target_species):
+    """
+    :param kraken_result: kraken-report output (bytes)
+    :param target_species: species name as in check_kraken
+    :return: (reads of the target species, {other species: reads})
+    """
+    target = target_species.replace(" ", "")
+    target_reads = 0
+    others = {}
+    for line in kraken_result.decode('utf8').split("\n"):
+        col = line.split("\t")
+        if len(col) > 5 and col[3] == "S":
+            ident = col[5].strip()
+            if ident.replace(" ", "") == target:
+                target_reads = int(col[1])
+            else:
+                others[ident] = int(col[1])
+    return target_reads, others
+
+
+def screen_verdict(kraken_result, target_species, pairs, min_target):
+    """
+    :param kraken_result: kraken-report output of the subsample (bytes)
+    :param target_species: species name as in check_kraken
+    :param pairs: read pairs in the subsample
+    :param min_target: target species % the subsample has to be confidently over to pass
+    :return: (verdict, contaminant species or None, report line) verdict is one of contaminated, pass or borderline
+    """
+    target_reads, others = species_counts(kraken_result, target_species)
+    t_low, t_high = wilson_interval(target_reads, pairs)
+    line = "kraken screen: {} read pairs, {:.1f}% confidence, {} {:.2f}% ({:.2f}-{:.2f}%)".format(
+        pairs, math.erf(SCREEN_Z / math.sqrt(2)) * 100, target_species, 100.0 * target_reads / max(pairs, 1),
+        t_low, t_high)
+
+    top = None
+    if others:
+        top = max(others, key=lambda x: others[x])
+        c_low, c_high = wilson_interval(others[top], pairs)
+        line += ", top contaminant {} {:.2f}% ({:.2f}-{:.2f}%)".format(top, 100.0 * others[top] / max(pairs, 1),
+                                                                      c_low, c_high)
+    else:
+        c_low = c_high = 0.0
+
+    if c_low > MAX_CONTAMINANT:
+        return "contaminated", top, line
+    if target_reads > 0 and t_low >= min_target and c_high <= MAX_CONTAMINANT:
+        return "pass", None, line
+    return "borderline", top, line
@@ -0,0 +1,106 @@
+"""
+Internal 7 gene MLST typer using the exact allele scan from allele calling (exact_scan.py)
+
+The scheme folder holds one <gene>.tfa per locus (alleles named <gene>_<number>) and a <scheme>.txt
+profile table (ST then one column per gene), the same layout the mlst tool uses (e.g. mlst/xcitri).
+A genome is typed here only when every gene has exactly one exact allele, otherwise (novel, missing
+or multiple alleles) None is returned so the caller can fall back to the mlst tool.
+"""
+
+import os
+from csv import reader
+
+from Bio import SeqIO
+
+from exact_scan import find_exact_alleles
+
+_schemes = {}
+
+
+class MlstScheme(object):
+
+    def __init__(self, name, genes, seqs, profiles):
+        """
+        :param name: scheme name
+        :param genes: genes in profile column order
+        :param seqs: {gene:{allele id:seq}}
+        :param profiles: {tuple of allele numbers in gene order: ST}
+        """
+        self.name = name
+        self.genes = genes
+        self.seqs = seqs
+        self.profiles = profiles
+
+    @classmethod
+    def from_dir(cls, scheme_dir):
+        """
+        :param scheme_dir: folder with <gene>.tfa files and <scheme name>.txt profiles
+        :return: MlstScheme
+        """
+        scheme_dir = scheme_dir.rstrip("/")
+        name = os.path.basename(scheme_dir)
+        profile_file = os.path.join(scheme_dir, name + ".txt")
+
+        rows = reader(open(profile_file), delimiter="\t")
+        header = next(rows)
+        genes = [x for x in header[1:] if os.path.exists(os.path.join(scheme_dir, x + ".tfa"))]
+        cols = [header.index(x) for x in genes]
+
+        profiles = {}
+        for row in rows:
+            if len(row) > max(cols):
+                profiles[tuple(row[x].strip() for x in cols)] = row[0].strip()
+
+        seqs = {}
+        for gene in genes:
+            seqs[gene] = {}
+            for allele in SeqIO.parse(os.path.join(scheme_dir, gene + ".tfa"), "fasta"):
+                seqs[gene][allele.id] = str(allele.seq)
+
+        return cls(name, genes, seqs, profiles)
+
+
+def scheme_files(scheme_dir):
+    """
+    :param scheme_dir: scheme folder
+    :return: paths of the scheme's <gene>.tfa allele files and <scheme name>.txt profile table (sorted), [] if the
+             folder does not exist
+    """
+    scheme_dir = scheme_dir.rstrip("/")
+    if not os.path.isdir(scheme_dir):
+        return []
+    name = os.path.basename(scheme_dir)
+    return sorted(os.path.join(scheme_dir, x) for x in os.listdir(scheme_dir)
+                  if x.endswith(".tfa") or x == name + ".txt")
+
+
+def load_scheme(scheme_dir):
+    """
+    :param scheme_dir: scheme folder
+    :return: MlstScheme (loaded once per process)
+    """
+    scheme_dir = os.path.abspath(scheme_dir)
+    if scheme_dir not in _schemes:
+        _schemes[scheme_dir] = MlstScheme.from_dir(scheme_dir)
+    return _schemes[scheme_dir]
+
+
+def type_genome(qgenome, scheme):
+    """
+    :param qgenome: query genome ContigStore
+    :param scheme: MlstScheme
+    :return: (ST, {gene:allele number}) ST is "-" for a new combination of known alleles,
+             None if any gene has no (or more than one) exact allele
+    """
+    found = find_exact_alleles(qgenome, scheme.seqs, 31)
+
+    alleles = {}
+    for gene in scheme.genes:
+        if gene in found and len(found[gene]) == 1:
+            alleles[gene] = list(found[gene])[0].rsplit("_", 1)[1]
+
+    if len(alleles) < len(scheme.genes):
+        return None, alleles
+
+    profile = tuple(alleles[x] for x in scheme.genes)
+    return scheme.profiles.get(profile, "-"), alleles
@@ -22,6 +22,22 @@ import datetime
 from copy import deepcopy
 import time
 import dis
+from ref_blastdb import get_ref_db, build_subset_db
+from blast_tabular import OUTFMT, parse_blast_tabular
+from snp_mask import mask_high_snp_regions
+from contig_store import ContigStore, reverse_complement
+from assembly_stats import AssemblyStats
+from exact_scan import find_exact_alleles
+from mlst_typer import load_scheme, type_genome, scheme_files
+from kmer_caller import KmerAlleleIndex
+from stage_runner import StepRunner, run_cmd
+import stage_metrics
+from result_cache import get_result_cache
+from kraken_screen import subsample_read_pairs, screen_verdict
+from call_record import calls_record_path, write_call_record, save_call_record, load_call_record, recall_record
+from ref_blastdb import fasta_md5
+
+MIN_SHOVILL_RAM = 4  # GB, with less left after kraken's share kraken and shovill run one after another
 
 abspath = os.path.abspath(__file__)
 dname = os.path.dirname(abspath)
@@ -36,7 +52,6 @@ conda install biopython
 conda install Kraken 
 (will need to DL minikraken DB)
 export KRAKEN_DEFAULT_DB='/srv/scratch/lanlab/kraken_dir/minikraken_20141208'
-conda install assembly-stats
 conda install blast
 conda install mafft
 conda install -c bioconda sistr_cmd
@@ -86,6 +101,18 @@ def main(args):
     :return: output alleles file with 7gene MLST, allele calls and seq and uncallable loci
     """
 
+    if args.intype == "genomes":
+        run_genome_batch(args)
+        return
+
+    if args.intype == "recall":
+        run_recall(args)
+        return
+
+    if args.intype == "reads" and args.mode == "kmer":
+        run_kmer_pipe(args)
+        return
+
     if args.intype == "reads":
         raw_assembly_out, strainid = run_assemblypipe(args)
     else:
@@ -94,11 +121,105 @@ def main(args):
             strainid = raw_assembly_out.split("/")[-1]
             args.strainid = re.sub('.(fasta|fna|fa)', '', strainid)
 
-    query_genome, strainid, mgt1st, serotype = post_assembly_qc(args.strainid,raw_assembly_out,args)
+    # genome is parsed once in post_assembly_qc and the same contig store is used by every allele calling stage
+    query_genome, strainid, mgt1st, serotype, genome = post_assembly_qc(args.strainid,raw_assembly_out,args)
+
+    genome_to_alleles(query_genome, args.strainid, args, mgt1st, serotype, genome)
+
+
+def run_genome_batch(args):
+    """
+    --intype genomes: assembly QC of each genome then allele calling of all that pass with one BLAST (genomes_to_alleles)
+    -i is a comma separated list of assemblies or a file listing one assembly path per line
+
+    :param args: command line input arguments in argparse object
+    """
+    inputs = args.input.split(",")
+    if len(inputs) == 1 and os.path.exists(inputs[0]) and not open(inputs[0]).read(1) == ">":
+        inputs = [x.strip() for x in open(inputs[0]) if x.strip() != ""]
+
+    genomes = []
+    failed = {}
+    for raw_assembly_out in inputs:
+        strainid = re.sub('.(fasta|fna|fa)', '', raw_assembly_out.split("/")[-1])
+        try:
+            # contig stores are not kept for the whole batch, genomes_to_alleles loads each genome when it is called
+            query_genome, strainid, mgt1st, serotype, genome = post_assembly_qc(strainid, raw_assembly_out, args)
+        except SystemExit as e:
+            failed[strainid] = str(e)
+            continue
+        genomes.append((query_genome, strainid, mgt1st, serotype))
+
+    if genomes:
+        failed.update(genomes_to_alleles(genomes, args))
+
+    for strainid in failed:
+        print("FAILED {}: {}".format(strainid, failed[strainid].strip()))
+    if failed:
+        sys.exit("{} of {} genomes failed".format(len(failed), len(inputs)))
+
+
 
-    genome_to_alleles(query_genome, args.strainid, args, mgt1st, serotype)
 
+def run_recall(args):
+    """
+    --intype recall: update previously written alleles files after --refalleles has grown, using the
+    <strain>_calls.json.gz record written with each alleles file (call_record.py). Only loci whose reference
+    alleles changed are re-evaluated: new calls that now exactly match a reference allele are promoted to it.
+    A rewritten alleles file gets a recall entry in its _metrics.json and its (now outdated) result cache entry
+    is removed.
+    -i is a comma separated list of _alleles.fasta files (or strain output folders) or a file listing one per line
+
+    :param args: command line input arguments in argparse object
+    """
+    start_time = time.time()
 
+    inputs = args.input.split(",")
+    if len(inputs) == 1 and os.path.isfile(inputs[0]) and not inputs[0].endswith("_alleles.fasta"):
+        inputs = [x.strip() for x in open(inputs[0]) if x.strip() != ""]
+
+    locus_allowed_size, seqs = get_allowed_locus_sizes(args.refalleles)
+    cache = get_result_cache(args)
+
+    failed = {}
+    promoted_total = 0
+    for alleles_path in inputs:
+        if os.path.isdir(alleles_path):
+            strain = os.path.basename(alleles_path.rstrip("/"))
+            alleles_path = os.path.join(alleles_path, strain + "_alleles.fasta")
+        record = load_call_record(calls_record_path(alleles_path))
+        if record is None:
+            failed[alleles_path] = "no calling record, rerun genome_to_alleles"
+            continue
+
+        recall_start = time.time()
+        changed, promoted, rerun = recall_record(record, seqs)
+        promoted_total += len(promoted)
+        if promoted:
+            write_outalleles(alleles_path, record["new"], record["ref"], record["uncallable"], record["loci"],
+                             record["mgt1st"], record["no_hits"], record["serotype"])
+            if cache and record.get("alleles_cache_key"):
+                cache.remove("alleles", record["alleles_cache_key"])
+            record["alleles_cache_key"] = None
+            stage_metrics.update_metrics(os.path.join(os.path.dirname(alleles_path), record["strain"] + "_metrics.json"),
+                                         record["strain"],
+                                         recall={"refalleles_md5": fasta_md5(args.refalleles),
+                                                 "changed_loci": len(changed), "promoted": len(promoted),
+                                                 "rerun_loci": len(rerun),
+                                                 "wall_s": round(time.time() - recall_start, 3)})
+        save_call_record(calls_record_path(alleles_path), record)
+        print("{}: {} loci with changed reference alleles, {} new alleles promoted".format(record["strain"],
+                                                                                         len(changed), len(promoted)))
+        if rerun:
+            failed[alleles_path] = "{} loci need full re-calling: {}".format(len(rerun), ",".join(rerun))
+
+    print("Re-calling of {} alleles files completed in: {:2f}, {} new alleles promoted".format(
+        len(inputs), time.time() - start_time, promoted_total))
+
+    for alleles_path in failed:
+        print("FAILED {}: {}".format(alleles_path, failed[alleles_path]))
+    if failed:
+        sys.exit("{} of {} alleles files could not be fully re-called".format(len(failed), len(inputs)))
 
 
 ######## ASSEMBLY PIPELINE (incl shovill + skesa) ########
@@ -107,28 +228,25 @@ def main(args):
 Takes raw reads (fastq or fastq.gz) and runs assembly pipeline:
  runs kraken and checks for match to input species string and that contamination is <10%
  runs shovill (with skesa as assembler) with modified 15 fold coverage minimum regardless of overall coverage
- runs assembly-stats to gather stats to compare to assembly quality limits in inputs
+ gathers assembly stats (assembly_stats.py) to compare to assembly quality limits in inputs
  runs SISTR to verify serovar of genome based on input serotype (salmonella only)
- runs mlst to get 7 gene MLST ST
+ types 7 gene MLST ST from exact allele matches (mlst_typer.py), running mlst only for novel/missing alleles
+
+kraken runs at the same time as shovill (a kraken failure stops shovill) and assembly stats at the same
+time as mlst, see stage_runner.py. Per step wall time and peak RSS go to <strain>_steps.txt
  
 """
 
 
 # TODO include read depth estimation (assume all reads map to ref) so need to count reads from input
 
-def run_assemblypipe(args):
+def setup_reads_run(args):
     """
+    check read inputs, derive strain name from the fastq names and make the strain output folder
 
-    :param fq1:
-    :param fq2:
-    :return:
+    :param args: command line input arguments in argparse object
+    :return: fq1, fq2, strain, strain output folder
     """
-    start_time = time.time()
-
-    ## get inputs from args
-
-    script_path = sys.path[0]
-
     reads = args.input.split(",")
     fq1 = reads[0]
     fq2 = reads[1]
@@ -167,19 +285,69 @@ def run_assemblypipe(args):
     else:
         os.mkdir(basename)
 
+    return fq1, fq2, strain, basename
+
+
+def run_assemblypipe(args):
+    """
+
+    :param fq1:
+    :param fq2:
+    :return:
+    """
+    start_time = time.time()
+
+    ## get inputs from args
+
+    script_path = sys.path[0]
+
+    fq1, fq2, strain, basename = setup_reads_run(args)
+
     krakenout1 = basename + "/" + strain + "_kraken_out"
     rename_skesa = basename + "/" + strain + "_contigs.fa"
     contam = basename + "/" + strain + "_failure_reason.txt"
     shovil_pref = basename + "/" + strain + "_shovill"
     skesa_assembly = shovil_pref + "/contigs.fa"
 
-    ##### Run kraken #####
-
-    run_kraken(args, fq1, fq2, krakenout1, strain, contam)
+    ##### Restore assembly of the same reads from the result cache #####
+
+    cache = get_result_cache(args)
+    if cache:
+        cache_key = cache.key("assembly", [fq1, fq2], {"species": args.species, "kraken_db": args.kraken_db,
+                                                       "refsize": args.refsize,
+                                                       "kraken_screen": [args.kraken_subsample,
+                                                                         args.kraken_subsample_mode,
+                                                                         args.kraken_min_target]})
+        if cache.get("assembly", cache_key, {"contigs.fa": rename_skesa,
+                                              "kraken_report.txt": krakenout1 + "_report.txt"}) is not None:
+            print("Assembly restored from result cache: " + cache_key)
+            return rename_skesa, strain
+
+    ##### Run kraken alongside shovill #####
+
+    # the --threads/--memory budget is split between the two, or they run one after another if it is too small
+    budget = None
+    if not args.serial_steps:
+        budget = split_assembly_budget(args)
+        if budget is None:
+            print("--threads/--memory too small to run kraken and shovill at the same time, running them one after another")
+    if budget is None:
+        kraken_threads, shovill_threads, shovill_ram = args.threads, args.threads, args.memory
+    else:
+        kraken_threads, shovill_threads, shovill_ram = budget
+        print("kraken: {} threads, shovill: {} threads {}GB ram".format(kraken_threads, shovill_threads, shovill_ram))
 
-    ##### Run shovill #####
+    runner = StepRunner(concurrent=budget is not None)
+    runner.add("kraken", run_kraken, args, fq1, fq2, krakenout1, strain, contam, kraken_threads)
+    runner.add("shovill", run_shovill, args, fq1, fq2, script_path, shovil_pref, skesa_assembly, rename_skesa,
+               shovill_threads, shovill_ram)
+    try:
+        runner.run()
+    finally:
+        runner.report(basename + "/" + strain + "_steps.txt")
 
-    run_shovill(args, fq1, fq2, script_path, shovil_pref, skesa_assembly, rename_skesa)
+    if cache:
+        cache.put("assembly", cache_key, {"contigs.fa": rename_skesa, "kraken_report.txt": krakenout1 + "_report.txt"})
 
     elapsed_time = time.time() - start_time
 
@@ -188,14 +356,146 @@ def run_assemblypipe(args):
     return rename_skesa, strain
 
 
+def kraken_db_gb(args):
+    """
+    :return: size in GB of the kraken database files (held in memory while kraken runs), 0 if not found
+    """
+    db = args.kraken_db or os.environ.get("KRAKEN_DEFAULT_DB", "")
+    if not os.path.isdir(db):
+        return 0.0
+    size = sum(os.path.getsize(os.path.join(db, x)) for x in os.listdir(db)
+               if x.startswith("database.") and os.path.isfile(os.path.join(db, x)))
+    return size / float(1 << 30)
+
+
+def split_assembly_budget(args):
+    """
+    split --threads/--memory between kraken and shovill running at the same time: kraken gets --kraken_threads
+    (default a quarter of --threads) and the memory of its database (--kraken_memory, default the size of the
+    database files), shovill the rest
+
+    :param args: command line input arguments in argparse object
+    :return: (kraken threads, shovill threads, shovill ram in GB) or None if the budget is too small to split
+    """
+    threads = int(args.threads)
+    memory = float(args.memory)
+    kraken_threads = args.kraken_threads if args.kraken_threads else max(1, threads // 4)
+    kraken_memory = args.kraken_memory if args.kraken_memory is not None else kraken_db_gb(args)
+    shovill_threads = threads - kraken_threads
+    shovill_ram = int(memory - kraken_memory)
+    if kraken_threads < 1 or shovill_threads < 1 or shovill_ram < MIN_SHOVILL_RAM:
+        return None
+    return kraken_threads, shovill_threads, shovill_ram
+
+
+def run_kmer_pipe(args):
+    """
+    --intype reads --mode kmer: calls exact known alleles (and the 7 gene MLST) straight from the reads (kmer_caller.py)
+    while kraken checks the reads. If every locus and MLST gene is resolved the alleles file is written without
+    assembling, otherwise the reads are assembled and the k-mer calls are used as known calls in genome_to_alleles
+    so only the unresolved loci are blasted
+
+    :param args: command line input arguments in argparse object
+    """
+    start_time = time.time()
+
+    script_path = sys.path[0]
+
+    if args.kmer_size > 31:
+        sys.exit("--kmer_size must be 31 or less")
+
+    # the read name prefix is only used for the temp folder, outputs are named by --strainid as in the assembly path
+    fq1, fq2, strain, basename = setup_reads_run(args)
+    strainid = args.strainid if args.strainid else strain
+    outdir = args.outpath + strainid
+
+    krakenout1 = basename + "/" + strain + "_kraken_out"
+    contam = basename + "/" + strain + "_failure_reason.txt"
+
+    locus_allowed_size, seqs = get_allowed_locus_sizes(args.refalleles)
+    locus_list = [x for x in locus_allowed_size.keys()]
+
+    # 7 gene MLST alleles are counted in the same pass over the reads under ("mlst", gene) keys
+    kmer_seqs = dict(seqs)
+    scheme = None
+    scheme_dir = mlst_scheme_dir(args)
+    if os.path.exists(scheme_dir):
+        scheme = load_scheme(scheme_dir)
+        for gene in scheme.genes:
+            kmer_seqs[("mlst", gene)] = scheme.seqs[gene]
+
+    ##### Run kraken alongside k-mer counting #####
+
+    index = KmerAlleleIndex(kmer_seqs, args.kmer_size)
+    runner = StepRunner(concurrent=not args.serial_steps)
+    # k-mer counting takes one thread of --threads while kraken runs
+    kraken_threads = max(1, int(args.threads) - 1) if not args.serial_steps else args.threads
+    runner.add("kraken", run_kraken, args, fq1, fq2, krakenout1, strain, contam, kraken_threads)
+    runner.add("kmer_count", index.count_reads, [fq1, fq2])
+    try:
+        runner.run()
+    finally:
+        runner.report(basename + "/" + strain + "_steps.txt")
+
+    kmer_calls, unresolved = index.calls(args.kmer_min_depth)
+    calls = {}
+    for locus in locus_list:
+        if locus in kmer_calls:
+            calls[locus] = kmer_calls[locus].split(":")[1]  # allele number as in exact BLAST calls
+
+    MGT1ST = None
+    if scheme and all(("mlst", x) in kmer_calls for x in scheme.genes):
+        profile = tuple(kmer_calls[("mlst", x)].rsplit("_", 1)[1] for x in scheme.genes)
+        MGT1ST = scheme.profiles.get(profile, "-")
+
+    unresolved_loci = [x for x in locus_list if x not in calls]
+    print("Loci called from {} reads: {}, unresolved: {}, 7 gene ST: {}".format(index.reads, len(calls),
+                                                                               len(unresolved_loci), MGT1ST))
+
+    if len(unresolved_loci) == 0 and MGT1ST is not None:
+        serotype = id_pathovar(MGT1ST, args.pathovar)
+        if not os.path.exists(outdir):
+            os.mkdir(outdir)
+        outfile = outdir + "/" + strainid + "_alleles.fasta"
+        write_outalleles(outfile, {}, calls, {}, locus_list, MGT1ST, [], serotype)
+        write_call_record(calls_record_path(outfile), strainid, seqs, locus_list, MGT1ST, serotype, calls, {}, {}, [])
+        stage_metrics.write_metrics(outdir + "/" + strainid + "_metrics.json", strainid,
+                                    allele_calling_wall_s=round(time.time() - start_time, 3), mode="kmer",
+                                    kmer_reads=index.reads)
+        print("Alleles called from reads in: ", time.time() - start_time)
+        return
+
+    ##### Fall back to assembly for unresolved loci #####
+
+    print("Assembling reads for {} unresolved loci\n".format(len(unresolved_loci)))
+    rename_skesa = basename + "/" + strain + "_contigs.fa"
+    shovil_pref = basename + "/" + strain + "_shovill"
+    skesa_assembly = shovil_pref + "/contigs.fa"
+    run_shovill(args, fq1, fq2, script_path, shovil_pref, skesa_assembly, rename_skesa)
+
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+    query_genome, strainid, mgt1st, serotype, genome = post_assembly_qc(strainid, rename_skesa, args)
+    genome_to_alleles(query_genome, strainid, args, mgt1st, serotype, genome, known_calls=calls)
+
+
 def post_assembly_qc(strain,raw_assembly_out,args):
+    """
+    assembly quality filters and 7 gene MLST of an assembly, the genome is parsed once into a ContigStore that is
+    used by both and returned for allele calling
+
+    :param strain: strain name
+    :param raw_assembly_out: assembly fasta
+    :param args: command line input arguments in argparse object
+    :return: passed assembly path, strain name, 7 gene ST, serotype, ContigStore of the assembly
+    """
     start_time = time.time()
     if not os.path.exists(raw_assembly_out):
         sys.exit("genome file is missing at {}".format(raw_assembly_out))
 
     basename = args.outpath + strain
 
-    if args.intype == "genome":
+    if args.intype in ["genome", "genomes"]:
         if os.path.exists(basename):
             if args.force:
                 shutil.rmtree(basename)
@@ -213,9 +513,43 @@ def post_assembly_qc(strain,raw_assembly_out,args):
     sistr_out = basename + "/" + strain + "_sistr.csv"
     assembly_stats = basename + "/" + strain + "_assembly_stats.txt"
 
-    ##### Run assembly-stats/assembly quality filters #####
-
-    run_assembly_stats(raw_assembly_out, contam, assembly_fail, strain, assembly_stats)
+    genome = ContigStore.from_fasta(raw_assembly_out, use_mmap=args.genome_mmap)
+
+    ##### Restore QC verdict of the same assembly from the result cache #####
+
+    cache = get_result_cache(args)
+    if cache:
+        # the verdict holds the 7 gene ST and pathovar, so the MLST scheme files and typer are part of the key
+        cache_key = cache.key("qc", [raw_assembly_out, args.pathovar] + scheme_files(mlst_scheme_dir(args)),
+                              {"min_largest_contig": args.min_largest_contig, "max_contig_no": args.max_contig_no,
+                               "genome_min": args.genome_min, "genome_max": args.genome_max, "n50_min": args.n50_min,
+                               "external_mlst": args.external_mlst})
+        verdict = cache.get("qc", cache_key, {"assembly_stats.txt": assembly_stats})
+        if verdict is not None:
+            print("Assembly QC verdict restored from result cache: " + cache_key)
+            if not verdict["pass"]:
+                outc = open(contam, "w")
+                outc.write(verdict["message"])
+                outc.write(open(assembly_stats).read())
+                outc.close()
+                shutil.copy(raw_assembly_out, assembly_fail)
+                sys.exit(verdict["message"])
+            shutil.copy(raw_assembly_out, skesa_pass)
+            return skesa_pass, strain, verdict["mlst"], verdict["serotype"], genome
+
+    ##### Run assembly stats/assembly quality filters alongside 7 gene MLST #####
+
+    runner = StepRunner(concurrent=not args.serial_steps)
+    runner.add("assembly_stats", run_assembly_stats, genome, contam, assembly_fail, strain, assembly_stats)
+    runner.add("mlst", type_mlst, genome, args)
+    try:
+        results = runner.run()
+    except SystemExit as e:
+        if cache and os.path.exists(assembly_fail):  # failed the assembly filters, not a tool error
+            cache.put("qc", cache_key, {"assembly_stats.txt": assembly_stats}, {"pass": False, "message": str(e)})
+        raise
+    finally:
+        runner.report(basename + "/" + strain + "_steps.txt")
 
     ##### Run SISTR serotyping #####
     #serotype = ""
@@ -224,18 +558,20 @@ def post_assembly_qc(strain,raw_assembly_out,args):
     #else:
     #    serotype = args.species
 
-    ##### Run 7 gene MLST program #####
-
-    MGT1ST = run_mlst(raw_assembly_out)
+    MGT1ST = results["mlst"]
     serotype = id_pathovar(MGT1ST, args.pathovar)
 
+    if cache:
+        cache.put("qc", cache_key, {"assembly_stats.txt": assembly_stats},
+                  {"pass": True, "mlst": MGT1ST, "serotype": serotype})
+
     shutil.copy(raw_assembly_out, skesa_pass)  # if no sys.exit by this point then genome has passed filters
 
     elapsed_time = time.time() - start_time
 
     print("Assembly QC completed in: ", elapsed_time)
 
-    return skesa_pass, strain, MGT1ST, serotype
+    return skesa_pass, strain, MGT1ST, serotype, genome
 
 
 def import_pathovar_key(pathovar_key):
@@ -302,18 +638,16 @@ def sistr_filter(sistr_out, serovars):
 def assem_filter(inp, args):
     """
     assembly stats filter
-    :param inp: assembly stats
+    :param inp: AssemblyStats of the genome
     :param args: input arguments argparse object from main()
     :return: True or (False + reasons for failure)
     """
-    print(inp)
-    inlis = inp.split("\n")
+    print(inp.to_text())
 
-    inf1 = inlis[1].split(",")
-    contigs = int(inf1[1].replace("n = ", ""))
-    largest_cont = int(inf1[3].replace("largest = ", ""))
-    length = int(inf1[0].replace("sum = ", ""))
-    n50 = int(inlis[2].split(",")[0].replace("N50 = ", ""))
+    contigs = inp.n
+    largest_cont = inp.largest
+    length = inp.sum
+    n50 = inp.n50
 
     contig_no_max = int(args.max_contig_no)
     largest_cont_min = int(args.min_largest_contig)
@@ -341,14 +675,46 @@ def assem_filter(inp, args):
 
 
 
+def type_mlst(genome, args):
+    """
+    7 gene MLST from exact allele matches to the scheme in --mlst_scheme (mlst_typer.py)
+    the mlst tool is only run if a gene has no single exact allele (novel/missing) or with --external_mlst
+
+    :param genome: ContigStore of the genome (the mlst tool is run on its fasta)
+    :param args: input arguments argparse object from main()
+    :return: ST
+    """
+    if not args.external_mlst:
+        scheme_dir = mlst_scheme_dir(args)
+        if os.path.exists(scheme_dir):
+            scheme = load_scheme(scheme_dir)
+            MGT1ST, alleles = type_genome(genome, scheme)
+            if MGT1ST is not None:
+                print("7 gene MLST {}: ST {} ({})".format(scheme.name, MGT1ST,
+                                                        " ".join("{}({})".format(x, alleles[x]) for x in scheme.genes)))
+                return MGT1ST
+            missing = [x for x in scheme.genes if x not in alleles]
+            print("No single exact allele for {}, running mlst".format(",".join(missing)))
+        else:
+            print("MLST scheme folder {} not found, running mlst".format(scheme_dir))
+    return run_mlst(genome.path)
+
+
+def mlst_scheme_dir(args):
+    """
+    :return: --mlst_scheme or the xcitri scheme folder next to the pathovar key
+    """
+    if args.mlst_scheme:
+        return args.mlst_scheme
+    return os.path.join(os.path.dirname(args.pathovar), "xcitri")
+
+
 def run_mlst(ingenome):
     ##### Run 7 gene MLST program #####
 
     mlst_cmd = "mlst {}".format(ingenome)
     print(mlst_cmd)
-    proc2 = subprocess.Popen(mlst_cmd, shell=True, stdout=subprocess.PIPE)
-
-    mlst_result = proc2.stdout.read()
+    returncode, mlst_result = run_cmd(mlst_cmd, capture=True)
     mlst_result = mlst_result.decode('utf8')
     print(mlst_result)
     MGT1ST = mlst_result.split("\t")[2]
@@ -357,7 +723,8 @@ def run_mlst(ingenome):
 
 
 
-def run_kraken(args, fq1, fq2, krakenout1, strain, contam):
+@stage_metrics.stage("run_kraken")
+def run_kraken(args, fq1, fq2, krakenout1, strain, contam, threads=None):
     ## set KRAKEN_DEFAULT_DB variable to kraken_db input variable
     krakendbcmd = ""
     if args.kraken_db != "":
@@ -369,84 +736,144 @@ def run_kraken(args, fq1, fq2, krakenout1, strain, contam):
             sys.exit(
                 "A Kraken database location must either be defined using --kraken_db\n or set as an environmental valiable ( export $KRAKEN_DEFAULT_DB=/path/to/dbfolder )")
 
+    #### Screen a subsample of read pairs first ####
+
+    screen_line = ""
+    if args.kraken_subsample > 0:
+        sub1 = krakenout1 + "_sub_1.fastq"
+        sub2 = krakenout1 + "_sub_2.fastq"
+        pairs, complete = subsample_read_pairs(fq1, fq2, sub1, sub2, args.kraken_subsample,
+                                               args.kraken_subsample_mode)
+        stage_metrics.count("kraken_screen_pairs", pairs)
+        kraken_result = kraken_classify(args, krakendbcmd, sub1, sub2, krakenout1, threads)
+        os.remove(sub1)
+        os.remove(sub2)
+        if complete:
+            # every read pair was in the subsample, this is the full classification
+            check_kraken_result(kraken_result, args, strain, contam)
+            return
+        verdict, contaminant, screen_line = screen_verdict(kraken_result, args.species, pairs, args.kraken_min_target)
+        screen_line += " ({} subsample of {} pairs)".format(args.kraken_subsample_mode, args.kraken_subsample)
+        print(screen_line + ": " + verdict)
+        if verdict == "contaminated":
+            kraken_fail(contam, "F: {}\tcontaminated with > 10% reads from\t{}\n".format(strain, contaminant),
+                        screen_line, kraken_result)
+        elif verdict == "pass":
+            return
+        stage_metrics.count("kraken_full_runs")
+        screen_line += ", borderline, all reads classified"
+
     #### Run kraken ####
 
+    kraken_result = kraken_classify(args, krakendbcmd, fq1, fq2, krakenout1, threads)
+    check_kraken_result(kraken_result, args, strain, contam, screen_line)
+
+
+def kraken_classify(args, krakendbcmd, fq1, fq2, krakenout1, threads=None):
+    """
+    classify read pairs with kraken, write kraken-report output to <krakenout1>_report.txt
+
+    :param args: command line input arguments in argparse object
+    :param krakendbcmd: kraken database option
+    :param fq1: forward reads
+    :param fq2: reverse reads
+    :param krakenout1: kraken output path (removed once reported)
+    :param threads: kraken threads (default --threads)
+    :return: kraken-report output (bytes)
+    """
+    if threads is None:
+        threads = args.threads
     if check_zp(fq1):
         kraken_cmd = 'kraken{} --threads {} --fastq-input --gzip-compressed --output {} --paired {} {}'.format(
             krakendbcmd,
-            str(args.threads),
+            str(threads),
             krakenout1,
             fq1, fq2)
     else:
-        kraken_cmd = 'kraken{} --threads {} --fastq-input --output {} --paired {} {}'.format(krakendbcmd,str(args.threads),
+        kraken_cmd = 'kraken{} --threads {} --fastq-input --output {} --paired {} {}'.format(krakendbcmd,str(threads),
                                                                                            krakenout1, fq1,
                                                                                            fq2)
 
-
-
-    subprocess.Popen(kraken_cmd, shell=True).wait()
+    run_cmd(kraken_cmd)
 
     kraken_report_cmd = f'kraken-report{krakendbcmd} {krakenout1}'
 
-    proc = subprocess.Popen(kraken_report_cmd, stdout=subprocess.PIPE, shell=True)
-
-    kraken_result = proc.stdout.read()
+    returncode, kraken_result = run_cmd(kraken_report_cmd, capture=True)
 
     krakenReport = open(krakenout1+"_report.txt","w")
 
-    kraken_out = kraken_result.decode('utf8')
-
-    krakenReport.write(kraken_out)
+    krakenReport.write(kraken_result.decode('utf8'))
 
     krakenReport.close()
 
     os.remove(krakenout1)
 
+    return kraken_result
+
+
+def check_kraken_result(kraken_result, args, strain, contam, screen_line=""):
+    """
+    exit with the failure reason if the reads are not from the target species or contaminated
+
+    :param kraken_result: kraken-report output (bytes)
+    :param args: command line input arguments in argparse object
+    :param strain: strain name
+    :param contam: failure reason file
+    :param screen_line: subsample screen report line to include in the failure reason
+    """
     contamination = check_kraken(kraken_result, args.species)
     # takes kraken_report file and checks for presence of 'species string' and any contaminants above 10% of reads
 
     if contamination == True:
-        outc = open(contam, "w")
         outmessage = "F: {}\tdoes not contain reads from the target species\n".format(strain)
-        outc.write(outmessage)
-        outc.write(kraken_out)
-        outc.close()
-        sys.exit(outmessage)
+        kraken_fail(contam, outmessage, screen_line, kraken_result)
     elif contamination != False:
-        outc = open(contam, "w")
         outmessage = "F: {}\tcontaminated with > 10% reads from\t{}\n".format(strain, contamination)
-        outc.write(outmessage)
-        outc.write(kraken_out)
-        outc.close()
-        sys.exit(outmessage)
+        kraken_fail(contam, outmessage, screen_line, kraken_result)
 
 
+def kraken_fail(contam, outmessage, screen_line, kraken_result):
+    """
+    write failure reason file (message, subsample screen report, kraken report) and exit
+    """
+    outc = open(contam, "w")
+    outc.write(outmessage)
+    if screen_line:
+        outc.write(screen_line + "\n")
+    outc.write(kraken_result.decode('utf8'))
+    outc.close()
+    sys.exit(outmessage)
+
 
-def run_shovill(args, fq1, fq2, script_path, shovil_pref, skesa_assembly, rename_skesa):
+
+@stage_metrics.stage("run_shovill")
+def run_shovill(args, fq1, fq2, script_path, shovil_pref, skesa_assembly, rename_skesa, threads=None, ram=None):
     ##TODO work out shovill inclusion / dependencies
+    if threads is None:
+        threads = args.threads
+    if ram is None:
+        ram = args.memory
 
     shovill_cmd = script_path + "/shovill_cmd/bin/shovill_15cov -R1 {} -R2 {} --gsize {}M --outdir {} --cpus {} --ram {} --assembler skesa --force".format(
-        fq1, fq2, args.refsize, shovil_pref, args.threads, args.memory)
+        fq1, fq2, args.refsize, shovil_pref, threads, ram)
 
-    subprocess.Popen(shovill_cmd, shell=True).wait()
+    run_cmd(shovill_cmd)
 
     shutil.copy(skesa_assembly, rename_skesa)
 
 
 
-def run_assembly_stats(rename_skesa, contam, assembly_fail, strain, assembly_stats):
+def run_assembly_stats(genome, contam, assembly_fail, strain, assembly_stats):
     """
-    run assembly-stats and pass results to assem_filter() if fails for 1 or more reasons sys.exit with reasons for fail
+    get assembly stats (from the genome's ContigStore, assembly_stats.py) and pass them to assem_filter()
+    if fails for 1 or more reasons sys.exit with reasons for fail
     """
+    rename_skesa = genome.path
 
-    assem_cmd = "assembly-stats {}".format(rename_skesa)
-
-    procassem = subprocess.Popen(assem_cmd, shell=True, stdout=subprocess.PIPE)
+    stats = AssemblyStats.from_store(genome)
+    assem_result = stats.to_text()
 
-    assem_result = procassem.stdout.read()
-    assem_result = assem_result.decode('utf8')
-
-    assembly_pass, fail_reasons = assem_filter(assem_result, args)
+    assembly_pass, fail_reasons = assem_filter(stats, args)
 
     assem_out = open(assembly_stats,"w")
     assem_out.write(assem_result)
@@ -503,8 +930,10 @@ def run_sistr(args, rename_skesa, strain, sistr_out, contam, serovar_fail):
 
 ######## ASSEMBLY TO ALLELES ########
 
+_recon_shared = None  # per genome inputs for reconstruct_locus, inherited by forked workers
+
 
-def genome_to_alleles(query_genome, strain_name, args, mgt1st, serotype):
+def genome_to_alleles(query_genome, strain_name, args, mgt1st, serotype, genome=None, known_calls=None):
     """
     Takes assembly from assemblypipe and blasts against set of known alleles for all loci
     exact matches to existing alleles are called from perfect blast hits
@@ -514,8 +943,10 @@ def genome_to_alleles(query_genome, strain_name, args, mgt1st, serotype):
     :param strain_name:
     :param args: args from main()
     :param mgt1st: 7 gene mlst included in allele file as a header
+    :param genome: ContigStore of query_genome (loaded from query_genome if not given)
+    :param known_calls: {locus:allele number} exact calls made before assembly (--mode kmer), these loci are not blasted
 
-    :return: writes alleles,zero calls,7geneMLST to output file
+    :return: writes alleles,zero calls,7geneMLST to output file and per stage timings/counts to <strain>_metrics.json
     """
     start_time = time.time()
 
@@ -523,11 +954,6 @@ def genome_to_alleles(query_genome, strain_name, args, mgt1st, serotype):
 
     ref_alleles_in = args.refalleles
 
-
-    hsp_ident_thresh = float(args.hspident)  # scriptvariable blast identity to at least one other allele for each locus
-    missing_limit = args.locusnlimit  # scriptvariable minimum allowable fraction of locus not lost (i.e. max 20% can be "N")
-    wordsize = 18  # scriptvariable blast word size
-
     ####
 
     pref = args.outpath
@@ -551,22 +977,111 @@ def genome_to_alleles(query_genome, strain_name, args, mgt1st, serotype):
     else:
         os.mkdir(tempdir)
 
-    qgenomeseq = SeqIO.parse(query_genome, "fasta")
+    cache = get_result_cache(args) if not known_calls else None
+    cache_key = None
+    if cache:
+        cache_key = alleles_cache_key(cache, query_genome, args, mgt1st, serotype)
+        if cache.get("alleles", cache_key, {"alleles.fasta": outfile,
+                                            "calls.json.gz": calls_record_path(outfile)}) is not None:
+            print("Alleles restored from result cache: " + cache_key)
+            shutil.rmtree(tempdir)
+            return
+
+    if genome is None:
+        genome = ContigStore.from_fasta(query_genome, use_mmap=args.genome_mmap)
 
-    qgenome = {x.id: str(x.seq) for x in qgenomeseq}  # query genome as dictionary of {fastq_header:seq}
+    qgenome = genome  # query genome as ContigStore, {fastq_header:seq} style access
 
     locus_allowed_size,seqs = get_allowed_locus_sizes(ref_alleles_in)
 
     locus_list = [x for x in locus_allowed_size.keys()]
 
-    print("Running BLAST\n")
+    prescreen_calls = {}
+    if not args.no_prescreen:
+        print("Screening contigs for exact allele matches\n")
+        prescreen_calls = exact_allele_prescreen(qgenome, seqs)
+        print("Exact matches found by pre-screen: {}\n".format(len(prescreen_calls.keys())))
+    if known_calls:
+        prescreen_calls.update(known_calls)
+
+    # only loci not resolved by the pre-screen are blasted
+    unresolved_sizes = {x: locus_allowed_size[x] for x in locus_list if x not in prescreen_calls}
+
+    if len(unresolved_sizes) == 0:
+        alleles_called_ref, ref_blast_hits, no_hits = {}, [], []
+    else:
+        print("Running BLAST\n")
+        if prescreen_calls:
+            ref_db = build_subset_db(seqs, unresolved_sizes.keys(), tempdir)
+        else:
+            ref_db = get_ref_db(ref_alleles_in, args.refdb)
+
+        # gets ref allele hits and blast hits against reference
+        alleles_called_ref, ref_blast_hits, no_hits = ref_exact_blast(query_genome, ref_db, unresolved_sizes,
+                                                                      tempdir,args)
+
+    call_alleles_from_blast(query_genome, qgenome, outfile, args, seqs, locus_list, prescreen_calls,
+                            alleles_called_ref, ref_blast_hits, no_hits, mgt1st, serotype, cache_key)
+
+    if cache:
+        cache.put("alleles", cache_key, {"alleles.fasta": outfile, "calls.json.gz": calls_record_path(outfile)})
+
+    elapsed_time = time.time() - start_time
+
+    print("Allele calling completed in: {:2f}".format(elapsed_time))
+
+    stage_metrics.write_metrics(outdir + "/" + strain_name + "_metrics.json", strain_name,
+                                allele_calling_wall_s=round(elapsed_time, 3))
+
+    if os.path.exists(tempdir):
+        shutil.rmtree(tempdir)
+
+    now = datetime.datetime.now()
+    timestamp = now.strftime("%H:%M:%S")
+
+
+    print("[" + timestamp + "] MGT fastq to alleles pipeline complete for strain: " + strain_name)
+
+def alleles_cache_key(cache, query_genome, args, mgt1st, serotype):
+    """
+    result cache key of an alleles file: genome, reference alleles and calling parameters
+    (mgt1st/serotype are written into the alleles file header so are part of the key)
+    """
+    params = {"refalleles_md5": fasta_md5(args.refalleles), "hspident": args.hspident,
+              "locusnlimit": args.locusnlimit, "snpwindow": args.snpwindow, "densitylim": args.densitylim,
+              "blastident": args.blastident, "mgt1st": mgt1st, "serotype": serotype}
+    return cache.key("alleles", [query_genome], params)
 
-    # gets ref allele hits and blast hits against reference
-    alleles_called_ref, ref_blast_hits, no_hits = ref_exact_blast(query_genome, ref_alleles_in, locus_allowed_size,
-                                                                  tempdir,args)
+
+def call_alleles_from_blast(query_genome, qgenome, outfile, args, seqs, locus_list, prescreen_calls,
+                            alleles_called_ref, ref_blast_hits, no_hits, mgt1st, serotype, cache_key=None):
+    """
+    second half of genome_to_alleles (shared with genomes_to_alleles): partial hits -> reconstructed loci -> output file
+
+    :param query_genome: assembled genome path
+    :param qgenome: query genome ContigStore
+    :param outfile: _alleles.fasta output path
+    :param args: args from main()
+    :param seqs: {locus:{allele id:seq}} from get_allowed_locus_sizes
+    :param locus_list: all loci
+    :param prescreen_calls: exact calls from exact_allele_prescreen
+    :param alleles_called_ref: exact calls from BLAST
+    :param ref_blast_hits: blast results for this genome
+    :param no_hits: loci without BLAST hits
+    :param mgt1st: 7 gene mlst included in allele file as a header
+    :param cache_key: result cache key the alleles file is stored under (kept in the calling record)
+    :return: writes alleles,zero calls,7geneMLST to outfile and the calling record to <strain>_calls.json.gz
+    """
+    hsp_ident_thresh = float(args.hspident)  # scriptvariable blast identity to at least one other allele for each locus
+    missing_limit = args.locusnlimit  # scriptvariable minimum allowable fraction of locus not lost (i.e. max 20% can be "N")
+    wordsize = 18  # scriptvariable blast word size
+
+    alleles_called_ref.update(prescreen_calls)
 
     print(no_hits)
     exacthits = len(alleles_called_ref.keys())
+    stage_metrics.count("loci", len(locus_list))
+    stage_metrics.count("exact_hits", exacthits)
     print("Exact matches found: {}\n".format(exacthits))
     print("Processing partial BLAST hits\n")
 
@@ -585,7 +1100,8 @@ def genome_to_alleles(query_genome, strain_name, args, mgt1st, serotype):
     # Try to rebuild each locus that has partial hsps matching it
     # returns reconstructed loci (with Ns) where possible
     reconstructed, uncallable = generate_query_allele_seqs(partial_hsps, query_genome, missing_limit,
-                                                           wordsize, tophitlocus, qgenome, hsp_ident_thresh, uncallable)
+                                                           wordsize, tophitlocus, qgenome, hsp_ident_thresh, uncallable,
+                                                           workers=args.recon_workers)
 
     alleles_called_ref,newcalls = check_reconstructed_for_exact_matches(reconstructed,seqs,alleles_called_ref)
 
@@ -594,22 +1110,145 @@ def genome_to_alleles(query_genome, strain_name, args, mgt1st, serotype):
 
     exacthits = len(alleles_called_ref.keys())-exacthits
     print("Reconstructed exact matches found: {}\n".format(exacthits))
+    stage_metrics.count("reconstructed_exact_hits", exacthits)
 
     print("Writing outputs\n")
     write_outalleles(outfile, reconstructed, alleles_called_ref, uncallable, locus_list, mgt1st, no_hits, serotype)
+    strain_name = os.path.basename(outfile)[:-len("_alleles.fasta")]
+    write_call_record(calls_record_path(outfile), strain_name, seqs, locus_list, mgt1st, serotype, alleles_called_ref,
+                      reconstructed, uncallable, no_hits, cache_key)
 
-    elapsed_time = time.time() - start_time
 
-    print("Allele calling completed in: {:2f}".format(elapsed_time))
 
-    if os.path.exists(tempdir):
-        shutil.rmtree(tempdir)
+def genomes_to_alleles(genomes, args):
+    """
+    batch version of genome_to_alleles: contigs of all genomes (that are not fully resolved by the pre-screen)
+    are written to one query file with contig ids prefixed by the genome's position in the batch (g<n>|contig),
+    blasted once against the reference allele database and the hsps are split back out per genome for the
+    per locus calling in call_alleles_from_blast. One _alleles.fasta (and _metrics.json) is written per strain.
+
+    :param genomes: list of (assembled genome path, strain name, 7 gene mlst, serotype)
+    :param args: args from main()
+    :return: {strain name: failure message} for strains that could not be called
+    """
+    start_time = time.time()
+
+    locus_allowed_size, seqs = get_allowed_locus_sizes(args.refalleles)
+    locus_list = [x for x in locus_allowed_size.keys()]
+
+    if args.tmpdir:
+        batchdir = args.tmpdir + "/batch_{}/".format(os.getpid())
+    else:
+        batchdir = args.outpath + "batch_{}_tmp/".format(os.getpid())
+    if os.path.exists(batchdir):
+        shutil.rmtree(batchdir)
+    os.makedirs(batchdir)
+
+    ## pre-screen each genome and write its contigs to the combined query
+
+    batch_query = batchdir + "batch_genomes.fasta"
+    outf = open(batch_query, "wb")
+    batch = []
+    cache = get_result_cache(args)
+    for query_genome, strain_name, mgt1st, serotype in genomes:
+        if cache:
+            outfile = args.outpath + strain_name + "/" + strain_name + "_alleles.fasta"
+            if cache.get("alleles", alleles_cache_key(cache, query_genome, args, mgt1st, serotype),
+                         {"alleles.fasta": outfile, "calls.json.gz": calls_record_path(outfile)}) is not None:
+                print("{}: alleles restored from result cache".format(strain_name))
+                continue
+        qgenome = ContigStore.from_fasta(query_genome, use_mmap=args.genome_mmap)
+        prescreen_calls = {}
+        if not args.no_prescreen:
+            prescreen_calls = exact_allele_prescreen(qgenome, seqs)
+        unresolved_sizes = {x: locus_allowed_size[x] for x in locus_list if x not in prescreen_calls}
+        print("{}: exact matches found by pre-screen: {}".format(strain_name, len(prescreen_calls.keys())))
+        if unresolved_sizes:
+            for contig in qgenome:
+                outf.write(">g{}|{}\n".format(len(batch), contig).encode())
+                outf.write(qgenome.raw(contig) + b"\n")
+        batch.append((query_genome, strain_name, mgt1st, serotype, prescreen_calls, unresolved_sizes))
+    outf.close()
+
+    ## one BLAST for the whole batch, hsps demultiplexed by genome prefix
+
+    genome_hits = {x: [] for x in range(len(batch))}
+    if any(x[5] for x in batch):
+        print("Running BLAST for {} genomes\n".format(len(batch)))
+        ref_db = get_ref_db(args.refalleles, args.refdb)
+        bident = int(args.blastident)
+        for result in run_blast(batch_query, ref_db, 15, 1000000, bident, batchdir, args):
+            prefix, contig = result.query.split("|", 1)
+            result.query = contig
+            genome_hits[int(prefix[1:])].append(result)
+    os.remove(batch_query)
+    batch_metrics = stage_metrics.report()["stages"]
+
+    ## per genome calling, a failing genome does not stop the batch
+
+    failed = {}
+    for gno, (query_genome, strain_name, mgt1st, serotype, prescreen_calls, unresolved_sizes) in enumerate(batch):
+        strain_start = time.time()
+        stage_metrics.reset()
+        outdir = args.outpath + strain_name
+        outfile = outdir + "/" + strain_name + "_alleles.fasta"
+        if not os.path.exists(outdir):
+            os.mkdir(outdir)
+        cache_key = alleles_cache_key(cache, query_genome, args, mgt1st, serotype) if cache else None
+        try:
+            qgenome = ContigStore.from_fasta(query_genome, use_mmap=args.genome_mmap)
+            alleles_called_ref, no_hits = exact_hits_from_blast(genome_hits[gno], unresolved_sizes)
+            call_alleles_from_blast(query_genome, qgenome, outfile, args, seqs, locus_list, prescreen_calls,
+                                    alleles_called_ref, genome_hits[gno], no_hits, mgt1st, serotype, cache_key)
+        except (Exception, SystemExit) as e:
+            print("{}: allele calling failed: {}".format(strain_name, e))
+            failed[strain_name] = str(e)
+            continue
+        genome_hits[gno] = None
+        if cache:
+            cache.put("alleles", cache_key, {"alleles.fasta": outfile, "calls.json.gz": calls_record_path(outfile)})
+        stage_metrics.write_metrics(outdir + "/" + strain_name + "_metrics.json", strain_name,
+                                    allele_calling_wall_s=round(time.time() - strain_start, 3),
+                                    batch_size=len(batch), batch_stages=batch_metrics)
+
+    if os.path.exists(batchdir):
+        shutil.rmtree(batchdir)
+
+    elapsed_time = time.time() - start_time
+    print("Batch allele calling of {} genomes completed in: {:2f}".format(len(batch), elapsed_time))
 
     now = datetime.datetime.now()
     timestamp = now.strftime("%H:%M:%S")
+    print("[" + timestamp + "] MGT batch genome to alleles pipeline complete, {} failed".format(len(failed)))
 
+    return failed
+
+
+@stage_metrics.stage("exact_allele_prescreen")
+def exact_allele_prescreen(qgenome, seqs):
+    """
+    finds full length exact copies of known alleles in the contigs (exact_scan.py)
+
+    a locus is only called here if all exact copies found are the same allele, otherwise it is left for BLAST
+
+    :param qgenome: query genome ContigStore
+    :param seqs: {locus:{allele id:seq}} from get_allowed_locus_sizes
+    :return: dict of loci with exact hits {locus:allele number}
+    """
+
+    found = find_exact_alleles(qgenome, seqs, 31)  # scriptvariable pre-screen anchor kmer size
+
+    calls = {}
+    for locus in found:
+        if len(found[locus]) == 1:
+            allele = list(found[locus])[0]
+            calls[locus] = allele.split(":")[1]
+
+    stage_metrics.count("loci", len(seqs))
+    stage_metrics.count("exact_hits", len(calls))
+
+    return calls
 
-    print("[" + timestamp + "] MGT fastq to alleles pipeline complete for strain: " + strain_name)
 
 def check_reconstructed_for_exact_matches(reconstructed,refseqs,alleles_called_ref):
     newcalls = []
@@ -623,7 +1262,7 @@ def check_reconstructed_for_exact_matches(reconstructed,refseqs,alleles_called_r
                     newcalls.append(locus)
     return alleles_called_ref,newcalls
 
-def ref_exact_blast(query_genome, ref_fasta, allele_sizes, tempdir,args):
+def ref_exact_blast(query_genome, ref_db, allele_sizes, tempdir,args):
     """
     runs blast and extracts exact hits to existing alleles
     data structure of parsed blast results:
@@ -635,20 +1274,32 @@ def ref_exact_blast(query_genome, ref_fasta, allele_sizes, tempdir,args):
             hsp attributes: 'align_length', 'bits', 'expect', 'frame', 'gaps', 'identities', 'match', 'num_alignments', 'positives', 'query', 'query_end', 'query_start', 'sbjct', 'sbjct_end', 'sbjct_start', 'score', 'strand'
 
     :param query_genome: query genome fasta path
-    :param ref_fasta: path to existing intact alleles file
-    :param allele_sizes: dictionary of required allele sizes for each locus
+    :param ref_db: blastdb prefix of existing intact alleles (see ref_blastdb.py)
+    :param allele_sizes: dictionary of required allele sizes for each locus to be blasted
     :param tempdir: directory path that is created to hold blast outputs/tmp files
 
     :return: dict of loci with exact hits, Bio.Blast.NCBIXML parsed blast results, list of loci with no blast hits in query genome
     """
-    no_hits = list(allele_sizes.keys())
     # scriptvariable 15 blast word size
     # scriptvariable 1000000 culling limit
     # scriptvariable 90 blast identity limit
 
     bident = int(args.blastident)
 
-    blast_hits = run_blast(query_genome, ref_fasta, 15, 1000000, bident, tempdir,args)
+    blast_hits = run_blast(query_genome, ref_db, 15, 1000000, bident, tempdir,args)
+
+    exact_dict, no_hits = exact_hits_from_blast(blast_hits, allele_sizes)
+
+    return exact_dict, blast_hits, no_hits
+
+
+def exact_hits_from_blast(blast_hits, allele_sizes):
+    """
+    :param blast_hits: parsed blast results of one genome
+    :param allele_sizes: dictionary of required allele sizes for each locus to be called
+    :return: dict of loci with exact hits, list of loci with no blast hits in query genome
+    """
+    no_hits = list(allele_sizes.keys())
     exact_list = []
     exact_dict = {}
     for result in blast_hits:
@@ -666,15 +1317,16 @@ def ref_exact_blast(query_genome, ref_fasta, allele_sizes, tempdir,args):
                         if allele_hit not in exact_dict:
                             exact_dict[allele_hit] = allele_no  # store exact hit in dict
 
-    return exact_dict, blast_hits, no_hits
+    return exact_dict, no_hits
 
 
 
+@stage_metrics.stage("run_blast")
 def run_blast(query_seq, locus_db, wordsize, culling, pident, tempdir,args):
     """
 
     :param query_seq: query sequence - can be multiple fasta seqs
-    :param locus_db: blastdb path
+    :param locus_db: blastdb path (prefix of makeblastdb output, not a fasta)
     :param wordsize: blast word size
     :return: returns list of blast results
     """
@@ -682,11 +1334,16 @@ def run_blast(query_seq, locus_db, wordsize, culling, pident, tempdir,args):
     # scriptvariable evalue 0.1
 
     cpus = multiprocessing.cpu_count()
-    gene = basename(locus_db).replace(".fasta", "")
-    tmp_out = tempdir + "/tmp_blast.xml"
+    if args.blastfmt == "tab":
+        # tabular output streamed into compact hsp records (see blast_tabular.py)
+        tmp_out = tempdir + "/tmp_blast.tsv"
+        outfmt = "\"{}\"".format(OUTFMT)
+    else:
+        tmp_out = tempdir + "/tmp_blast.xml"
+        outfmt = 5
     cline = NcbiblastnCommandline(
         query=query_seq,
-        subject=locus_db,
+        db=locus_db,
         evalue=0.1,
         perc_identity=pident,
         # penalty=-5,
@@ -695,7 +1352,7 @@ def run_blast(query_seq, locus_db, wordsize, culling, pident, tempdir,args):
         # gapopen=4,
         # ungapped=True,
         out=tmp_out,
-        outfmt=5,
+        outfmt=outfmt,
         max_target_seqs=10000000,
         max_hsps=5,
         word_size=wordsize,
@@ -711,9 +1368,17 @@ def run_blast(query_seq, locus_db, wordsize, culling, pident, tempdir,args):
 
     r_handle = open(tmp_out)
 
-    blast_records = list(NCBIXML.parse(r_handle))
+    if args.blastfmt == "tab":
+        blast_records = list(parse_blast_tabular(r_handle))
+    else:
+        blast_records = list(NCBIXML.parse(r_handle))
 
+    r_handle.close()
     remove(tmp_out)
+
+    stage_metrics.count("queries", len(blast_records))
+    stage_metrics.count("alignments", sum(len(x.alignments) for x in blast_records))
+    stage_metrics.count("hsps", sum(len(y.hsps) for x in blast_records for y in x.alignments))
     """
     blast_records structure: 
     list of results (if multifasta input, one result per fasta seq) 
@@ -727,6 +1392,7 @@ def run_blast(query_seq, locus_db, wordsize, culling, pident, tempdir,args):
 
 
 
+@stage_metrics.stage("get_partial_match_query_region")
 def get_partial_match_query_region(blast_results, partial_matches, qgenome, hsp_ident,seqs):
     """
 
@@ -874,159 +1540,60 @@ def get_partial_match_query_region(blast_results, partial_matches, qgenome, hsp_
     if testlocus in no_call_reason:
         print("REASON",no_call_reason[testlocus])
 
-    return npartials, no_call_reason,tophitlocus
-
-def mask_high_snp_regions(locus, recon_locus, ref_locus, window_size, snp_limit):
-    """
-    compare new allele seq to "ref" allele to identify and mask(with Ns) regions with high snp density
-    which can be caused by BLAST errors where indels are present in query seq
-
-    :param locus: Not currently used (useful for debug)
-    :param recon_locus: sequence to be checked
-    :param ref_locus: sequence of 'ref' locus
-    :param window_size: size of rolling window to check SNP frequency within
-    :param snp_limit: limit of number of SNPs within that window
-
-    :return: input sequence to be checked with regions with elevated SNP counts masked if necessary
-    """
-
-    if len(recon_locus) != len(ref_locus): #  comparison with reference will break if lengths not the same
-        return recon_locus
-
-    halfwindow = int(window_size / 2)
-    mutpos = []
-    outlocus = list(str(recon_locus)) #  Convert test sequence into list of letters
-    for pos in range(len(recon_locus)):
-        if recon_locus[pos] != ref_locus[pos] and recon_locus[pos] not in ["N", "-"] and ref_locus[pos] not in ["N","-"]:
-            mutpos.append("X")#  if the same position doesn't match (i.e. a SNP) and that missmatch is not caused by an N or an indel
-        else:
-            mutpos.append("M")  # If ref and new seq are the same
-
-    #  Get list of ranges allowing for window length over whole locus
-    for x in range(halfwindow, len(ref_locus) - halfwindow):
-        window = mutpos[x - halfwindow:x + halfwindow]  # get window list of Match(M) or SNP(X)
-        if window.count("X") > int(snp_limit):
-            # if num of SNPS greater than limit mask all positions in current window
-            for pos in range(x - halfwindow, x + halfwindow):
-                outlocus[pos] = "N"  # change to N
-    outlocus = "".join(outlocus)
+    stage_metrics.count("loci", len(partial_matches))
+    stage_metrics.count("partial_loci", len(npartials))
+    stage_metrics.count("hsps", sum(len(x) for x in npartials.values()))
+    stage_metrics.count("uncallable", len(no_call_reason))
 
-    if outlocus.count("N") > (1 - float(0.8)) * len(ref_locus):
-        print("Too many Ns",locus)
-
-    return outlocus
+    return npartials, no_call_reason,tophitlocus
 
+@stage_metrics.stage("generate_query_allele_seqs")
 def generate_query_allele_seqs(partial_hsps, query_genome, missing_perc_cutoff, wordsize, tophitlocus,
-                               qgenome, hsp_thresh, uncallable):
+                               qgenome, hsp_thresh, uncallable, workers=1):
     """
 
     reconstruct allele sequences from hsps that partially cover the locus
 
     :param partial_hsps: each locus' partially matching hsps
-    :param query_genome: path to query genome file
+    :param query_genome: path to query genome file (not reparsed, qgenome is used)
     :param alleles_sizes: allele sizes dict
     :param missing_perc_cutoff: max amount of locus allowed to be missing as fraction (i.e. 0.8)
     :param wordsize: blast word size
     :param ref_alleles: allele seqs derived from "reference" (all are allele 1)
-    :param qgenome: query genome as dict
+    :param qgenome: query genome ContigStore
     :param hsp_thresh: BLAST identity threshold to pass hsp filter
     :param uncallable: dict - loci called 0 with reason as value
+    :param workers: number of processes to reconstruct loci in (1 = serial), results are identical either way
 
     :return: reconstructed alleles in dict and loci where reconstruction failed in uncallable dict
     """
-    query_genome = SeqIO.parse(query_genome, "fasta")
-    q_genome = {}
     calls = {}
 
-    full_allele = ""
-
-    testlocus = "BPXXXX"
-
-    for s in query_genome:
-        q_genome[s.id] = str(s.seq)
-
     # check that number of identities in blast hits is at least X fraction of normal reference allele length
     # need to check that at least x of allele is covered
-    hspcov = 0
-    for locus in partial_hsps:
-        hspls = partial_hsps[locus]
-        reflen = len(tophitlocus[locus])
-        refhit = tophitlocus[locus]
-
-        frac_covered = get_combined_hsp_coverage_of_ref_allele(reflen, hspls, hsp_thresh)  # annotation in function
-
-        if frac_covered < float(missing_perc_cutoff):
-            uncallable[locus] = "unscorable_too_much_missing"
-            hspcov +=1
-        hspls = list(remove_hsps_entirely_within_others(hspls, locus, hsp_thresh))
-        # removes small hsps within larger ones caused by partial hits to non-orthologous but related genes
-
-        hspls = check_ends_for_snps(hspls, tophitlocus[locus], "", qgenome)  # annotation in function
-
-        hspls2 = []
-        if len(hspls) == 0:
-            uncallable[locus] = "failed_filter"
-        elif len(hspls) > 1:
-            contigs = {}
-            for tup in hspls:
-                hsp = tup[0]
-                # scriptvariable hsp min size
-                if hsp_filter_ok(hsp, 30, hsp_thresh):
-                    hspls2.append(tup)
-                    contig = tup[1].split(" ")[0]
-                    if contig not in contigs:
-                        contigs[contig] = [tup]
-                    else:
-                        contigs[contig].append(tup)
-
-            # if hits come from > 1 contig
-            if len(contigs.keys()) > 1:
-
-                message, full_allele = check_split_over_contigs(hspls2, query_genome, reflen,
-                                                                locus)  # annotation in function
-                if locus == testlocus:
-                    print("MESSAGE",message)
-                if message == "inconsistent_overlap":
-                    uncallable[locus] = message
-                else:
-                    calls[locus] = full_allele
-
-            else:
-
-                for c in contigs:  # there will only be one contig
-                    fixed_mid = check_mid(c, contigs[c], q_genome, wordsize, reflen, locus,refhit)  # annotation in function
-
-                    if locus == testlocus:
-                        print("fixed_mid", fixed_mid)
-
-                    if fixed_mid == "possible_insertion":
-                        uncallable[locus] = "possible_insertion"
-                    elif fixed_mid == "mixed_orientation":
-                        uncallable[locus] = "mixed_orientation"
-                    else:
-                        calls[locus] = fixed_mid
-
-
-        else:  # if only one hsp matches
-
-            hsp = hspls[0][0]
-            queryid = hspls[0][1].split(" ")[0]
-            contig = q_genome[queryid]
-
-            seq = remove_indels_from_hsp(hsp).query
-
-            full_allele, added_start, added_end = check_ends(contig, hsp.query_start, hsp.query_end, hsp.sbjct_start,
-                                                             hsp.sbjct_end, reflen, seq,
-                                                             locus)  # annotation in function
-
-            calls[locus] = full_allele
+    # loci are independent so can be reconstructed in forked workers which inherit the contig store read-only
+    # results are collected in partial_hsps order so output is the same as the serial path
+    global _recon_shared
+    _recon_shared = (qgenome, tophitlocus, missing_perc_cutoff, wordsize, hsp_thresh)
+    locus_inputs = [(locus, partial_hsps[locus]) for locus in partial_hsps]
+    if int(workers) > 1 and len(locus_inputs) > 1:
+        pool = multiprocessing.get_context("fork").Pool(int(workers))
+        results = pool.map(reconstruct_locus, locus_inputs, chunksize=max(1, int(len(locus_inputs) / (int(workers) * 4))))
+        pool.close()
+        pool.join()
+    else:
+        results = [reconstruct_locus(x) for x in locus_inputs]
+    _recon_shared = None
 
+    for locus, call, reason in results:
+        if reason:
+            uncallable[locus] = reason
+        if call is not None:
+            calls[locus] = call
 
     for locus in calls:
-        newseq = str(calls[locus])
-
-        calls[locus] = mask_high_snp_regions(locus, newseq, tophitlocus[locus], args.snpwindow,
-                                       args.densitylim)
+        if calls[locus].count("N") > (1 - float(0.8)) * len(tophitlocus[locus]):
+            print("Too many Ns",locus)
 
     missingperc = 0
     calls2 = dict(calls)
@@ -1045,9 +1612,107 @@ def generate_query_allele_seqs(partial_hsps, query_genome, missing_perc_cutoff,
             calls2[locus] = calls[locus]
     print("missing:",missingperc)
 
+    stage_metrics.count("loci", len(partial_hsps))
+    stage_metrics.count("hsps", sum(len(x) for x in partial_hsps.values()))
+    stage_metrics.count("reconstructed", len(calls2))
+
     return calls2, uncallable
 
 
+def reconstruct_locus(locus_input):
+    """
+    reconstruct one locus from its partial hsps, the per locus body of generate_query_allele_seqs
+    genome dicts and thresholds come from _recon_shared (set by generate_query_allele_seqs) so they are not
+    copied to pool workers for every locus
+
+    :param locus_input: (locus, list of partial hsp tuples)
+    :return: (locus, snp masked reconstructed allele or None, reason locus is uncallable or None)
+    """
+    locus, hspls = locus_input
+    qgenome, tophitlocus, missing_perc_cutoff, wordsize, hsp_thresh = _recon_shared
+    q_genome = qgenome
+    query_genome = None  # not used by check_split_over_contigs
+
+    testlocus = "BPXXXX"
+    call = None
+    reason = None
+
+    reflen = len(tophitlocus[locus])
+    refhit = tophitlocus[locus]
+
+    frac_covered = get_combined_hsp_coverage_of_ref_allele(reflen, hspls, hsp_thresh)  # annotation in function
+
+    if frac_covered < float(missing_perc_cutoff):
+        reason = "unscorable_too_much_missing"
+    hspls = list(remove_hsps_entirely_within_others(hspls, locus, hsp_thresh))
+    # removes small hsps within larger ones caused by partial hits to non-orthologous but related genes
+
+    hspls = check_ends_for_snps(hspls, tophitlocus[locus], "", qgenome)  # annotation in function
+
+    hspls2 = []
+    if len(hspls) == 0:
+        reason = "failed_filter"
+    elif len(hspls) > 1:
+        contigs = {}
+        for tup in hspls:
+            hsp = tup[0]
+            # scriptvariable hsp min size
+            if hsp_filter_ok(hsp, 30, hsp_thresh):
+                hspls2.append(tup)
+                contig = tup[1].split(" ")[0]
+                if contig not in contigs:
+                    contigs[contig] = [tup]
+                else:
+                    contigs[contig].append(tup)
+
+        # if hits come from > 1 contig
+        if len(contigs.keys()) > 1:
+
+            message, full_allele = check_split_over_contigs(hspls2, query_genome, reflen,
+                                                            locus)  # annotation in function
+            if locus == testlocus:
+                print("MESSAGE",message)
+            if message == "inconsistent_overlap":
+                reason = message
+            else:
+                call = full_allele
+
+        else:
+
+            for c in contigs:  # there will only be one contig
+                fixed_mid = check_mid(c, contigs[c], q_genome, wordsize, reflen, locus,refhit)  # annotation in function
+
+                if locus == testlocus:
+                    print("fixed_mid", fixed_mid)
+
+                if fixed_mid == "possible_insertion":
+                    reason = "possible_insertion"
+                elif fixed_mid == "mixed_orientation":
+                    reason = "mixed_orientation"
+                else:
+                    call = fixed_mid
+
+
+    else:  # if only one hsp matches
+
+        hsp = hspls[0][0]
+        queryid = hspls[0][1].split(" ")[0]
+
+        seq = remove_indels_from_hsp(hsp).query
+
+        full_allele, added_start, added_end = check_ends(queryid, hsp.query_start, hsp.query_end, hsp.sbjct_start,
+                                                         hsp.sbjct_end, reflen, seq,
+                                                         locus)  # annotation in function
+
+        call = full_allele
+
+    if call is not None:
+        call = mask_high_snp_regions(locus, str(call), tophitlocus[locus], args.snpwindow,
+                                     args.densitylim)
+
+    return locus, call, reason
+
+
 ######## PER LOCUS ########
 
 def get_combined_hsp_coverage_of_ref_allele(reflen, hspls, hsp_thresh):
@@ -1122,7 +1787,7 @@ def check_ends_for_snps(hsplis, full_subj, locus, qgenome):
     :param hsplis: list of high scoring pairs (hsps) from blast
     :param full_subj: allele subject
     :param locus: not needed except for error reporting
-    :param qgenome: query genome
+    :param qgenome: query genome ContigStore
 
     :return: list of modified hsps with locus ending snps included
     """
@@ -1135,14 +1800,14 @@ def check_ends_for_snps(hsplis, full_subj, locus, qgenome):
         nhsp = hsp[0]
 
         contig2 = contig.split(" ")[0]
-        contigseq = qgenome[contig2]
+        contiglen = qgenome.length(contig2)
         subseq = full_subj
 
         trial = 0
         if thsp.sbjct_start > thsp.sbjct_end:
             if thsp.sbjct_end == 2:
-                if thsp.query_end < len(contigseq):
-                    q_snp = contigseq[thsp.query_end]
+                if thsp.query_end < contiglen:
+                    q_snp = qgenome.base(contig2, thsp.query_end)
                 else:
                     q_snp = "N"  # if only final nucleotide is deleted from allele add N TODO INDEL record this as a del when dels are included for this and next 3 instances
                 s_snp = reverse_complement(subseq[0])
@@ -1155,7 +1820,7 @@ def check_ends_for_snps(hsplis, full_subj, locus, qgenome):
             if thsp.sbjct_start == len(subseq) - 1:
                 # trial = 1
                 if thsp.query_start - 2 >= 0:
-                    q_snp = contigseq[thsp.query_start - 2]
+                    q_snp = qgenome.base(contig2, thsp.query_start - 2)
                 else:
                     q_snp = "N"
                 s_snp = reverse_complement(subseq[-1])
@@ -1168,7 +1833,7 @@ def check_ends_for_snps(hsplis, full_subj, locus, qgenome):
         else:
             if thsp.sbjct_start == 2:
                 if thsp.query_start - 2 >= 0:
-                    q_snp = contigseq[thsp.query_start - 2]
+                    q_snp = qgenome.base(contig2, thsp.query_start - 2)
                 else:
                     q_snp = "N"
                 s_snp = subseq[0]
@@ -1180,8 +1845,8 @@ def check_ends_for_snps(hsplis, full_subj, locus, qgenome):
                 nhsp.query_start = nhsp.query_start - 1
             if thsp.sbjct_end == len(subseq) - 1:
                 try:
-                    if thsp.query_end < len(contigseq):
-                        q_snp = contigseq[thsp.query_end]
+                    if thsp.query_end < contiglen:
+                        q_snp = qgenome.base(contig2, thsp.query_end)
                     else:
                         q_snp = "N"
                     s_snp = subseq[-1]
@@ -1243,7 +1908,8 @@ def check_split_over_contigs(hspls, query_genome, reflen, locus):
     # get first hsp
     hsp1 = range_d[sorted_range_list[0]][0]
 
-    newseq = remove_indels_from_hsp(hsp1).query
+    # built as a list of bases, joined once at the end
+    newseq = list(remove_indels_from_hsp(hsp1).query)
 
 
     for rang in range(len(sorted_range_list) - 1):
@@ -1273,11 +1939,12 @@ def check_split_over_contigs(hspls, query_genome, reflen, locus):
 
             if end_cur == start_next:
                 add_seq = next_query[overlap:]
-                newseq += add_seq
+                newseq.extend(add_seq)
 
             else:
                 add_seq = "N"*overlap + next_query[overlap:]
-                newseq = newseq[:olstart] + add_seq
+                del newseq[olstart:]
+                newseq.extend(add_seq)
                 # return "inconsistent_overlap", ""
 
             # check overlap for identity
@@ -1285,17 +1952,18 @@ def check_split_over_contigs(hspls, query_genome, reflen, locus):
         elif cur_range_end == next_range_start - 1:
             # if the hsps end and start on consecutive positions then just add next hsp to new seq
             add = remove_indels_from_hsp(next_hsp).query
-            newseq += add
+            newseq.extend(add)
         elif cur_range_end < next_range_start - 1:
             # if there is a gap add Ns the size of the gap to newseq and then the next hsp
             # add Ns in gap
             missing_no = next_range_start - cur_range_end - 1
             nstring = "N" * missing_no
-            newseq += nstring
+            newseq.extend(nstring)
             add_seq = remove_indels_from_hsp(next_hsp).query
-            newseq += add_seq
+            newseq.extend(add_seq)
         else:
             print("\n\nPROBLEM SPLIT CONTIGS\n\n")
+    newseq = "".join(newseq)
     if len(newseq) == reflen:
         return "reconstructed split", newseq
     else:
@@ -1315,9 +1983,9 @@ def check_mid(contig, hspls, q_genome, wordsize, reflen, locus,refhit):
     where two or more partial hsps match same contig
     sequentially add them together with Ns filling gaps and removing identical ovelaps to create full length allele
     use word length ratio as cutoff for allowing non-N letters in restored gap sequence(i.e. if word length is 12. non-N sequence chunk between 2 hsps can be a max of 18 before possible insertion is called)
-    :param contig:
+    :param contig: contig id
     :param hspls:
-    :param q_genome:
+    :param q_genome: query genome ContigStore (not used, alleles are rebuilt from the hsp query strings)
     :param wordsize:
     :param reflen:
     :param locus:
@@ -1339,7 +2007,8 @@ def check_mid(contig, hspls, q_genome, wordsize, reflen, locus,refhit):
 
         sorted_hsps = sorted(map(int, order.keys()))
 
-        full_allele = remove_indels_from_hsp(order[sorted_hsps[0]]).query
+        # built as a list of bases, joined once before check_ends
+        full_allele = list(remove_indels_from_hsp(order[sorted_hsps[0]]).query)
 
         sstart = order[sorted_hsps[0]].sbjct_start
         send = order[sorted_hsps[-1]].sbjct_end
@@ -1365,13 +2034,12 @@ def check_mid(contig, hspls, q_genome, wordsize, reflen, locus,refhit):
                     olcheck, ollen = check_matching_overlap(hsp, hspnext, "positive")
                     hspnext = remove_indels_from_hsp(hspnext)
                     if olcheck == "nomatch":
-                        addr = q_genome[contig][hspnext.query_start + ollen-1:hspnext.query_end]
                         add = hspnext.query[ollen:]
-                        full_allele = full_allele[:-1*(ollen)] + "N"*ollen + add
+                        del full_allele[-1*(ollen):]
+                        full_allele.extend("N"*ollen + add)
                     else:
-                        addr = q_genome[contig][hspnext.query_start + ollen-1:hspnext.query_end]
                         add = hspnext.query[ollen:]
-                        full_allele = full_allele + add
+                        full_allele.extend(add)
                     if locus == test_locus:
                         print("OLCHECK",olcheck)
 
@@ -1379,8 +2047,8 @@ def check_mid(contig, hspls, q_genome, wordsize, reflen, locus,refhit):
 
                     # if no overlap then add string of N length of gap
                     mid_section_seq = "N" * (hspnext.sbjct_start - hsp.sbjct_end - 1)
-                    full_allele += mid_section_seq
-                    full_allele += remove_indels_from_hsp(hspnext).query  # hspnext.query
+                    full_allele.extend(mid_section_seq)
+                    full_allele.extend(remove_indels_from_hsp(hspnext).query)  # hspnext.query
                     nonn_size = largest_nonn_strings(mid_section_seq)
 
                     # if length of gap is 2 times blast word size then the gap is likely caused by an insertion - call as 0
@@ -1406,21 +2074,22 @@ def check_mid(contig, hspls, q_genome, wordsize, reflen, locus,refhit):
                     hspnext = remove_indels_from_hsp(hspnext)
                     if olcheck == "nomatch":
                         add = hspnext.query[ollen:]
-                        full_allele = full_allele[:-1*(ollen)]+ "N"*ollen + add
+                        del full_allele[-1*(ollen):]
+                        full_allele.extend("N"*ollen + add)
                     else:
                         add = hspnext.query[ollen:]
-                        full_allele = full_allele + add
+                        full_allele.extend(add)
                 else:
                     mid_section_seq = "N" * (hspnext.sbjct_end - hsp.sbjct_start - 1)
-                    full_allele = full_allele + mid_section_seq
+                    full_allele.extend(mid_section_seq)
                     add = remove_indels_from_hsp(hspnext).query
-                    full_allele = full_allele + add
+                    full_allele.extend(add)
                     nonn_size = largest_nonn_strings(mid_section_seq)
                     if nonn_size > (wordsize * 2):
                         return "possible_insertion"
 
-        full_allele, added_start, added_end = check_ends(contig, qstart, qend, sstart, send, reflen, full_allele,
-                                                         locus)  # Annotation in function
+        full_allele, added_start, added_end = check_ends(contig, qstart, qend, sstart, send, reflen,
+                                                         "".join(full_allele), locus)  # Annotation in function
 
         if locus == test_locus:
             print("full_fixed",len(full_allele),full_allele)
@@ -1488,25 +2157,25 @@ def remove_indels_from_hsp(hsp):
         matches = matches[::-1]
         refstart, refend = refend, refstart
 
-    seq = ""
-    intact_nucs = ["A", "T", "G", "C", "a", "t", "c", "g"]
+    seq = []
+    intact_nucs = {"A", "T", "G", "C", "a", "t", "c", "g"}
     for i in range(len(unknown_allele)):
         if matches[i] == " ":
             if unknown_allele[i] in intact_nucs and ref_allele[i] in intact_nucs:
-                seq += unknown_allele[i]
+                seq.append(unknown_allele[i])
             elif unknown_allele[i] == "-" and ref_allele[i] in intact_nucs:
                 # TODO INDEL REMOVE Below replaces deletion in unknown allele with reference nucleotides to IGNORE DELETIONS
-                seq += ref_allele[i]
+                seq.append(ref_allele[i])
             elif unknown_allele[i] in intact_nucs and ref_allele[i] == "-":
                 continue
                 # TODO INDEL REMOVE No addition of unknown allele seq if insertion in new allele
-                # seq+=unknown_allele[i]
+                # seq.append(unknown_allele[i])
             elif unknown_allele[i] == "N":
-                seq += "N"
+                seq.append("N")
         else:
-            seq += unknown_allele[i]
+            seq.append(unknown_allele[i])
 
-    hsp1.query = seq
+    hsp1.query = "".join(seq)
     return hsp1
 
 
@@ -1514,7 +2183,8 @@ def remove_indels_from_hsp(hsp):
 def check_ends(contig, qstart, qend, sstart, send, reflen, alleleseq, locus):
     """
     Add Ns to start and/or end
-    :param contig: :param alleleseq:
+    :param contig: contig id (not used with no del calls)
+    :param alleleseq:
     :param qstart: not used with no del calls
     :param qend: not used with no del calls
     :param sstart: hsp locus position start
@@ -1824,17 +2494,6 @@ def check_for_multiple_ol_partial_hsps(hspls, hsp_thresh,locus):
 ######## UTILS ########
 
 
-def reverse_complement(dna):
-    """
-
-    :param dna:
-    :return:
-    """
-    complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', "-": "-", "N": "N"}
-    return ''.join([complement[base] for base in dna[::-1]])
-
-
-
 def largest_nonn_strings(string):
     """
 
@@ -1864,6 +2523,7 @@ def get_sizes_dict(inf):
 
 
 
+@stage_metrics.stage("write_outalleles")
 def write_outalleles(outpath, reconstructed, ref, uncall, locuslist, mgt1st, no_hits, serotype):
     outf = open(outpath, "w")
     outf.write(">{}:{}\n\n".format("species_serotype", serotype))
@@ -1911,6 +2571,11 @@ def write_outalleles(outpath, reconstructed, ref, uncall, locuslist, mgt1st, no_
     print("absent:", absent)
     outf.close()
 
+    stage_metrics.count("loci", len(locuslist))
+    stage_metrics.count("exact_hits", call)
+    stage_metrics.count("new_alleles", sum(new.values()))
+    stage_metrics.count("uncallable", sum(missing.values()) + absent)
+
 
 ######## ARGUMENTS/HELP ########
 
@@ -1923,11 +2588,51 @@ if __name__ == "__main__":
     parser.add_argument("-i","--input",
                         help="If reads: Input paired fastq(.gz) files, comma separated (i.e. name_1.fastq,name_2.fastq )\nIf genome the assembly fasta file",required=True)
     parser.add_argument("--intype",
-                        help="select input type from either reads (illumina paired end reads) for genome (assembled genome in fasta format)",
+                        help="select input type from either reads (illumina paired end reads) for genome (assembled genome in fasta format), genomes (batch of assemblies blasted together, -i is a comma separated list or a file with one assembly path per line) or recall (update earlier _alleles.fasta outputs after --refalleles has grown, -i is a comma separated list or a file listing _alleles.fasta files or strain output folders)",
                         required=True,
-                        choices=["reads","genome"])
+                        choices=["reads","genome","genomes","recall"])
+    parser.add_argument("--mode",
+                        help="reads input only: assembly (assemble then call alleles) or kmer (call known alleles from read k-mers, assembling only if some loci are unresolved)",
+                        default="assembly",
+                        choices=["assembly","kmer"])
+    parser.add_argument("--kmer_size",
+                        help="--mode kmer: k-mer size (max 31)",
+                        default=31,
+                        type=int)
+    parser.add_argument("--kmer_min_depth",
+                        help="--mode kmer: every k-mer of an allele must be seen in at least this many reads for the allele to be called",
+                        default=5,
+                        type=int)
     parser.add_argument("--refalleles", help="File path to MGT reference allele file.",
                         default="./species_specific_alleles/Xcitri_intact_alleles.fasta")
+    parser.add_argument("--refdb", help="folder holding pre-built BLAST database of --refalleles (built or rebuilt if missing/out of date, default <refalleles name>_blastdb next to refalleles)")
+    parser.add_argument("--blastfmt",
+                        help="BLAST output format parsed for allele calling, tab (streamed tabular output) or xml (Bio.Blast.NCBIXML)",
+                        default="tab",
+                        choices=["tab","xml"])
+    parser.add_argument("--no_prescreen",
+                        help="do not screen contigs for exact copies of known alleles before BLAST (BLAST all loci)",
+                        action='store_true')
+    parser.add_argument("--recon_workers",
+                        help="number of processes used to reconstruct partially matching loci (1 = serial)",
+                        default=1,
+                        type=int)
+    parser.add_argument("--genome_mmap",
+                        help="read query genome contigs on demand from an mmap of the assembly instead of loading them into memory",
+                        action='store_true')
+    parser.add_argument("--serial_steps",
+                        help="run kraken/shovill and assembly stats/mlst one after another instead of at the same time",
+                        action='store_true')
+    parser.add_argument("--cachedir",
+                        help="folder of the result cache (assemblies, QC verdicts and alleles files stored by input checksums and parameters), default <outpath>/result_cache")
+    parser.add_argument("--cache_size",
+                        help="maximum size of the result cache in GB, least recently used results are removed above this",
+                        default=20,
+                        type=float)
+    parser.add_argument("--no_cache", "--no-cache",
+                        help="do not read or write the result cache",
+                        dest="no_cache",
+                        action='store_true')
     parser.add_argument("--strainid", help="id for strain to use in output")
     parser.add_argument("--tmpdir",help="temporary folder")
     parser.add_argument("-o","--outpath", help="Path to ouput file name required=True",required=True)
@@ -1936,6 +2641,11 @@ if __name__ == "__main__":
     #parser.add_argument("--pathovar", help="estimate pathovar by MLST (OFF by default)", action='store_true')
     parser.add_argument("-y", "--pathovar", help="estimate pathovar by MLST using supplied tsv",
                         default="./mlst/mlst_pathovar_key.txt")
+    parser.add_argument("--mlst_scheme",
+                        help="folder of 7 gene MLST scheme (<gene>.tfa files + <scheme>.txt profiles) used to type genomes from exact allele matches (default xcitri folder next to --pathovar)")
+    parser.add_argument("--external_mlst",
+                        help="always type 7 gene MLST with the mlst tool instead of the internal exact match typer",
+                        action='store_true')
     parser.add_argument("-t", "--threads", help="number of computing threads",
                         default="4")
     parser.add_argument("-m", "--memory", help="memory available in GB",
@@ -1964,6 +2674,24 @@ if __name__ == "__main__":
     parser.add_argument("--kraken_db",
                         help="path for kraken db (if KRAKEN_DEFAULT_DB variable has already been set then ignore)",
                         default="/srv/scratch/lanlab/mgtdb/kraken/minikraken_20171019_8GB")
+    parser.add_argument("--kraken_threads",
+                        help="threads of --threads given to kraken while shovill runs at the same time (default a quarter of --threads), shovill gets the rest",
+                        type=int)
+    parser.add_argument("--kraken_memory",
+                        help="memory in GB taken out of --memory for kraken while shovill runs at the same time (default the size of the kraken database files)",
+                        type=float)
+    parser.add_argument("--kraken_subsample",
+                        help="classify this many read pairs first, only classify every read if the species/contamination verdict of the subsample is borderline (0 = classify every read)",
+                        default=200000,
+                        type=int)
+    parser.add_argument("--kraken_subsample_mode",
+                        help="take the first read pairs (head) or a random sample over every pair (random)",
+                        choices=["head", "random"],
+                        default="head")
+    parser.add_argument("--kraken_min_target",
+                        help="subsample screen: only pass the reads without classifying all of them if the target species is confidently over this percentage of read pairs",
+                        default=1.0,
+                        type=float)
     parser.add_argument("--hspident",
                         help="BLAST percentage identity needed for hsp to be returned",
                         default=0.98,type=float)
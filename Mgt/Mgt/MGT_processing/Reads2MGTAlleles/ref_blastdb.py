@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Build and verify the pre-built BLAST database of the reference allele set.
+
+reads_to_alleles.py used to pass the reference alleles fasta to blastn as a subject,
+which re-indexes every allele for every genome. The database made here is built once with
+makeblastdb and is stored next to the reference fasta together with an md5 of the fasta it
+was made from, so it is only rebuilt when the reference alleles change.
+
+usage:
+    python ref_blastdb.py build <ref_alleles.fasta> [--dbdir DIR] [--force]
+    python ref_blastdb.py verify <ref_alleles.fasta> [--dbdir DIR]
+"""
+
+import argparse
+import fcntl
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+
+DB_SUFFIXES = (".nhr", ".nin", ".nsq")
+
+
+######## UTILS ########
+
+
+def fasta_md5(ref_fasta):
+    """
+    :param ref_fasta: path to reference alleles fasta
+    :return: hex md5 of the file contents
+    """
+    md5 = hashlib.md5()
+    with open(ref_fasta, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def ref_db_paths(ref_fasta, dbdir=None):
+    """
+    default location is <fasta dir>/<fasta name>_blastdb/
+
+    :param ref_fasta: path to reference alleles fasta
+    :param dbdir: folder to hold the database (optional)
+    :return: (database folder, database prefix to pass to blastn -db, checksum file)
+    """
+    name = os.path.basename(ref_fasta)
+    name = os.path.splitext(name)[0]
+    if not dbdir:
+        dbdir = os.path.join(os.path.dirname(os.path.abspath(ref_fasta)), name + "_blastdb")
+    dbdir = os.path.abspath(dbdir)
+    return dbdir, os.path.join(dbdir, name), os.path.join(dbdir, name + ".md5")
+
+
+######## BUILD/VERIFY ########
+
+
+def verify_ref_db(ref_fasta, dbdir=None):
+    """
+    :param ref_fasta: path to reference alleles fasta
+    :param dbdir: folder holding the database (optional)
+    :return: (True if database exists and was built from current fasta, message)
+    """
+    dbdir, dbprefix, md5file = ref_db_paths(ref_fasta, dbdir)
+    for suffix in DB_SUFFIXES:
+        if not os.path.exists(dbprefix + suffix):
+            return False, "missing database file {}".format(dbprefix + suffix)
+    if not os.path.exists(md5file):
+        return False, "missing checksum file {}".format(md5file)
+    stored = open(md5file).read().strip()
+    current = fasta_md5(ref_fasta)
+    if stored != current:
+        return False, "{} has changed since database was built ({} != {})".format(ref_fasta, current, stored)
+    return True, "database {} is up to date".format(dbprefix)
+
+
+def build_ref_db(ref_fasta, dbdir=None):
+    """
+    database is built in a temporary folder and moved into place so that runs sharing the same
+    reference fasta never see a half written database
+
+    :param ref_fasta: path to reference alleles fasta
+    :param dbdir: folder to hold the database (optional)
+    :return: database prefix
+    """
+    dbdir, dbprefix, md5file = ref_db_paths(ref_fasta, dbdir)
+    checksum = fasta_md5(ref_fasta)
+
+    tmpdir = "{}.tmp{}".format(dbdir, os.getpid())
+    if os.path.exists(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    tmpprefix = os.path.join(tmpdir, os.path.basename(dbprefix))
+
+    cmd = 'makeblastdb -in "{}" -dbtype nucl -out "{}"'.format(ref_fasta, tmpprefix)
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        shutil.rmtree(tmpdir)
+        sys.exit("makeblastdb failed for {}:\n{}".format(ref_fasta, err.decode("utf-8")))
+
+    outf = open(os.path.join(tmpdir, os.path.basename(md5file)), "w")
+    outf.write(checksum + "\n")
+    outf.close()
+
+    # the old database is renamed aside rather than removed first so dbdir always holds a complete database
+    # or nothing, a run that finds it missing waits on the lock in get_ref_db until the new one is in place
+    olddir = "{}.old{}".format(dbdir, os.getpid())
+    if os.path.exists(dbdir):
+        os.rename(dbdir, olddir)
+    try:
+        os.rename(tmpdir, dbdir)
+    except OSError:
+        # another run built it at the same time, use theirs if it is current
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        ok, msg = verify_ref_db(ref_fasta, dbdir)
+        if not ok:
+            sys.exit("could not move reference blast database into place: " + msg)
+    finally:
+        if os.path.exists(olddir):
+            shutil.rmtree(olddir, ignore_errors=True)
+
+    return dbprefix
+
+
+def build_subset_db(seqs, loci, tempdir):
+    """
+    throwaway database holding only the alleles of some loci (i.e. those not resolved before BLAST),
+    small enough that it is built per genome in the run's temp folder without a checksum
+
+    :param seqs: {locus:{allele id:seq}} from get_allowed_locus_sizes
+    :param loci: loci to include
+    :param tempdir: run temp folder
+    :return: database prefix
+    """
+    subset_fasta = os.path.join(tempdir, "unresolved_alleles.fasta")
+    outf = open(subset_fasta, "w")
+    for locus in loci:
+        for allele in seqs[locus]:
+            outf.write(">{}\n{}\n".format(allele, str(seqs[locus][allele])))
+    outf.close()
+
+    dbprefix = os.path.join(tempdir, "unresolved_alleles")
+    cmd = 'makeblastdb -in "{}" -dbtype nucl -out "{}"'.format(subset_fasta, dbprefix)
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        sys.exit("makeblastdb failed for {}:\n{}".format(subset_fasta, err.decode("utf-8")))
+    return dbprefix
+
+
+def get_ref_db(ref_fasta, dbdir=None):
+    """
+    returns database prefix for ref_fasta, (re)building it only if it is missing or out of date
+
+    :param ref_fasta: path to reference alleles fasta
+    :param dbdir: folder to hold the database (optional)
+    :return: database prefix
+    """
+    ok, msg = verify_ref_db(ref_fasta, dbdir)
+    if ok:
+        return ref_db_paths(ref_fasta, dbdir)[1]
+
+    # concurrent runs (e.g. extract_alleles.py --jobs) wait here so only one of them builds the database
+    dbdir = ref_db_paths(ref_fasta, dbdir)[0]
+    lock = lock_ref_db(dbdir)
+    try:
+        ok, msg = verify_ref_db(ref_fasta, dbdir)
+        if ok:
+            return ref_db_paths(ref_fasta, dbdir)[1]
+        print("Building reference allele BLAST database: " + msg)
+        return build_ref_db(ref_fasta, dbdir)
+    finally:
+        unlock_ref_db(lock)
+
+
+def lock_ref_db(dbdir):
+    """
+    :param dbdir: database folder
+    :return: open lock file, held exclusively until passed to unlock_ref_db
+    """
+    lock = open(dbdir + ".lock", "w")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def unlock_ref_db(lock):
+    """
+    :param lock: lock file from lock_ref_db
+    """
+    fcntl.flock(lock, fcntl.LOCK_UN)
+    lock.close()
+
+
+######## ARGUMENTS/HELP ########
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="Build or verify the reference allele BLAST database used by reads_to_alleles.py")
+    parser.add_argument("action", choices=["build", "verify"],
+                        help="build: (re)build database if out of date, verify: check database matches fasta")
+    parser.add_argument("refalleles", help="File path to MGT reference allele file.")
+    parser.add_argument("--dbdir", help="folder to hold database (default <refalleles name>_blastdb next to refalleles)")
+    parser.add_argument("-f", "--force", help="rebuild even if database is up to date", action='store_true')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.refalleles):
+        sys.exit("No such file: {}".format(args.refalleles))
+
+    if args.action == "verify":
+        ok, msg = verify_ref_db(args.refalleles, args.dbdir)
+        print(msg)
+        sys.exit(0 if ok else 1)
+
+    if args.force:
+        lock = lock_ref_db(ref_db_paths(args.refalleles, args.dbdir)[0])
+        try:
+            dbprefix = build_ref_db(args.refalleles, args.dbdir)
+        finally:
+            unlock_ref_db(lock)
+    else:
+        dbprefix = get_ref_db(args.refalleles, args.dbdir)
+    print("Reference allele BLAST database: " + dbprefix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Content addressed cache of reads_to_alleles.py stage results.
+
+Each stage result (assembly, assembly QC verdict, alleles file) is stored under a key made from the
+sha256 of the stage's input files plus the parameters that change its output, so resubmitting the same
+reads or assembly (re-uploads, moved projects, cron_pipeline.py retries) restores the stored result
+instead of running the stage again. Entries are kept in <cachedir>/<stage>/<key>/ with a meta.json,
+the least recently used entries are removed when the cache grows over its size limit. The size is walked
+once per run and then kept as a running total of what the run stored, so only a put that takes the total
+over the limit walks the cache again (to evict).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+CACHE_VERSION = 2  # bump when stage outputs change so old entries are not reused
+
+_caches = {}
+_digests = {}
+
+
+def file_digest(path):
+    """
+    sha256 of file contents, remembered for the run by (path, size, mtime)
+
+    :param path: file path
+    :return: hex digest
+    """
+    stat = os.stat(path)
+    tag = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if tag not in _digests:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        _digests[tag] = sha.hexdigest()
+    return _digests[tag]
+
+
+def _dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class ResultCache(object):
+
+    def __init__(self, cachedir, max_bytes):
+        """
+        :param cachedir: cache folder
+        :param max_bytes: size limit, least recently used entries are evicted above it
+        """
+        self.cachedir = os.path.abspath(cachedir)
+        self.max_bytes = max_bytes
+        self.size = None  # running estimate of the cache size, the folder is only walked to start it and to evict
+        if not os.path.exists(self.cachedir):
+            os.makedirs(self.cachedir, exist_ok=True)
+
+    def key(self, stage, inputs, params):
+        """
+        :param stage: stage name (assembly, qc, alleles)
+        :param inputs: input file paths
+        :param params: dict of parameters that change the stage output
+        :return: hex key
+        """
+        sha = hashlib.sha256()
+        sha.update(json.dumps([CACHE_VERSION, stage, [file_digest(x) for x in inputs], params],
+                              sort_keys=True, default=str).encode())
+        return sha.hexdigest()
+
+    def _entry(self, stage, key):
+        return os.path.join(self.cachedir, stage, key)
+
+    def get(self, stage, key, outputs):
+        """
+        :param stage: stage name
+        :param key: key from key()
+        :param outputs: {stored file name: destination path} files to restore (missing ones are skipped)
+        :return: stored meta dict, None if not cached
+        """
+        entry = self._entry(stage, key)
+        metafile = os.path.join(entry, "meta.json")
+        if not os.path.exists(metafile):
+            return None
+        try:
+            meta = json.load(open(metafile))
+            for name, dest in outputs.items():
+                if name in meta["files"]:
+                    shutil.copy(os.path.join(entry, name), dest)
+        except (OSError, ValueError, KeyError):
+            return None  # evicted or half written while reading, treat as a miss
+        os.utime(metafile)  # last use time for LRU eviction
+        return meta
+
+    def put(self, stage, key, files, meta=None):
+        """
+        :param stage: stage name
+        :param key: key from key()
+        :param files: {stored file name: source path}
+        :param meta: json serialisable values to store with the files
+        """
+        entry = self._entry(stage, key)
+        tmp = "{}.tmp{}".format(entry, os.getpid())
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        added = 0
+        for name, src in files.items():
+            shutil.copy(src, os.path.join(tmp, name))
+            added += os.path.getsize(src)
+        meta = dict(meta or {})
+        meta["files"] = sorted(files.keys())
+        meta["created"] = time.time()
+        outf = open(os.path.join(tmp, "meta.json"), "w")
+        json.dump(meta, outf)
+        outf.close()
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # stored by another run at the same time
+            added = 0
+        if self.size is None:
+            self.size = _dir_size(self.cachedir)
+        else:
+            self.size += added
+        if self.size > self.max_bytes:
+            self.size = self.evict()
+
+    def remove(self, stage, key):
+        """
+        remove an entry (i.e. its outputs were changed after it was stored)
+
+        :param stage: stage name
+        :param key: key from key()
+        """
+        entry = self._entry(stage, key)
+        if os.path.exists(entry):
+            if self.size is not None:
+                self.size -= _dir_size(entry)
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def evict(self):
+        """
+        remove least recently used entries until the cache is under its size limit
+
+        :return: size of the cache left (bytes)
+        """
+        entries = []
+        for stage in os.listdir(self.cachedir):
+            stagedir = os.path.join(self.cachedir, stage)
+            if not os.path.isdir(stagedir):
+                continue
+            for key in os.listdir(stagedir):
+                entry = os.path.join(stagedir, key)
+                metafile = os.path.join(entry, "meta.json")
+                if not os.path.exists(metafile):
+                    continue
+                try:
+                    entries.append((os.path.getmtime(metafile), _dir_size(entry), entry))
+                except OSError:
+                    continue
+        total = sum(x[1] for x in entries)
+        for used, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        return total
+
+
+def get_result_cache(args):
+    """
+    :param args: reads_to_alleles.py arguments
+    :return: ResultCache for args.cachedir (default <outpath>/result_cache), None if caching is turned off with
+    --no-cache
+    """
+    if args.no_cache:
+        return None
+    cachedir = os.path.abspath(args.cachedir if args.cachedir else os.path.join(args.outpath, "result_cache"))
+    if cachedir not in _caches:
+        _caches[cachedir] = ResultCache(cachedir, int(float(args.cache_size) * 1024 ** 3))
+    return _caches[cachedir]
@@ -0,0 +1,59 @@
+"""
+SNP density masking shared by reads_to_alleles.py and MgtAllele2Db/Allele_to_mgt_db.py
+"""
+
+import numpy as np
+
+_N = ord("N")
+_GAP = ord("-")
+
+
+def mask_high_snp_regions(locus, recon_locus, ref_locus, window_size, snp_limit):
+    """
+    compare new allele seq to "ref" allele to identify and mask(with Ns) regions with high snp density
+    which can be caused by BLAST errors where indels are present in query seq
+
+    SNP counts for every window come from one cumulative sum over the per position mismatch array,
+    windows over the limit are then masked in one pass with a difference array
+
+    :param locus: Not currently used (useful for debug)
+    :param recon_locus: sequence to be checked
+    :param ref_locus: sequence of 'ref' locus
+    :param window_size: size of rolling window to check SNP frequency within
+    :param snp_limit: limit of number of SNPs within that window
+
+    :return: input sequence to be checked with regions with elevated SNP counts masked if necessary
+    """
+
+    if len(recon_locus) != len(ref_locus):  # comparison with reference will break if lengths not the same
+        return recon_locus
+
+    halfwindow = int(int(window_size) / 2)
+    winlen = 2 * halfwindow  # windows are positions x - halfwindow to x + halfwindow - 1
+
+    recon = np.frombuffer(str(recon_locus).encode("ascii"), dtype=np.uint8)
+    ref = np.frombuffer(str(ref_locus).encode("ascii"), dtype=np.uint8)
+
+    # SNP = mismatch not caused by an N or an indel in either sequence
+    snps = (recon != ref) & (recon != _N) & (recon != _GAP) & (ref != _N) & (ref != _GAP)
+
+    nwindows = len(ref) - winlen
+    if nwindows <= 0 or winlen == 0:
+        return str(recon_locus)
+
+    csum = np.zeros(len(ref) + 1, dtype=np.int64)
+    np.cumsum(snps, out=csum[1:])
+    window_counts = csum[winlen:winlen + nwindows] - csum[:nwindows]
+    starts = np.nonzero(window_counts > int(snp_limit))[0]
+
+    if len(starts) == 0:
+        return str(recon_locus)
+
+    cover = np.zeros(len(ref) + 1, dtype=np.int64)
+    np.add.at(cover, starts, 1)
+    np.add.at(cover, starts + winlen, -1)
+    masked = np.cumsum(cover[:-1]) > 0
+
+    outlocus = recon.copy()
+    outlocus[masked] = _N
+    return outlocus.tobytes().decode("ascii")
@@ -0,0 +1,171 @@
+"""
+Per stage timing and resource metrics for reads_to_alleles.py, written to <strain>_metrics.json
+
+Stages are marked with the @stage("name") decorator (or "with timed(name):") and record, summed over
+every call of the stage:
+    wall_s          wall clock time
+    cpu_s           cpu time of the thread running the stage (python work)
+    child_cpu_s     cpu time of the external commands the stage ran (kraken, shovill, blastn ...)
+    peak_rss_kb     peak RSS of this process when the stage finished (ru_maxrss is a high water mark)
+    peak_child_rss_kb  peak RSS of the external commands the stage ran
+    counts          anything counted with count() while the stage ran (loci, hsps, exact hits ...)
+
+count() outside of a stage adds to the run level counts. Commands run through stage_runner.run_cmd
+report their own resource use, so stages running at the same time in threads (kraken and shovill)
+are not charged for each other's commands.
+"""
+
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+_lock = threading.Lock()
+_stages = {}
+_counts = {}
+
+
+def reset():
+    """
+    clear collected metrics (i.e. between genomes)
+    """
+    with _lock:
+        _stages.clear()
+        _counts.clear()
+
+
+def _current():
+    stack = getattr(_local, "stack", None)
+    if stack:
+        return stack[-1]
+    return None
+
+
+def count(key, n=1):
+    """
+    add n to counter key of the running stage (or of the run if no stage is running)
+    """
+    entry = _current()
+    with _lock:
+        counts = entry["counts"] if entry is not None else _counts
+        counts[key] = counts.get(key, 0) + n
+
+
+def add_command_usage(usage):
+    """
+    charge the resource use of a finished external command (rusage from os.wait4) to the running stage
+    """
+    entry = _current()
+    if entry is None:
+        return
+    entry["commands"] += 1
+    entry["child_cpu_s"] += usage.ru_utime + usage.ru_stime
+    entry["peak_child_rss_kb"] = max(entry["peak_child_rss_kb"], usage.ru_maxrss)
+
+
+@contextmanager
+def timed(name):
+    """
+    record metrics of the code run inside the with block as stage name
+    """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    entry = {"commands": 0, "child_cpu_s": 0.0, "peak_child_rss_kb": 0, "counts": {}}
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    _local.stack.append(entry)
+    wall = time.time()
+    cpu = time.thread_time()
+    try:
+        yield entry
+    finally:
+        wall = time.time() - wall
+        cpu = time.thread_time() - cpu
+        _local.stack.pop()
+        if entry["commands"] == 0:
+            # commands not started through run_cmd (i.e. blastn from Biopython) are only seen once reaped
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            entry["child_cpu_s"] = (after.ru_utime + after.ru_stime) - (children.ru_utime + children.ru_stime)
+            if after.ru_maxrss > children.ru_maxrss:
+                entry["peak_child_rss_kb"] = after.ru_maxrss
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        with _lock:
+            if name not in _stages:
+                _stages[name] = {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "child_cpu_s": 0.0,
+                                 "peak_rss_kb": 0, "peak_child_rss_kb": 0, "counts": {}}
+            stage_metrics = _stages[name]
+            stage_metrics["calls"] += 1
+            stage_metrics["wall_s"] += wall
+            stage_metrics["cpu_s"] += cpu
+            stage_metrics["child_cpu_s"] += entry["child_cpu_s"]
+            stage_metrics["peak_rss_kb"] = max(stage_metrics["peak_rss_kb"], peak)
+            stage_metrics["peak_child_rss_kb"] = max(stage_metrics["peak_child_rss_kb"], entry["peak_child_rss_kb"])
+            for key, n in entry["counts"].items():
+                stage_metrics["counts"][key] = stage_metrics["counts"].get(key, 0) + n
+
+
+def stage(name):
+    """
+    decorator recording every call of the function as stage name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report():
+    """
+    :return: {"stages": {name: metrics}, "counts": {key: n}} with times rounded to ms
+    """
+    with _lock:
+        stages = {}
+        for name, metrics in _stages.items():
+            metrics = dict(metrics, counts=dict(metrics["counts"]))
+            for key in ("wall_s", "cpu_s", "child_cpu_s"):
+                metrics[key] = round(metrics[key], 3)
+            stages[name] = metrics
+        return {"stages": stages, "counts": dict(_counts)}
+
+
+def write_metrics(outpath, strain, **extra):
+    """
+    :param outpath: json file to write (<strain>_metrics.json next to <strain>_alleles.fasta)
+    :param strain: strain name
+    :param extra: other top level values to include (i.e. total time)
+    """
+    out = {"strain": strain}
+    out.update(extra)
+    out.update(report())
+    outf = open(outpath, "w")
+    json.dump(out, outf, indent=2)
+    outf.write("\n")
+    outf.close()
+
+
+def update_metrics(outpath, strain, **extra):
+    """
+    set top level values of an existing metrics file (i.e. a later recall of the alleles file), keeping the rest
+
+    :param outpath: <strain>_metrics.json path (written if missing)
+    :param strain: strain name
+    :param extra: top level values to set
+    """
+    out = {"strain": strain}
+    if os.path.exists(outpath):
+        try:
+            out = json.load(open(outpath))
+        except ValueError:
+            pass
+    out.update(extra)
+    outf = open(outpath, "w")
+    json.dump(out, outf, indent=2)
+    outf.write("\n")
+    outf.close()
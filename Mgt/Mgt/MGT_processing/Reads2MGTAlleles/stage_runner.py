@@ -0,0 +1,215 @@
+"""
+Small DAG runner for the external tool steps of reads_to_alleles.py (kraken, shovill, assembly stats, mlst).
+
+Steps whose dependencies are done are started together in threads (the work itself is in the external
+tools), so e.g. kraken screening runs while shovill assembles. The first step to fail (sys.exit or an
+exception) stops the run: processes started by the other running steps through run_cmd are killed and
+the failure is re-raised in the calling thread, so the pipeline exits with the same message as before.
+
+Each step records wall clock time and peak RSS (max over the commands it ran, including their child
+processes, or of this python process for steps that run no commands).
+"""
+
+import os
+import queue
+import resource
+import signal
+import subprocess
+import threading
+import time
+
+import stage_metrics
+
+_local = threading.local()
+
+
+class StepRecord(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.status = "pending"
+        self.start = None
+        self.wall = 0.0
+        self.peak_rss_kb = 0
+        self.commands = 0
+        self.error = ""
+
+    def as_dict(self):
+        return {"step": self.name, "status": self.status, "wall_s": round(self.wall, 3),
+                "peak_rss_kb": self.peak_rss_kb, "error": self.error}
+
+
+def run_cmd(cmd, capture=False):
+    """
+    run shell command in its own process group so a failing step run can kill it (and its children)
+
+    :param cmd: shell command
+    :param capture: return stdout
+    :return: (returncode, stdout bytes if capture else None)
+    """
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE if capture else None, start_new_session=True)
+    runner = getattr(_local, "runner", None)
+    if runner is not None:
+        runner._register(proc)
+
+    out = None
+    if capture:
+        out = proc.stdout.read()
+        proc.stdout.close()
+    # wait4 gives resource use of this command (and the processes it waited for) only
+    pid, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+
+    if runner is not None:
+        runner._unregister(proc)
+    stage_metrics.add_command_usage(usage)
+    record = getattr(_local, "record", None)
+    if record is not None:
+        record.commands += 1
+        record.peak_rss_kb = max(record.peak_rss_kb, usage.ru_maxrss)
+    return proc.returncode, out
+
+
+class StepRunner(object):
+
+    def __init__(self, concurrent=True):
+        """
+        :param concurrent: start independent steps together (False = run steps one at a time in the order added)
+        """
+        self.concurrent = concurrent
+        self.steps = {}
+        self.order = []
+        self.records = []
+        self.results = {}
+        self._procs = set()
+        self._lock = threading.Lock()
+
+    def add(self, name, func, *args, deps=()):
+        """
+        :param name: step name
+        :param func: function to run
+        :param args: positional arguments for func
+        :param deps: names of steps (already added) that must finish first
+        """
+        for dep in deps:
+            if dep not in self.steps:
+                raise ValueError("step {} depends on unknown step {}".format(name, dep))
+        self.steps[name] = (func, args, tuple(deps))
+        self.order.append(name)
+        self.records.append(StepRecord(name))
+
+    ######## process tracking ########
+
+    def _register(self, proc):
+        with self._lock:
+            self._procs.add(proc)
+
+    def _unregister(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def _kill_running(self):
+        with self._lock:
+            procs = list(self._procs)
+        for proc in procs:
+            try:
+                os.killpg(proc.pid, signal.SIGTERM)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+    ######## running ########
+
+    def _run_step(self, name, record, done):
+        func, args, deps = self.steps[name]
+        _local.runner = self
+        _local.record = record
+        record.status = "running"
+        record.start = time.time()
+        try:
+            self.results[name] = func(*args)
+            record.status = "done" if self._failure is None else "cancelled"
+        except BaseException as e:  # sys.exit in a step is a failure of the run
+            with self._lock:
+                first = self._failure is None
+                if first:
+                    self._failure = e
+            if first:
+                record.status = "failed"
+                record.error = str(e)
+            else:
+                record.status = "cancelled"  # killed because another step failed
+        finally:
+            record.wall = time.time() - record.start
+            if record.commands == 0:
+                record.peak_rss_kb = max(record.peak_rss_kb, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+            _local.runner = None
+            _local.record = None
+            done.put(name)
+
+    def run(self):
+        """
+        :return: {step name: return value of step function}
+        """
+        self._failure = None
+        records = {x.name: x for x in self.records}
+
+        if not self.concurrent:
+            for name in self.order:
+                self._run_step(name, records[name], queue.Queue())
+                if self._failure is not None:
+                    self._cancel_pending(records)
+                    raise self._failure
+            return self.results
+
+        done = queue.Queue()
+        finished = set()
+        running = {}
+        while len(finished) < len(self.order):
+            if self._failure is None:
+                for name in self.order:
+                    if name in running or name in finished:
+                        continue
+                    if all(dep in finished for dep in self.steps[name][2]):
+                        thread = threading.Thread(target=self._run_step, args=(name, records[name], done), daemon=True)
+                        running[name] = thread
+                        thread.start()
+            if not running:
+                break
+            name = done.get()
+            running.pop(name).join()
+            finished.add(name)
+            if self._failure is not None:
+                # fail early, stop anything still running and don't start the rest
+                self._kill_running()
+                for other in list(running):
+                    done.get()
+                for other in list(running):
+                    running.pop(other).join()
+                break
+
+        if self._failure is not None:
+            self._cancel_pending(records)
+            raise self._failure
+        return self.results
+
+    def _cancel_pending(self, records):
+        for record in records.values():
+            if record.status == "pending":
+                record.status = "cancelled"
+
+    ######## reporting ########
+
+    def report(self, outfile=None):
+        """
+        print per step wall time and peak RSS, optionally appending them to a tab separated file
+        """
+        lines = ["{}\t{}\t{:.2f}\t{}".format(x.name, x.status, x.wall, x.peak_rss_kb) for x in self.records]
+        for line in lines:
+            print("step: " + line)
+        if outfile:
+            new = not os.path.exists(outfile)
+            outf = open(outfile, "a")
+            if new:
+                outf.write("step\tstatus\twall_s\tpeak_rss_kb\n")
+            outf.write("\n".join(lines) + "\n")
+            outf.close()
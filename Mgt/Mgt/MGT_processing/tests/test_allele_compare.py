@@ -0,0 +1,94 @@
+import random
+import sys
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.MgtAllele2Db.allele_compare import get_muts_per_locus, ref_snps
+
+
+def loop_muts_per_locus(newnegs, alleles, newseq, muts, matchallelelist):
+    """
+    per character comparison get_muts_per_locus replaced
+    """
+    match = False
+    for existlocus in alleles:
+        oldseq = str(alleles[existlocus])
+        if len(newseq) == len(oldseq):
+            anymut = 'no'
+            for pos in range(len(newseq)):
+                if newseq[pos] != oldseq[pos] and newseq[pos] not in ["N", "-"] and oldseq[pos] not in [
+                    "N", "-"]:
+                    anymut = 'yes'
+            if anymut == 'no':
+                if "-" not in existlocus:
+                    matchallelelist.append(existlocus)
+                allele = existlocus.split("_")[0].strip("-")
+                newnegs.append(("", allele, newseq, muts))
+                match = True
+    return newnegs, muts, matchallelelist, match
+
+
+def loop_ref_snps(newseq, oldseq):
+    """
+    per character SNP calls against allele 1 that ref_snps replaced
+    """
+    muts = []
+    for pos in range(len(oldseq)):
+        if newseq[pos] != oldseq[pos] and newseq[pos] not in ["N", "-"] and oldseq[pos] not in ["N", "-"]:
+            muts.append((oldseq[pos], str(pos), newseq[pos]))
+    return muts
+
+
+def mutate(rand, seq, changes, bases="ACGT"):
+    seq = list(seq)
+    for pos in rand.sample(range(len(seq)), changes):
+        seq[pos] = rand.choice(bases)
+    return "".join(seq)
+
+
+class TestAlleleCompare(unittest.TestCase):
+
+    def setUp(self):
+        self.rand = random.Random(7)
+
+    def random_locus(self):
+        ref = "".join(self.rand.choice("ACGT") for _ in range(60))
+        alleles = {"1": ref}
+        for i in range(2, 12):
+            alleles[str(i)] = mutate(self.rand, ref, self.rand.randint(0, 2))
+            if self.rand.random() < 0.5:
+                alleles["-{}_1".format(i)] = mutate(self.rand, alleles[str(i)], 3, "N-")
+        alleles["12"] = ref + "ACG"
+        return alleles
+
+    def test_muts_per_locus_matches_loop(self):
+        matched = 0
+        for _ in range(300):
+            alleles = self.random_locus()
+            newseq = mutate(self.rand, self.rand.choice(list(alleles.values())), self.rand.randint(0, 3), "ACGTN-")
+            expected = loop_muts_per_locus([], alleles, newseq, [], [])
+            self.assertEqual(get_muts_per_locus([], alleles, newseq, [], []), expected)
+            matched += expected[3]
+        self.assertTrue(0 < matched < 300)
+
+    def test_no_same_length(self):
+        self.assertEqual(get_muts_per_locus([], {"1": "ACGT"}, "ACG", [], []), ([], [], [], False))
+
+    def test_ref_snps_matches_loop(self):
+        for _ in range(300):
+            ref = "".join(self.rand.choice("ACGTN-") for _ in range(50))
+            newseq = mutate(self.rand, ref, self.rand.randint(0, 5), "ACGTN-") + "A" * self.rand.randint(0, 3)
+            self.assertEqual(ref_snps(newseq, ref), loop_ref_snps(newseq, ref))
+
+    def test_ref_snps_shorter_than_ref(self):
+        # the per character loop failed on a new allele shorter than allele 1, as does ref_snps
+        with self.assertRaises(IndexError):
+            loop_ref_snps("ACG", "ACGT")
+        with self.assertRaises(IndexError):
+            ref_snps("ACG", "ACGT")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.MgtAllele2Db.allele_store import AlleleStore, store_path
+
+
+class TestAlleleStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fasta = path.join(self.dir, "STM0001.fasta")
+        with open(self.fasta, "w") as outf:
+            outf.write(">STM0001:1\nACGTACGT\n>STM0001:2\nACGTACGA\n>STM0001:-2_1\nACGTNCGA\n>STM0001:3\nACGTAC\nGTTT\n")
+        self.store = AlleleStore(store_path(self.dir, "X"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def append(self, text):
+        with open(self.fasta, "a") as outf:
+            outf.write(text)
+
+    def test_exact_lookup(self):
+        self.assertEqual(self.store.sync_locus("STM0001", self.fasta), 4)
+        self.assertEqual(self.store.find("STM0001", "ACGTACGA"), "2")
+        self.assertEqual(self.store.find("STM0001", "ACGTACGTTT"), "3")
+        self.assertIsNone(self.store.find("STM0001", "ACGTNCGA"))
+        self.assertEqual(self.store.find("STM0001", "ACGTNCGA", negative=True), "-2_1")
+        self.assertIsNone(self.store.find("STM0001", "TTTTTTTT"))
+        self.assertEqual(self.store.positive_ids("STM0001"), {"1", "2", "3"})
+
+    def test_length_bucket(self):
+        self.store.sync_locus("STM0001", self.fasta)
+        pos, neg = self.store.length_bucket("STM0001", 8)
+        self.assertEqual(pos, {"1": "ACGTACGT", "2": "ACGTACGA"})
+        self.assertEqual(neg, {"-2_1": "ACGTNCGA"})
+        pos, neg = self.store.length_bucket("STM0001", 10)
+        self.assertEqual(pos, {"3": "ACGTACGTTT", "1": "ACGTACGT"})  # allele 1 always included
+        self.assertEqual(neg, {})
+
+    def test_appended_alleles_only_are_read(self):
+        self.store.sync_locus("STM0001", self.fasta)
+        self.assertEqual(self.store.sync_locus("STM0001", self.fasta), 0)
+        self.append(">STM0001:4\nTCGTACGT\n")
+        self.assertEqual(self.store.sync_locus("STM0001", self.fasta), 1)
+        self.assertEqual(self.store.find("STM0001", "TCGTACGT"), "4")
+
+        # record still being written is left for the next sync
+        self.append(">STM0001:5\nTTGT")
+        self.assertEqual(self.store.sync_locus("STM0001", self.fasta), 0)
+        self.append("ACGT\n")
+        self.assertEqual(self.store.sync_locus("STM0001", self.fasta), 1)
+        self.assertEqual(self.store.find("STM0001", "TTGTACGT"), "5")
+
+    def test_rewritten_file_is_read_again(self):
+        self.store.sync_locus("STM0001", self.fasta)
+        with open(self.fasta, "w") as outf:
+            outf.write(">STM0001:1\nGGGTACGT\n>STM0001:2\nACGTACGA\n>STM0001:-2_1\nACGTNCGA\n>STM0001:3\nACGTACGTTT\n>STM0001:4\nA\n")
+        self.assertEqual(self.store.sync_locus("STM0001", self.fasta), 5)
+        self.assertIsNone(self.store.find("STM0001", "ACGTACGT"))
+        self.assertEqual(self.store.find("STM0001", "GGGTACGT"), "1")
+
+    def test_store_shared_between_connections(self):
+        self.store.sync_locus("STM0001", self.fasta)
+        other = AlleleStore(store_path(self.dir, "X"))
+        self.assertEqual(other.sync_locus("STM0001", self.fasta), 0)
+        self.assertEqual(other.find("STM0001", "ACGTACGA"), "2")
+        other.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.MgtAllele2Db.ap_matrix import ApMatrix, encode_allele
+
+
+class TestApMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(1)
+        self.cachedir = tempfile.mkdtemp()
+        self.tables = {0: ["L%d" % i for i in range(6)], 1: ["L%d" % i for i in range(6, 10)]}
+        self.loci = self.tables[0] + self.tables[1]
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute('CREATE TABLE "X_ap3_0" ("id" INTEGER PRIMARY KEY, "st" INTEGER, {})'.format(
+            ",".join('"{}" TEXT'.format(x) for x in self.tables[0])))
+        self.conn.execute('CREATE TABLE "X_ap3_1" ("id" INTEGER PRIMARY KEY, "main_id" INTEGER, {})'.format(
+            ",".join('"{}" TEXT'.format(x) for x in self.tables[1])))
+        self.profiles = {}
+        self.add(1, 200)
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def add(self, first, last):
+        for apid in range(first, last + 1):
+            profile = [self.rng.choice(["1", "2", "3", "0", "-2_1"]) for _ in self.loci]
+            self.profiles[str(apid)] = profile
+            self.conn.execute('INSERT INTO "X_ap3_0" VALUES (?, ?, {})'.format(",".join("?" * 6)),
+                              [apid, apid] + profile[:6])
+            self.conn.execute('INSERT INTO "X_ap3_1" VALUES (?, ?, {})'.format(",".join("?" * 4)),
+                              [apid, apid] + profile[6:])
+
+    def expected(self, query, allowdiff):
+        out = {}
+        for apid, profile in self.profiles.items():
+            miss = [(query[x], encode_allele(y)) for x, y in zip(self.loci, profile)
+                    if query[x] != encode_allele(y) and query[x] != 0 and encode_allele(y) != 0]
+            zeros = sum(1 for x, y in zip(self.loci, profile) if query[x] == 0 or encode_allele(y) == 0)
+            if len(miss) <= allowdiff:
+                out[apid] = (sorted((str(a), str(b)) for a, b in miss), zeros)
+        return out
+
+    def matches(self, matrix, query, allowdiff):
+        miss, zeros = matrix.mismatches(query, self.loci, allowdiff, first_chunks=(2, 2), chunk=3)
+        return {x: (sorted(miss[x]), zeros[x]) for x in miss}
+
+    def test_encode_allele(self):
+        self.assertEqual([encode_allele(x) for x in ["5", "-3_2", "0", "", None]], [5, 3, 0, 0, 0])
+
+    def test_matches_python_comparison(self):
+        matrix = ApMatrix(self.cachedir, "X", 3, self.tables)
+        self.assertEqual(matrix.sync(self.conn), 200)
+        for _ in range(5):
+            query = {x: self.rng.choice([0, 1, 2, 3]) for x in self.loci}
+            for allowdiff in (1, 4):
+                self.assertEqual(self.matches(matrix, query, allowdiff), self.expected(query, allowdiff))
+
+    def test_incremental_extension(self):
+        ApMatrix(self.cachedir, "X", 3, self.tables).sync(self.conn)
+        self.add(201, 2000)
+        matrix = ApMatrix(self.cachedir, "X", 3, self.tables)
+        self.assertEqual(matrix.sync(self.conn), 1800)
+        self.assertEqual(matrix.rows, 2000)
+        self.assertEqual(matrix.sync(self.conn), 0)
+        query = {x: 2 for x in self.loci}
+        self.assertEqual(self.matches(matrix, query, 3), self.expected(query, 3))
+
+    def test_incomplete_profile_skipped(self):
+        # profile 204 was written to table 0 only (i.e. a run failed part way through addApForScheme)
+        self.add(201, 209)
+        self.conn.execute('DELETE FROM "X_ap3_1" WHERE "main_id" = 204')
+        orphan = self.profiles.pop("204")
+        matrix = ApMatrix(self.cachedir, "X", 3, self.tables)
+        self.assertEqual(matrix.sync(self.conn), 208)
+        self.assertEqual(matrix.rows, 208)
+        query = {x: encode_allele(y) for x, y in zip(self.loci, self.profiles["207"])}
+        self.assertIn("207", self.matches(matrix, query, 0))
+        self.assertEqual(self.matches(matrix, query, 2), self.expected(query, 2))
+
+        self.add(210, 212)
+        matrix = ApMatrix(self.cachedir, "X", 3, self.tables)
+        self.assertEqual(matrix.sync(self.conn), 3)
+        self.assertEqual(matrix.rows, 211)
+
+        # once the profile is complete it is added on the next sync
+        self.conn.execute('INSERT INTO "X_ap3_1" VALUES (?, ?, {})'.format(",".join("?" * 4)), [204, 204] + orphan[6:])
+        self.profiles["204"] = orphan
+        matrix = ApMatrix(self.cachedir, "X", 3, self.tables)
+        self.assertEqual(matrix.sync(self.conn), 1)
+        self.assertEqual(matrix.sync(self.conn), 0)
+        self.assertEqual(matrix.rows, 212)
+        query = {x: encode_allele(y) for x, y in zip(self.loci, orphan)}
+        self.assertEqual(self.matches(matrix, query, 2), self.expected(query, 2))
+
+    def test_rebuild_after_delete(self):
+        ApMatrix(self.cachedir, "X", 3, self.tables).sync(self.conn)
+        self.conn.execute('DELETE FROM "X_ap3_0" WHERE "id" = 5')
+        self.conn.execute('DELETE FROM "X_ap3_1" WHERE "main_id" = 5')
+        del self.profiles["5"]
+        matrix = ApMatrix(self.cachedir, "X", 3, self.tables)
+        self.assertEqual(matrix.sync(self.conn), 199)
+        query = {x: 1 for x in self.loci}
+        self.assertEqual(self.matches(matrix, query, 4), self.expected(query, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.Reads2MGTAlleles.assembly_stats import AssemblyStats
+from MGT_processing.Reads2MGTAlleles.contig_store import ContigStore
+
+
+class TestAssemblyStats(unittest.TestCase):
+
+    def setUp(self):
+        self.contigs = [("c1", "ACGT" * 250), ("c2", "GGCC" * 100 + "NNNN" + "ATAT" * 99), ("c3", "A" * 60 + "N" * 40)]
+        f = tempfile.NamedTemporaryFile("w", suffix=".fasta", delete=False)
+        for name, seq in self.contigs:
+            f.write(">{} extra words\n".format(name))
+            for i in range(0, len(seq), 60):
+                f.write(seq[i:i + 60] + "\n")
+        f.close()
+        self.fasta = f.name
+
+    def tearDown(self):
+        os.remove(self.fasta)
+
+    def test_basic_stats(self):
+        stats = AssemblyStats.from_fasta(self.fasta)
+        self.assertEqual(stats.n, 3)
+        self.assertEqual(stats.sum, 1000 + 800 + 100)
+        self.assertEqual(stats.largest, 1000)
+        self.assertEqual(stats.shortest, 100)
+        self.assertEqual(stats.n50, 1000)
+        self.assertEqual(stats.l50, 1)
+        self.assertEqual(stats.nx(90), (800, 2))
+        self.assertEqual(stats.n_count, 44)
+        self.assertEqual(stats.gaps, 2)  # run of 40 Ns spans a line break but is one gap
+
+    def test_gc(self):
+        stats = AssemblyStats.from_fasta(self.fasta)
+        self.assertAlmostEqual(stats.gc, (500 + 400) / float(1900 - 44))
+
+    def test_store_matches_fasta(self):
+        from_fasta = AssemblyStats.from_fasta(self.fasta)
+        from_store = AssemblyStats.from_store(ContigStore.from_fasta(self.fasta))
+        self.assertEqual(from_fasta.to_text(), from_store.to_text())
+        self.assertEqual(from_fasta.gc_count, from_store.gc_count)
+
+    def test_text_layout(self):
+        lines = AssemblyStats.from_fasta(self.fasta).to_text().split("\n")
+        self.assertEqual(lines[1], "sum = 1900, n = 3, ave = 633.33, largest = 1000")
+        self.assertEqual(lines[2], "N50 = 1000, n = 1")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.Reads2MGTAlleles.call_record import calls_record_path, load_call_record, recall_record, \
+    write_call_record
+
+
+class TestCallRecord(unittest.TestCase):
+
+    def setUp(self):
+        self.seqs = {"L1": {"L1:1": "AAAAAAAA"}, "L2": {"L2:1": "CCCCCCCC"}, "L3": {"L3:1": "GGGGGGGG"},
+                     "L5": {"L5:1": "ACACACAC"}, "L6": {"L6:1": "TGTGTGTG"}}
+        self.dir = tempfile.mkdtemp()
+        self.path = calls_record_path(path.join(self.dir, "S1_alleles.fasta"))
+        write_call_record(self.path, "S1", self.seqs, ["L1", "L2", "L3", "L5", "L6"], "7", "citri", {"L1": "1"},
+                          {"L2": "CCCCCCCT", "L3": "GGGNGGGG"}, {"L5": "incomplete"}, ["L6"], "abc")
+
+    def tearDown(self):
+        os.remove(self.path)
+        os.rmdir(self.dir)
+
+    def test_round_trip(self):
+        record = load_call_record(self.path)
+        self.assertEqual(self.path, path.join(self.dir, "S1_calls.json.gz"))
+        self.assertEqual(record["ref"], {"L1": "1"})
+        self.assertEqual(record["new"]["L2"], "CCCCCCCT")
+        self.assertEqual(record["uncallable"], {"L5": "incomplete"})
+        self.assertEqual(record["no_hits"], ["L6"])
+        self.assertEqual(record["alleles_cache_key"], "abc")
+
+    def test_unchanged_reference(self):
+        self.assertEqual(recall_record(load_call_record(self.path), self.seqs), ([], [], []))
+
+    def test_promote_new_allele(self):
+        self.seqs["L2"]["L2:2"] = "CCCCCCCT"
+        self.seqs["L3"]["L3:2"] = "GGGAGGGG"
+        record = load_call_record(self.path)
+        changed, promoted, rerun = recall_record(record, self.seqs)
+        self.assertEqual((changed, promoted, rerun), (["L2", "L3"], ["L2"], []))
+        self.assertEqual(record["ref"]["L2"], "2")
+        self.assertNotIn("L2", record["new"])
+        self.assertIn("L3", record["new"])  # partial calls are left as new
+        self.assertEqual(record["allele_counts"]["L2"], 2)
+
+    def test_changed_uncallable_needs_rerun(self):
+        self.seqs["L5"]["L5:2"] = "ACACACAA"
+        self.seqs["L6"]["L6:2"] = "TGTGTGTT"
+        self.seqs["L1"]["L1:2"] = "AAAAAAAT"
+        changed, promoted, rerun = recall_record(load_call_record(self.path), self.seqs)
+        self.assertEqual((changed, promoted, rerun), (["L1", "L5", "L6"], [], ["L5", "L6"]))
+
+    def test_added_locus_needs_rerun(self):
+        self.seqs["L4"] = {"L4:1": "TTTTTTTT"}
+        self.assertEqual(recall_record(load_call_record(self.path), self.seqs)[2], ["L4"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import random
+import sqlite3
+import sys
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.MgtAllele2Db import cc_merges
+from MGT_processing.MgtAllele2Db.cc_merges import UnionFind, load_merges, backfill_canonical, canonical_ready, \
+    merged_ids, merge_dict, add_cc, record_merge
+
+
+class TestCcMerges(unittest.TestCase):
+
+    def setUp(self):
+        cc_merges._canonical_tables.clear()
+        self.conn = sqlite3.connect(":memory:", isolation_level=None)
+        self.cur = self.conn.cursor()
+        self.cur.execute('CREATE TABLE "X_cc1_2" ("identifier" INTEGER PRIMARY KEY, "merge_id_id" INTEGER NULL)')
+        # 3 -> 5 -> 2, 7 -> 5, 6 -> 4, 1 and 8 unmerged
+        for cc, mergecc in [(1, None), (2, None), (3, 5), (4, None), (5, 2), (6, 4), (7, 5), (8, None)]:
+            self.cur.execute('INSERT INTO "X_cc1_2" VALUES (?, ?)', (cc, mergecc))
+
+    def test_union_find(self):
+        uf = UnionFind()
+        self.assertEqual(uf.union(5, 3), 3)
+        self.assertEqual(uf.union(9, 7), 7)
+        self.assertEqual(uf.union(9, 5), 3)
+        self.assertEqual(uf.find(7), 3)
+        self.assertEqual(uf.find(11), 11)
+        self.assertEqual(sorted(uf.groups()[3]), [3, 5, 7, 9])
+
+    def test_merge_dict_without_column(self):
+        self.assertFalse(canonical_ready(self.cur, "X_cc1_2"))
+        self.assertEqual(merge_dict(self.cur, "X_cc1_2"), {2: 2, 3: 2, 5: 2, 7: 2, 4: 4, 6: 4})
+
+    def test_backfill(self):
+        self.assertEqual(backfill_canonical(self.cur, "X_cc1_2"), (8, 2))
+        self.assertTrue(canonical_ready(self.cur, "X_cc1_2"))
+        self.assertEqual(sorted(merged_ids(self.cur, "X_cc1_2", ["7"]), key=int), ["2", "3", "5", "7"])
+        self.assertEqual(sorted(merged_ids(self.cur, "X_cc1_2", ["6", "8", "99"]), key=int), ["4", "6", "8"])
+        self.assertEqual(merge_dict(self.cur, "X_cc1_2"), {2: 2, 3: 2, 5: 2, 7: 2, 4: 4, 6: 4})
+
+    def test_maintained_groups_match_union_find(self):
+        backfill_canonical(self.cur, "X_cc1_2")
+        pairs = self.cur.execute('SELECT "identifier", "merge_id_id" FROM "X_cc1_2"').fetchall()
+        rand = random.Random(3)
+        for cc in range(9, 60):
+            self.cur.execute('INSERT INTO "X_cc1_2" ("identifier") VALUES (?)', (cc,))
+            add_cc(self.cur, "X_cc1_2", cc)
+            pairs.append((cc, None))
+        for i in range(40):
+            cc, mergecc = rand.sample(range(1, 60), 2)
+            record_merge(self.cur, "X_cc1_2", cc, mergecc)
+            pairs.append((cc, mergecc))
+
+        uf = load_merges(pairs)
+        self.assertTrue(canonical_ready(self.cur, "X_cc1_2"))
+        for cc, canonical in self.cur.execute('SELECT "identifier", "canonical_id" FROM "X_cc1_2"').fetchall():
+            self.assertEqual(canonical, uf.find(cc))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.Reads2MGTAlleles.contig_store import ContigStore, _index_fasta
+
+
+class TestContigStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, text):
+        fasta = path.join(self.dir, "genome.fa")
+        with open(fasta, "w") as outf:
+            outf.write(text)
+        return fasta
+
+    def test_mmap_matches_memory(self):
+        fasta = self.write(">c1 desc\nACGTA\nCGTAC\nGT\n\n>c2\nTTTTG\nCA\n")
+        mem = ContigStore.from_fasta(fasta)
+        mapped = ContigStore.from_fasta(fasta, use_mmap=True)
+        self.assertIsNotNone(mapped._index)
+        for contig in mem:
+            self.assertEqual(mapped[contig], mem[contig])
+            self.assertEqual(mapped.slice(contig, 3, 9), mem.slice(contig, 3, 9))
+            self.assertEqual(mapped.revcomp(contig, 1, 6), mem.revcomp(contig, 1, 6))
+
+    def test_blank_line_inside_contig(self):
+        fasta = self.write(">c1\nACGTA\n\nCGTAC\n>c2\nTTTTG\n")
+        with self.assertRaises(ValueError):
+            _index_fasta(fasta)
+        mapped = ContigStore.from_fasta(fasta, use_mmap=True)
+        self.assertIsNone(mapped._index)
+        self.assertEqual(mapped.slice("c1", 3, 7), "TACG")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import sqlite3
+import sys
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.MgtAllele2Db import counters
+from MGT_processing.MgtAllele2Db.counters import allele_counters, next_allele, next_neg_allele, next_st, next_dst, \
+    locus_allele_counters, note_pos_allele, pos_allele_counter
+
+
+class TestCounters(unittest.TestCase):
+
+    def setUp(self):
+        counters._counter_tables.clear()
+        self.conn = sqlite3.connect(":memory:", isolation_level=None)
+        self.conn.execute('CREATE TABLE "X_allele" ("id" INTEGER PRIMARY KEY, "identifier" TEXT, "locus_id" TEXT)')
+        for allele in ["1", "2", "-2_1", "-2_3", "5", "-7_1"]:
+            self.conn.execute('INSERT INTO "X_allele" ("identifier", "locus_id") VALUES (?, ?)', (allele, "STM0001"))
+        self.conn.execute('CREATE TABLE "X_ap2_0" ("id" INTEGER PRIMARY KEY, "st" INTEGER, "dst" INTEGER)')
+        for st, dst in [(1, 0), (2, 0), (2, 1), (2, 2), (4, 1)]:
+            self.conn.execute('INSERT INTO "X_ap2_0" ("st", "dst") VALUES (?, ?)', (st, dst))
+
+    def test_allele_counters(self):
+        nextpos, nextneg = allele_counters(["1", "2", "-2_1", "-2_3", "5", "-7_1", ""])
+        self.assertEqual(nextpos, 8)
+        self.assertEqual(nextneg, {"1": 1, "2": 4, "5": 1, "7": 2})
+        self.assertEqual(allele_counters([]), (1, {}))
+        self.assertEqual(pos_allele_counter(["1", "2", "-2_1", "5", "-7_1", ""]), 6)
+        self.assertEqual(pos_allele_counter(["-2_1"]), 1)
+
+    def test_alleles_seeded_then_claimed(self):
+        self.assertEqual(next_allele(self.conn, "X", "STM0001", claim=False), 8)
+        self.assertEqual(next_allele(self.conn, "X", "STM0001"), 8)
+        self.assertEqual(next_allele(self.conn, "X", "STM0001"), 9)
+        self.assertEqual(next_allele(self.conn, "X", "STM0001", claim=False), 10)
+        self.assertEqual(next_allele(self.conn, "X", "STM0002"), 1)
+
+        self.assertEqual(next_neg_allele(self.conn, "X", "STM0001", "2"), 4)
+        self.assertEqual(next_neg_allele(self.conn, "X", "STM0001", "2"), 5)
+        self.assertEqual(next_neg_allele(self.conn, "X", "STM0001", "5"), 1)
+        self.assertEqual(next_neg_allele(self.conn, "X", "STM0001", "9"), 1)
+
+    def test_counters_not_reseeded(self):
+        next_allele(self.conn, "X", "STM0001")
+        self.conn.execute('INSERT INTO "X_allele" ("identifier", "locus_id") VALUES (?, ?)', ("20", "STM0001"))
+        self.assertEqual(next_allele(self.conn, "X", "STM0001"), 9)
+
+    def test_taken_number_reseeded(self):
+        self.assertEqual(next_allele(self.conn, "X", "STM0001"), 8)
+        for allele in ["9", "-10_1"]:
+            self.conn.execute('INSERT INTO "X_allele" ("identifier", "locus_id") VALUES (?, ?)', (allele, "STM0001"))
+        self.assertEqual(next_allele(self.conn, "X", "STM0001"), 11)
+        self.assertEqual(next_allele(self.conn, "X", "STM0001"), 12)
+
+        self.assertEqual(next_neg_allele(self.conn, "X", "STM0001", "2"), 4)
+        self.conn.execute('INSERT INTO "X_allele" ("identifier", "locus_id") VALUES (?, ?)', ("-2_6", "STM0001"))
+        self.assertEqual(next_neg_allele(self.conn, "X", "STM0001", "2"), 5)
+        self.assertEqual(next_neg_allele(self.conn, "X", "STM0001", "2"), 7)
+
+        self.assertEqual(next_st(self.conn, "X", 2), 5)
+        self.conn.execute('INSERT INTO "X_ap2_0" ("st", "dst") VALUES (?, ?)', (6, 0))
+        self.assertEqual(next_st(self.conn, "X", 2), 7)
+        self.conn.execute('INSERT INTO "X_ap2_0" ("st", "dst") VALUES (?, ?)', (2, 3))
+        self.assertEqual(next_dst(self.conn, "X", 2, 2), 4)
+
+    def test_locus_allele_counters(self):
+        self.conn.execute('CREATE TABLE "X_locus" ("identifier" TEXT PRIMARY KEY)')
+        for locus in ["STM0001", "STM0002", "STM0003", "STM0004"]:
+            self.conn.execute('INSERT INTO "X_locus" VALUES (?)', (locus,))
+        self.conn.execute('INSERT INTO "X_allele" ("identifier", "locus_id") VALUES (?, ?)', ("3", "STM0002"))
+        self.conn.execute('INSERT INTO "X_allele" ("identifier", "locus_id") VALUES (?, ?)', ("-2_1", "STM0004"))
+        next_allele(self.conn, "X", "STM0001")
+        # only positive alleles count, -7_1 (STM0001) and -2_1 (STM0004) do not
+        self.assertEqual(locus_allele_counters(self.conn, "X"), {"STM0001": 6, "STM0002": 4, "STM0003": 1,
+                                                                 "STM0004": 1})
+        note_pos_allele(self.conn, "X", "STM0002", next_allele(self.conn, "X", "STM0002"))
+        note_pos_allele(self.conn, "X", "STM0003", 2)
+        self.assertEqual(locus_allele_counters(self.conn, "X"), {"STM0001": 6, "STM0002": 5, "STM0003": 3,
+                                                                 "STM0004": 1})
+        self.assertEqual(next_allele(self.conn, "X", "STM0004"), 3)
+
+    def test_read_only(self):
+        self.conn.execute('CREATE TABLE "X_locus" ("identifier" TEXT PRIMARY KEY)')
+        for locus in ["STM0001", "STM0002"]:
+            self.conn.execute('INSERT INTO "X_locus" VALUES (?)', (locus,))
+        self.assertEqual(next_allele(self.conn, "X", "STM0001", claim=False), 8)
+        self.assertEqual(next_st(self.conn, "X", 2, claim=False), 5)
+        self.assertEqual(locus_allele_counters(self.conn, "X", write=False), {"STM0001": 6, "STM0002": 1})
+        self.assertEqual(self.conn.execute("SELECT name FROM sqlite_master WHERE name = 'X_counters'").fetchall(), [])
+
+        next_st(self.conn, "X", 2)
+        self.assertEqual(next_allele(self.conn, "X", "STM0001", claim=False), 8)
+        self.assertEqual(locus_allele_counters(self.conn, "X", write=False), {"STM0001": 6, "STM0002": 1})
+        self.assertEqual(self.conn.execute('SELECT "kind" FROM "X_counters"').fetchall(), [("st",)])
+
+    def test_st_and_dst(self):
+        self.assertEqual(next_st(self.conn, "X", 2), 5)
+        self.assertEqual(next_st(self.conn, "X", 2), 6)
+        self.assertEqual(next_dst(self.conn, "X", 2, 2), 3)
+        self.assertEqual(next_dst(self.conn, "X", 2, 2), 4)
+        self.assertEqual(next_dst(self.conn, "X", 2, 4), 2)
+        self.assertEqual(next_dst(self.conn, "X", 2, 6), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
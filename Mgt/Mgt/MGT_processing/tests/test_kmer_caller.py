@@ -0,0 +1,95 @@
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.Reads2MGTAlleles.kmer_caller import KmerAlleleIndex, encode_kmers
+
+COMPLEMENT = {"A": "T", "C": "G", "G": "C", "T": "A"}
+
+
+def reference_kmers(seq, k):
+    """
+    per character canonical k-mer encoding to check encode_kmers against
+    """
+    out = []
+    for i in range(len(seq) - k + 1):
+        kmer = seq[i:i + k].upper()
+        if any(x not in COMPLEMENT for x in kmer):
+            continue
+        revcomp = "".join(COMPLEMENT[x] for x in reversed(kmer))
+        values = []
+        for s in (kmer, revcomp):
+            value = 0
+            for base in s:
+                value = value * 4 + "ACGT".index(base)
+            values.append(value)
+        out.append(min(values))
+    return out
+
+
+def random_seq(rand, length):
+    return "".join(rand.choice("ACGT") for _ in range(length))
+
+
+class TestEncodeKmers(unittest.TestCase):
+
+    def test_matches_reference(self):
+        rand = random.Random(5)
+        for k in (1, 5, 11, 16, 21, 31):
+            for length in (k - 1, k, k + 1, 97):
+                seq = "".join(rand.choice("ACGTacgtN") for _ in range(length))
+                self.assertEqual(encode_kmers(seq.encode(), k).tolist(), reference_kmers(seq, k),
+                                 "k={} {}".format(k, seq))
+
+    def test_reads_not_joined(self):
+        self.assertEqual(encode_kmers(b"ACGTAC" + b"N" + b"GGTTA", 5).tolist(),
+                         reference_kmers("ACGTAC", 5) + reference_kmers("GGTTA", 5))
+
+
+class TestKmerAlleleIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rand = random.Random(3)
+        self.k = 11
+        self.allele1 = random_seq(rand, 40)
+        self.allele2 = self.allele1[:30] + ("A" if self.allele1[30] != "A" else "C") + self.allele1[31:]
+        self.other = random_seq(rand, 40)
+        self.index = KmerAlleleIndex({"STM0001": {"1": self.allele1, "2": self.allele2},
+                                      "STM0002": {"1": self.other}}, k=self.k)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def count(self, reads):
+        fastq = path.join(self.dir, "reads.fastq")
+        with open(fastq, "w") as outf:
+            for i, read in enumerate(reads):
+                outf.write("@read{}\n{}\n+\n{}\n".format(i, read, "I" * len(read)))
+        self.index.count_reads([fastq], batch_size=3)
+
+    def test_exact_call(self):
+        self.count([self.allele1, self.allele1, self.other, self.other])
+        self.assertEqual(self.index.calls(2), ({"STM0001": "1", "STM0002": "1"}, []))
+        self.assertEqual(self.index.reads, 4)
+
+    def test_one_uncovered_kmer(self):
+        # the reads cover every k-mer of allele 1 but the one starting at position 10
+        self.count([self.allele1[:20], self.allele1[11:], self.other])
+        kmer = reference_kmers(self.allele1[10:10 + self.k], self.k)
+        self.assertNotIn(kmer[0], reference_kmers(self.allele1[:20], self.k) + reference_kmers(self.allele1[11:], self.k))
+        self.assertEqual(self.index.covered(1), {"STM0001": [], "STM0002": ["1"]})
+        self.assertEqual(self.index.calls(1), ({"STM0002": "1"}, ["STM0001"]))
+
+    def test_mixed_alleles_unresolved(self):
+        self.count([self.allele1, self.allele2])
+        self.assertEqual(self.index.calls(1), ({}, ["STM0001", "STM0002"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import gzip
+import os
+import sys
+import tempfile
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.Reads2MGTAlleles.kraken_screen import screen_verdict, subsample_read_pairs, wilson_interval
+
+
+def kraken_report(target, other, unclassified):
+    total = float(target + other + unclassified)
+    lines = [(unclassified, "U", "unclassified"), (target, "S", "    Xanthomonas citri"),
+             (other, "S", "    Escherichia coli")]
+    return "".join("{:.2f}\t{}\t0\t{}\t0\t{}\n".format(100 * n / total, n, level, name)
+                   for n, level, name in lines).encode()
+
+
+class TestScreenVerdict(unittest.TestCase):
+
+    def verdict(self, target, other, unclassified):
+        return screen_verdict(kraken_report(target, other, unclassified), "Xanthomonas citri",
+                              target + other + unclassified, 1.0)
+
+    def test_clear_pass(self):
+        self.assertEqual(self.verdict(190000, 5000, 5000)[0], "pass")
+
+    def test_low_target_escalated(self):
+        self.assertEqual(self.verdict(100, 100, 199800)[0], "borderline")
+        self.assertEqual(self.verdict(0, 100, 199900)[0], "borderline")
+
+    def test_no_target_contaminated(self):
+        self.assertEqual(self.verdict(0, 150000, 50000)[:2], ("contaminated", "Escherichia coli"))
+
+    def test_contaminated(self):
+        verdict, contaminant, line = self.verdict(150000, 30000, 20000)
+        self.assertEqual((verdict, contaminant), ("contaminated", "Escherichia coli"))
+        self.assertIn("200000 read pairs", line)
+
+    def test_borderline(self):
+        self.assertEqual(self.verdict(80, 9, 11)[0], "borderline")
+
+    def test_interval(self):
+        low, high = wilson_interval(0, 200000)
+        self.assertEqual(low, 0.0)
+        self.assertLess(high, 0.01)
+
+
+class TestSubsample(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fq = []
+        for end in (1, 2):
+            fq = path.join(self.dir, "reads_{}.fastq.gz".format(end))
+            with gzip.open(fq, "wt") as f:
+                for i in range(50):
+                    f.write("@read{}/{}\nACGT\n+\nIIII\n".format(i, end))
+            self.fq.append(fq)
+        self.out = [path.join(self.dir, "sub_1.fastq"), path.join(self.dir, "sub_2.fastq")]
+
+    def tearDown(self):
+        for f in os.listdir(self.dir):
+            os.remove(path.join(self.dir, f))
+        os.rmdir(self.dir)
+
+    def test_head(self):
+        self.assertEqual(subsample_read_pairs(self.fq[0], self.fq[1], self.out[0], self.out[1], 10), (10, False))
+        self.assertEqual(open(self.out[0]).read().splitlines()[-4], "@read9/1")
+
+    def test_random_keeps_pairs(self):
+        self.assertEqual(subsample_read_pairs(self.fq[0], self.fq[1], self.out[0], self.out[1], 10, "random"),
+                         (10, False))
+        names1 = [x.split("/")[0] for x in open(self.out[0]).read().splitlines()[::4]]
+        names2 = [x.split("/")[0] for x in open(self.out[1]).read().splitlines()[::4]]
+        self.assertEqual(names1, names2)
+
+    def test_complete(self):
+        self.assertEqual(subsample_read_pairs(self.fq[0], self.fq[1], self.out[0], self.out[1], 100), (50, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
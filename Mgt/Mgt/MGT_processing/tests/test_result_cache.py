@@ -0,0 +1,53 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.Reads2MGTAlleles import result_cache
+from MGT_processing.Reads2MGTAlleles.result_cache import ResultCache, get_result_cache
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = path.join(self.dir, "contigs.fa")
+        with open(self.src, "w") as outf:
+            outf.write(">1\n" + "A" * 1000 + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_put_get(self):
+        cache = ResultCache(path.join(self.dir, "cache"), 1 << 20)
+        key = cache.key("assembly", [self.src], {"refsize": 5})
+        self.assertIsNone(cache.get("assembly", key, {}))
+        cache.put("assembly", key, {"contigs.fa": self.src}, {"pass": True})
+        dest = path.join(self.dir, "restored.fa")
+        self.assertTrue(cache.get("assembly", key, {"contigs.fa": dest})["pass"])
+        self.assertEqual(open(dest).read(), open(self.src).read())
+        self.assertNotEqual(cache.key("assembly", [self.src], {"refsize": 6}), key)
+
+    def test_evicts_least_recently_used(self):
+        cache = ResultCache(path.join(self.dir, "cache"), 2500)
+        for i in range(3):
+            cache.put("qc", "k{}".format(i), {"contigs.fa": self.src})
+            os.utime(path.join(cache.cachedir, "qc", "k{}".format(i), "meta.json"), (i, i))
+        self.assertEqual(sorted(os.listdir(path.join(cache.cachedir, "qc"))), ["k1", "k2"])
+        self.assertLessEqual(cache.size, 2500)
+
+    def test_default_under_outpath(self):
+        result_cache._caches.clear()
+        args = argparse.Namespace(no_cache=False, cachedir=None, outpath=self.dir + "/", cache_size=1)
+        self.assertEqual(get_result_cache(args).cachedir, path.join(self.dir, "result_cache"))
+        args.no_cache = True
+        self.assertIsNone(get_result_cache(args))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import random
+import sys
+import unittest
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from MGT_processing.Reads2MGTAlleles.snp_mask import mask_high_snp_regions
+
+
+def list_mask_high_snp_regions(locus, recon_locus, ref_locus, window_size, snp_limit):
+    """
+    previous pure python implementation, kept as the reference for equivalence tests
+    """
+    if len(recon_locus) != len(ref_locus):
+        return recon_locus
+
+    halfwindow = int(window_size / 2)
+    mutpos = []
+    outlocus = list(str(recon_locus))
+    for pos in range(len(recon_locus)):
+        if recon_locus[pos] != ref_locus[pos] and recon_locus[pos] not in ["N", "-"] and ref_locus[pos] not in ["N","-"]:
+            mutpos.append("X")
+        else:
+            mutpos.append("M")
+
+    for x in range(halfwindow, len(ref_locus) - halfwindow):
+        window = mutpos[x - halfwindow:x + halfwindow]
+        if window.count("X") > int(snp_limit):
+            for pos in range(x - halfwindow, x + halfwindow):
+                outlocus[pos] = "N"
+    outlocus = "".join(outlocus)
+
+    return outlocus
+
+
+def mutate(seq, rate, rng, alphabet="ACGTN-"):
+    return "".join(rng.choice(alphabet) if rng.random() < rate else base for base in seq)
+
+
+class TestMaskHighSnpRegions(unittest.TestCase):
+
+    def assertSameMask(self, recon, ref, window_size, snp_limit):
+        self.assertEqual(mask_high_snp_regions("locus", recon, ref, window_size, snp_limit),
+                         list_mask_high_snp_regions("locus", recon, ref, window_size, snp_limit))
+
+    def test_random_loci(self):
+        rng = random.Random(1)
+        for _ in range(300):
+            ref = "".join(rng.choice("ACGT") for _ in range(rng.randint(1, 600)))
+            recon = mutate(ref, rng.choice([0.0, 0.01, 0.05, 0.2, 0.6]), rng)
+            self.assertSameMask(recon, ref, rng.choice([0, 1, 2, 5, 10, 40, 41]), rng.choice([0, 1, 4, 16]))
+
+    def test_snp_cluster_masked(self):
+        ref = "A" * 100
+        recon = "A" * 40 + "CCCCC" + "A" * 55
+        masked = mask_high_snp_regions("locus", recon, ref, 10, 4)
+        self.assertIn("N", masked)
+        self.assertEqual(len(masked), len(ref))
+        self.assertSameMask(recon, ref, 10, 4)
+
+    def test_ns_and_gaps_are_not_snps(self):
+        ref = "ACGT" * 25
+        recon = ref[:30] + "NNNN--NN" + ref[38:]
+        self.assertEqual(mask_high_snp_regions("locus", recon, ref, 10, 1), recon)
+        self.assertSameMask(recon, ref, 10, 1)
+
+    def test_window_longer_than_locus(self):
+        ref = "ACGTACGT"
+        recon = "TTTTTTTT"
+        self.assertEqual(mask_high_snp_regions("locus", recon, ref, 40, 0), recon)
+        self.assertSameMask(recon, ref, 40, 0)
+
+    def test_string_limit(self):
+        ref = "A" * 60
+        recon = "A" * 20 + "CCCCCC" + "A" * 34
+        self.assertSameMask(recon, ref, 10, "4")
+
+    def test_length_mismatch_returned_unchanged(self):
+        self.assertEqual(mask_high_snp_regions("locus", "ACGTT", "ACGT", 2, 0), "ACGTT")
+
+
+if __name__ == '__main__':
+    unittest.main()
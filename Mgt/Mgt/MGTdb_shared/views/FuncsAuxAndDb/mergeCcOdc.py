@@ -1,4 +1,6 @@
 from . import getPoolOfCcMergeIds, rawQueries
+from django.db import connections
+from MGT_processing.MgtAllele2Db import cc_merges
 from time import sleep as sl
 from collections import OrderedDict
 import time
@@ -17,46 +19,11 @@ def get_merge_dict(list_colsInfo, org):
         # for each cc get all cc and ccmerge columns
         if colname.startswith("cc") and "merge" not in colname and colname != "cc2_1":
 
-            querystring = f"""SELECT "identifier","merge_id_id" FROM "{org}_{colname}"; """
-
-            (data, columns) = rawQueries.executeQuery_table(querystring, org)
-
-            # for each pair with a mergecc add to list of lists of merges
-            # if one of a pair is already in a list add the other in the pair
-            # if neither are in a merge list add new merge list with those two
-            # merges list is a list of lists were each list is a set of ccs to be merged
-            merges = []
-            for pair in data:
-                cc = pair[0]
-                mergecc = pair[1]
-                if mergecc:
-                    nmerges = []
-                    inexist = False
-                    for existmerges in merges:
-                        newmergels = list(existmerges)
-                        if cc in existmerges and mergecc not in existmerges:
-                            newmergels.append(mergecc)
-                            nmerges.append(newmergels)
-                            inexist = True
-                        elif cc not in existmerges and mergecc in existmerges:
-                            newmergels.append(cc)
-                            nmerges.append(newmergels)
-                            inexist = True
-                        elif cc in existmerges and mergecc in existmerges:
-                            inexist = True
-                        else:
-                            nmerges.append(newmergels)
-                    if not inexist:
-                        nmerges.append([cc, mergecc])
-                    merges = list(nmerges)
-
-            # ccminmerge is a dict where each value is the lowest cc in a merge list and each key is a cc that will
-            # merge to it
-            cc_minmerge = {}
-            for mergels in merges:
-                mincc = min(mergels)
-                for cc in mergels:
-                    cc_minmerge[cc] = mincc
+            # cc_minmerge is a dict where each key is a cc that is part of a merge and each value is the lowest cc
+            # of its merge group (from the canonical_id column, or union-find over the merge_id links)
+            cursor = connections[f'{org.lower()}'].cursor()
+            cc_minmerge = cc_merges.merge_dict(cursor, f"{org}_{colname}")
+            cursor.close()
 
             # each cc table has its own minmerge dictionary
             merge_dicts[colname] = cc_minmerge
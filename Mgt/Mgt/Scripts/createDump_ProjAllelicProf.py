@@ -10,6 +10,9 @@ import re
 import glob
 # import shutil
 # from subprocess import Popen, PIPE, STDOUT
+
+PROFILE_HASH_COL = "profile_hash"  # allele profile hash column of ap<lev>_0 tables (UpdateScripts/addAllelicProfiles.py), not a locus
+
 ##################################################### TOP_LVL
 def createTheDump(mgtPath, settingModuleName, queryNumLimit):
 
@@ -242,7 +245,7 @@ def setupColumnsInMgt9Tables(tns_mgt9, appClass):
             if re.match('^id$', fieldName) or re.match('^main_id$', fieldName):
                 # dict_idCols[tn['table_name']] = idColNum
                 dict_colsToKeep[tn['table_name']].append(fieldName)
-            elif re.match('^cc[0-9]+\_[0-9]+\_id$', fieldName) or re.match('^date\_', fieldName):
+            elif re.match('^cc[0-9]+\_[0-9]+\_id$', fieldName) or re.match('^date\_', fieldName) or fieldName == PROFILE_HASH_COL:
                 # dict_numCols[tn['table_name']] = dict_numCols[tn['table_name']]  - 1
                 pass
             else:
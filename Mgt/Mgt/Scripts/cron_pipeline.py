@@ -1169,23 +1169,26 @@ def runAllele2Db(args,conn,alleleslocation):
         # command += "source ~/.bashrc\n"
         # command += "source ~/.zshrc\n"
         command += "conda activate {conda_env}\n".format(conda_env = args.condaenv)
+        # one Allele_to_mgt_db.py run assigns every isolate in order (set up and caches loaded once)
+        manifest = alleles_tmp + "/" + uid + "_manifest.txt"
+        manifestout = open(manifest, "w")
         for f in alleles:
             ident = all2id[f]
             fullpath = uploadlocation + f
             if not os.path.exists(fullpath):
                 print(f"Strain id {ident} allele file not present at {fullpath}")
             else:
-                command += """python {scriptpath} {allelesfile} {appname} -s {settings} --apzerolim {apzero} -c -t none --threads {threads} --project {mgtproj} --local --timing --id {ident}{nested}{query}\n""".format(allelesfile=fullpath,
-                                                                                                                                                        scriptpath=al2dbpath,
-                                                                                                                                                        appname=args.appname,
-                                                                                                                                                        tmp=args.tmpfolder,
-                                                                                                                                                        mgtproj=args.dbproject,
-                                                                                                                                                        settings=args.settings,
-                                                                                                                                                        apzero=args.apzero,
-                                                                                                                                                        ident=ident,
-                                                                                                                                                        nested=nestedcall,
-                                                                                                                                                        query=q,
-                                                                                                                                                        threads=args.threads)
+                manifestout.write("{}\t{}\n".format(fullpath, ident))
+        manifestout.close()
+        command += """python {scriptpath} {manifest} {appname} -s {settings} --manifest --apzerolim {apzero} -c -t none --threads {threads} --project {mgtproj} --local --timing{nested}{query}\n""".format(manifest=manifest,
+                                                                                                                                                    scriptpath=al2dbpath,
+                                                                                                                                                    appname=args.appname,
+                                                                                                                                                    mgtproj=args.dbproject,
+                                                                                                                                                    settings=args.settings,
+                                                                                                                                                    apzero=args.apzero,
+                                                                                                                                                    nested=nestedcall,
+                                                                                                                                                    query=q,
+                                                                                                                                                    threads=args.threads)
         command += '"'
         subprocess.run(command, shell=True)
         # with subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as sp:
@@ -1229,7 +1232,7 @@ cd {tmp}
     
 source /srv/scratch/lanlab/michael/miniconda_newkatana/bin/activate mgtdbpaper
     
-for allelesfile in {allelesfolder}/*.fasta; do python {scriptpath} $allelesfile {appname} -s {settings} --timing --apzerolim {apzero} -c -t none --threads {threads} --project {mgtproj} --timing{subset}{nested}{query}; done
+python {scriptpath} {allelesfolder}/*.fasta {appname} -s {settings} --timing --apzerolim {apzero} -c -t none --threads {threads} --project {mgtproj} --timing{subset}{nested}{query}
 rm -r {allelesfolder}
 """.format(allelesfolder=alleles_tmp,
                                                                                                                                                                             scriptpath=al2dbpath,
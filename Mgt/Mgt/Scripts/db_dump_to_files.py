@@ -17,6 +17,10 @@ import importlib.util
 6 - all mgt assignments (Username Project   Isolatename AssignmentStatus    MGT2    MGT3    MGT4    MGT5    MGT6    MGT7    MGT8    MGT9) - only public
 """
 
+# allele profile table columns that are not loci (as in get_table_nos of Allele_to_mgt_db.py), together with cc
+# columns and other *id columns. profile_hash is the allele profile hash column (UpdateScripts/addAllelicProfiles.py)
+NON_LOCUS_COLS = ["st", "dst", "id", "main_id", "date_created", "date_modified", "profile_hash"]
+
 def get_conn(args):
     database = settings.APPS_DATABASE_MAPPING[args.appname]
 
@@ -73,38 +77,31 @@ def get_ap(args,conn,apidlist,ap_tables,maxlevel):
     apidlist = list(map(str,apidlist))
     #### TODO the below "X" in table is the largest scheme number
     for table in ap_tables:
-        if maxlevel in table:
-            last = -6
-        else:
-            last = -3
-        # print(table)
+        # loci selected by name so extra columns (i.e. profile_hash, cc columns) are never read as loci
         loci_query = """
-        SELECT *
+        SELECT "column_name"
         FROM
         information_schema.columns
         WHERE
         table_name = '{}_{}'
+        ORDER BY "ordinal_position"
         """.format(args.appname,table)
-        locils = sqlquery_to_outls(conn,loci_query)
-        locils = [x[3] for x in locils]
-        if 'dst' in locils:
-            loci = locils[3:last]
-        else:
-            loci = locils[1:-2]
+        locils = [x[0] for x in sqlquery_to_outls(conn,loci_query)]
+        loci = [x for x in locils if x not in NON_LOCUS_COLS and not x.startswith("cc") and not x.endswith("id")]
         # print(loci[0],loci[-1])
 
         locusnames += loci
         if "_0" in table:
             allele_query = """
-                    SELECT *
+                    SELECT "id","{3}"
                     FROM
                     "{0}_{1}"
                     WHERE "id" in ('{2}');
-                    """.format(args.appname, table,"','".join(apidlist))
+                    """.format(args.appname, table,"','".join(apidlist),'","'.join(loci))
 
             allelels = sqlquery_to_outls(conn, allele_query)
             for res in allelels:
-                res_ap = res[3:last]
+                res_ap = res[1:]
                 resid = res[0]
                 aplisdict[resid] = list(res_ap)
 
@@ -113,15 +110,15 @@ def get_ap(args,conn,apidlist,ap_tables,maxlevel):
             # aplis += alleles
         else:
             allele_query = """
-                                SELECT *
+                                SELECT "main_id","{3}"
                                 FROM
                                 "{0}_{1}"
                                 WHERE "main_id" in ('{2}');
-                                """.format(args.appname, table, "','".join(apidlist))
+                                """.format(args.appname, table, "','".join(apidlist),'","'.join(loci))
 
             allelels = sqlquery_to_outls(conn, allele_query)
             for res in allelels:
-                res_ap = list(res[1:-2])
+                res_ap = list(res[1:])
                 resid = res[0]
                 aplisdict[resid]+=res_ap
 
@@ -148,6 +148,7 @@ def createTableCode(appClass, schObj, tabNum, tableName, table_0_name):
 	if tableName == table_0_name :
 		list_code.append("\t" + "st = models.IntegerField()")
 		list_code.append("\t" + "dst = models.IntegerField()")
+		list_code.append("\t" + "profile_hash = models.CharField(max_length=32, blank=True, null=True, db_index=True)")
 		# list_code.append("\t" + "clonal_complex = models.ForeignKey(Clonal_complex, on_delete=models.PROTECT, blank=True, null=True)")
 
 		# list_code.append("\t" + "scheme = models.ForeignKey(Scheme, on_delete=models.PROTECT)")
@@ -76,6 +76,7 @@ def printTableCode(tableName):
 	print ("class " + tableName + "(models.Model):")
 	print ("\t" + "identifier = models.IntegerField(primary_key=True)")
 	print ("\t" + "merge_id = models.ForeignKey('self', on_delete=models.PROTECT, blank=True, null=True)")
+	print ("\t" + "canonical_id = models.IntegerField(blank=True, null=True, db_index=True)")
 	print ("\t" + "merge_timestamp = models.DateTimeField(auto_now=True)")
 	print ("\t" + "date_created = models.DateTimeField(auto_now_add=True)")
 	print ("\t" + "date_modified = models.DateTimeField(auto_now=True)")
@@ -10,13 +10,17 @@ runs the pipeline for each sample. Input files are expected to exist
 on the host filesystem; the wrapper will detect and mount their parent
 directories automatically.
 
-Outputs are written into --out_dir.
+Outputs are written into --out_dir, with one log file per sample in
+--out_dir/logs. Samples that already have an _alleles.fasta in --out_dir
+are skipped (use --force to re-run them). With --jobs N, up to N samples
+run at once and the --threads/--memory budgets are split between them.
 
 Example:
   ./scripts/extract_alleles.py \
       --source_dir /path/to/my/files \
       --out_dir /path/to/upload_later \
-      --species_key Xcitri
+      --species_key Xcitri \
+      --jobs 8 --threads 64 --memory 256
 """
 
 import argparse
@@ -30,6 +34,8 @@ import ast
 import json
 from pathlib import Path
 import importlib.util
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 REPO_BASE = Path(__file__).resolve().parents[1]
@@ -85,9 +91,17 @@ def read_details(path: Path):
 def ensure_paths():
     ALLELES_DIR.mkdir(parents=True, exist_ok=True)
 
+def alleles_output(out_dir: Path, strainid: str) -> Path:
+    return Path(out_dir) / strainid / f"{strainid}_alleles.fasta"
+
+def split_budget(total: int, jobs: int) -> int:
+    """Share of a --threads/--memory budget for each of `jobs` concurrent samples (at least 1)."""
+    return max(1, int(total) // max(1, jobs))
+
 def run_wrapper(strainid, intype, input_paths, o_arg, cutoffs,
                 threads, memory, kraken_db, force, pathovar_key, refalleles, dry_run,
-                min_largest_contig, max_contig_no, genome_min, genome_max, n50_min, hspident, locusnlimit, snpwindow, densitylim, refsize, blastident):
+                min_largest_contig, max_contig_no, genome_min, genome_max, n50_min, hspident, locusnlimit, snpwindow, densitylim, refsize, blastident,
+                log_path=None):
     i_arg = ",".join(str(p) for p in input_paths)
     cmd = [
         str(WRAPPER),
@@ -166,7 +180,63 @@ def run_wrapper(strainid, intype, input_paths, o_arg, cutoffs,
     print("[RUN]", " ".join(cmd))
     if dry_run:
         return 0
-    return subprocess.run(cmd, cwd=REPO_BASE).returncode
+    if log_path is None:
+        return subprocess.run(cmd, cwd=REPO_BASE).returncode
+    with open(log_path, "w", encoding="utf-8") as log:
+        log.write("[RUN] " + " ".join(cmd) + "\n")
+        log.flush()
+        return subprocess.run(cmd, cwd=REPO_BASE, stdout=log, stderr=subprocess.STDOUT).returncode
+
+def process_sample(strainid, file_list, args, cutoffs, threads, memory, log_dir: Path):
+    """
+    Run one sample through the wrapper.
+    Returns (strainid, status, elapsed seconds, message) where status is ok, skipped or failed.
+    """
+    start = time.time()
+    if not args.force and alleles_output(args.out_dir, strainid).exists():
+        return strainid, "skipped", 0.0, f"{alleles_output(args.out_dir, strainid)} exists"
+    log_path = log_dir / f"{strainid}.log"
+    try:
+        src_files = []
+        for f in file_list:
+            p = Path(f)
+            if not p.is_absolute():
+                p = args.source_dir / f
+            if not p.exists():
+                raise FileNotFoundError(f"Input not found: {p}")
+            src_files.append(p.resolve())
+
+        intype = infer_intype(src_files)
+        if intype == "reads" and len(src_files) != 2:
+            raise ValueError(f"Reads input requires 2 files, got {len(src_files)}")
+
+        rc = run_wrapper(strainid, intype, src_files, args.out_dir, cutoffs,
+                         threads, memory, args.kraken_db,
+                         args.force, args.pathovar_key, args.refalleles, args.dry_run,
+                         args.min_largest_contig, args.max_contig_no, args.genome_min, args.genome_max, args.n50_min, args.hspident, args.locusnlimit, args.snpwindow, args.densitylim, args.refsize, args.blastident,
+                         log_path=log_path)
+        if rc != 0:
+            raise RuntimeError(f"reads_to_alleles failed (exit {rc}), see {log_path}")
+
+    except Exception as e:
+        return strainid, "failed", time.time() - start, str(e)
+
+    return strainid, "ok", time.time() - start, str(log_path)
+
+def print_summary(results, wall):
+    done = [r for r in results if r[1] == "ok"]
+    skipped = [r for r in results if r[1] == "skipped"]
+    failed = [r for r in results if r[1] == "failed"]
+    print("\n=== Summary ===")
+    print(f"Samples: {len(results)}  ok: {len(done)}  skipped: {len(skipped)}  failed: {len(failed)}")
+    print(f"Wall time: {wall:.1f} s")
+    if done:
+        mean = sum(r[2] for r in done) / len(done)
+        print(f"Mean time per sample: {mean:.1f} s")
+        if wall > 0:
+            print(f"Throughput: {len(done) / wall * 3600:.1f} samples/hour")
+    for strainid, _, _, msg in failed:
+        print(f"[ERROR] {strainid}: {msg}")
 
 def main():
     ap = argparse.ArgumentParser(
@@ -178,8 +248,12 @@ def main():
                     help="Directory containing the files referenced in details_file")
     ap.add_argument("--out_dir", type=Path, required=True,
                     help="Output directory for allele files")
-    ap.add_argument("--threads", type=int, default=4)
-    ap.add_argument("--memory", type=int, default=8)
+    ap.add_argument("--threads", type=int, default=4,
+                    help="Total threads, split evenly between concurrent samples")
+    ap.add_argument("--memory", type=int, default=8,
+                    help="Total memory in GB, split evenly between concurrent samples")
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="Number of samples to run at once")
     ap.add_argument("--kraken_db", default=None)
     ap.add_argument("--pathovar_key", default=PATHOVAR_KEY, help=f"Text file translating MLST result to phylogenetic-associated pathovar.")
     ap.add_argument("--refalleles", default=REF_ALLELES, help=f"File path to MGT reference allele file.")
@@ -216,41 +290,42 @@ def main():
     ap.add_argument("--blastident",
                         help="BLAST percentage identity needed for hsp to be returned",
                         type=int)
-    ap.add_argument("--force", action="store_true")
+    ap.add_argument("--force", action="store_true",
+                    help="Re-run samples that already have an _alleles.fasta in --out_dir and overwrite their outputs")
     ap.add_argument("--dry_run", action="store_true")
     args = ap.parse_args()
 
     ensure_paths()
     cutoffs = load_species_cutoffs_json(SPECIES_JSON, "Xcitri")
 
-    failures = 0
-    for strainid, file_list in read_details(args.details_file):
-        print(f"\n=== Sample: {strainid} ===")
-        try:
-            src_files = []
-            for f in file_list:
-                p = Path(f)
-                if not p.is_absolute():
-                    p = args.source_dir / f
-                if not p.exists():
-                    raise FileNotFoundError(f"Input not found: {p}")
-                src_files.append(p.resolve())
+    log_dir = args.out_dir / "logs"
+    log_dir.mkdir(parents=True, exist_ok=True)
 
-            intype = infer_intype(src_files)
-            if intype == "reads" and len(src_files) != 2:
-                raise ValueError(f"Reads input requires 2 files, got {len(src_files)}")
+    jobs = max(1, args.jobs)
+    threads = split_budget(args.threads, jobs)
+    memory = split_budget(args.memory, jobs)
+    if jobs > 1:
+        print(f"Running {jobs} samples at once with {threads} threads and {memory} GB each")
 
-            rc = run_wrapper(strainid, intype, src_files, args.out_dir, cutoffs,
-                             args.threads, args.memory, args.kraken_db,
-                             args.force, args.pathovar_key, args.refalleles, args.dry_run, 
-                             args.min_largest_contig, args.max_contig_no, args.genome_min, args.genome_max, args.n50_min, args.hspident, args.locusnlimit, args.snpwindow, args.densitylim, args.refsize, args.blastident)
-            if rc != 0:
-                raise RuntimeError(f"reads_to_alleles failed (exit {rc})")
+    samples = list(read_details(args.details_file))
+    results = []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(process_sample, strainid, file_list, args, cutoffs, threads, memory, log_dir)
+                   for strainid, file_list in samples]
+        for fut in as_completed(futures):
+            strainid, status, elapsed, msg = fut.result()
+            results.append((strainid, status, elapsed, msg))
+            if status == "ok":
+                print(f"=== Sample: {strainid} done in {elapsed:.1f} s ({len(results)}/{len(samples)}) ===")
+            elif status == "skipped":
+                print(f"=== Sample: {strainid} skipped, {msg} ===")
+            else:
+                print(f"[ERROR] {strainid}: {msg}")
 
-        except Exception as e:
-            failures += 1
-            print(f"[ERROR] {strainid}: {e}")
+    print_summary(results, time.time() - start)
 
+    failures = len([r for r in results if r[1] == "failed"])
     if failures:
         print(f"\nDone with {failures} failure(s).")
     else:
@@ -7,7 +7,7 @@ from pathlib import Path
 
 # Flags that take a single path value right after them
 _SINGLE_PATH_FLAGS = {
-    "--refalleles", "-o", "--outpath", "--kraken_db", "--tmpdir", "--pathovar",
+    "--refalleles", "-o", "--outpath", "--kraken_db", "--tmpdir", "--pathovar", "--mlst_scheme",
 }
 # Flags whose value may be comma-separated list of paths
 _COMMA_PATH_FLAGS = {"-i", "--input"}